@@ -0,0 +1,180 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import multiprocessing
+import queue
+
+import torch
+from diffusers import AutoencoderKL, DDIMScheduler
+from omegaconf import OmegaConf
+
+from eval.eval_sync_conf import syncnet_eval
+from eval.syncnet import SyncNetEval
+from eval.syncnet_detect import SyncNetDetector
+from latentsync.models.unet import UNet3DConditionModel
+from latentsync.pipelines.lipsync_pipeline import LipsyncPipeline
+from latentsync.whisper.audio2feature import Audio2Feature
+from preprocess.extract_audio_embeds import whisper_model_path
+
+
+def validation_kwargs(config) -> dict:
+    """Arguments of the LipsyncPipeline call that renders the validation video of a UNet training run."""
+    distill_config = config.get("distill", None)
+    distill = distill_config is not None and distill_config.enabled
+    return dict(
+        num_frames=config.data.num_frames,
+        num_inference_steps=distill_config.student_steps if distill else config.run.inference_steps,
+        guidance_scale=config.run.guidance_scale,
+        weight_dtype=torch.float16,
+        width=config.data.resolution,
+        height=config.data.resolution,
+        mask=config.data.mask,
+        mask_image_path=config.data.mask_image_path,
+        distilled=distill,
+    )
+
+
+def build_validation_models(config, device):
+    vae = AutoencoderKL.from_pretrained("stabilityai/sd-vae-ft-mse", torch_dtype=torch.float16)
+    vae.config.scaling_factor = 0.18215
+    vae.config.shift_factor = 0
+    vae.requires_grad_(False)
+
+    audio_encoder = Audio2Feature(
+        model_path=whisper_model_path(config.model.cross_attention_dim),
+        device=device,
+        audio_embeds_cache_dir=config.data.audio_embeds_cache_dir,
+        num_frames=config.data.num_frames,
+        audio_feat_length=config.data.audio_feat_length,
+    )
+
+    # Inference only, the weights of every checkpoint are cast to float16 when loaded
+    denoising_unet, _ = UNet3DConditionModel.from_pretrained(
+        OmegaConf.to_container(config.model), config.ckpt.resume_ckpt_path, device=device, dtype=torch.float16
+    )
+    denoising_unet.requires_grad_(False)
+
+    pipeline = LipsyncPipeline(
+        vae=vae,
+        audio_encoder=audio_encoder,
+        denoising_unet=denoising_unet,
+        scheduler=DDIMScheduler.from_pretrained("configs"),
+    ).to(device)
+    pipeline.set_progress_bar_config(disable=True)
+
+    syncnet_eval_model = SyncNetEval(device=device)
+    syncnet_eval_model.loadParameters("checkpoints/auxiliary/syncnet_v2.model")
+    syncnet_detector = SyncNetDetector(device=device, detect_results_dir="detect_results")
+    return pipeline, syncnet_eval_model, syncnet_detector
+
+
+def validation_worker(config_dict: dict, device: str, requests, results):
+    """Validate the checkpoints sent through `requests` until it yields None, one result in `results` for each."""
+    config = OmegaConf.create(config_dict)
+    device = torch.device(device)
+    if device.type == "cuda":
+        torch.cuda.set_device(device)
+    pipeline, syncnet_eval_model, syncnet_detector = build_validation_models(config, device)
+
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        result = {"step": request["step"], "video_path": request["video_out_path"]}
+        try:
+            ckpt = torch.load(request["ckpt_path"], map_location=device, weights_only=True)
+            # Same config as the training UNet, a missing or unexpected key means the checkpoint is not of this run
+            pipeline.denoising_unet.load_state_dict(ckpt["state_dict"])
+            del ckpt
+            with torch.autocast(device_type="cuda", dtype=torch.float16):
+                pipeline(
+                    config.data.val_video_path,
+                    config.data.val_audio_path,
+                    request["video_out_path"],
+                    request["video_mask_path"],
+                    **validation_kwargs(config),
+                )
+            if config.model.add_audio_layer:
+                result["av_offset"], result["sync_conf"] = syncnet_eval(
+                    syncnet_eval_model, syncnet_detector, request["video_out_path"]
+                )
+        except Exception as e:
+            result["error"] = f"{type(e).__name__} - {e}"
+        torch.cuda.empty_cache()
+        results.put(result)
+
+
+class AsyncValidator:
+    """Validate the checkpoints of a UNet training run in a separate process, while the training goes on.
+
+    The process loads its own VAE, Whisper, UNet and SyncNet evaluation models on `device` once, then renders the
+    validation video of every checkpoint passed to `submit` and measures its SyncNet confidence. `poll` returns the
+    results that have come back since the last call. At most `max_pending` checkpoints wait or run at a time, `submit`
+    skips the others so a slow validation never queues up behind the training. It also returns False once the process
+    has died, `is_alive` tells the two cases apart.
+    """
+
+    def __init__(self, config, device, max_pending: int = 2):
+        context = multiprocessing.get_context("spawn")  # CUDA cannot be used in a forked process
+        self.requests = context.Queue()
+        self.results = context.Queue()
+        self.max_pending = max_pending
+        self.num_pending = 0
+        self.process = context.Process(
+            target=validation_worker,
+            args=(OmegaConf.to_container(config, resolve=True), str(device), self.requests, self.results),
+            daemon=True,
+        )
+        self.process.start()
+
+    def is_alive(self) -> bool:
+        return self.process.is_alive()
+
+    def submit(self, step: int, ckpt_path: str, video_out_path: str, video_mask_path: str) -> bool:
+        if self.num_pending >= self.max_pending or not self.is_alive():
+            return False
+        self.requests.put(
+            {
+                "step": step,
+                "ckpt_path": ckpt_path,
+                "video_out_path": video_out_path,
+                "video_mask_path": video_mask_path,
+            }
+        )
+        self.num_pending += 1
+        return True
+
+    def poll(self) -> list:
+        results = []
+        while True:
+            try:
+                results.append(self.results.get_nowait())
+            except queue.Empty:
+                break
+        self.num_pending -= len(results)
+        return results
+
+    def close(self) -> list:
+        """Wait for the pending validations, stop the process and return their results."""
+        self.requests.put(None)
+        results = []
+        while self.num_pending > 0:
+            try:
+                results.append(self.results.get(timeout=10))
+                self.num_pending -= 1
+            except queue.Empty:
+                if not self.process.is_alive():
+                    break
+        self.process.join()
+        return results
@@ -0,0 +1,122 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Sweep schedulers x inference steps on a fixed clip and report wall time and SyncNet confidence.
+
+The models are loaded once, only the scheduler is swapped between runs, so the timings compare the denoising
+loops and not the model loading. Every run uses the same seed. Results are appended as JSON lines.
+
+    python -m eval.benchmark_schedulers --inference_ckpt_path checkpoints/latentsync_unet.pt \\
+        --video_path assets/demo1_video.mp4 --audio_path assets/demo1_audio.wav \\
+        --schedulers ddim dpm_solver++ unipc --steps 20 10 8 6
+"""
+
+import argparse
+import json
+import os
+import time
+
+import torch
+from accelerate.utils import set_seed
+from omegaconf import OmegaConf
+
+from eval.eval_sync_conf import syncnet_eval
+from eval.syncnet import SyncNetEval
+from eval.syncnet_detect import SyncNetDetector
+from latentsync.utils.scheduler import SCHEDULERS, build_scheduler
+from scripts.inference import load_pipeline
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--unet_config_path", type=str, default="configs/unet/stage2.yaml")
+    parser.add_argument("--inference_ckpt_path", type=str, required=True)
+    parser.add_argument("--video_path", type=str, required=True)
+    parser.add_argument("--audio_path", type=str, required=True)
+    parser.add_argument("--output_dir", type=str, default="benchmark_schedulers")
+    parser.add_argument("--schedulers", type=str, nargs="+", default=list(SCHEDULERS), choices=list(SCHEDULERS))
+    parser.add_argument("--steps", type=int, nargs="+", default=[20, 10, 8, 6])
+    parser.add_argument("--guidance_scale", type=float, default=1.5)
+    parser.add_argument("--seed", type=int, default=1247)
+    parser.add_argument("--device", type=str, default="auto")
+    parser.add_argument("--syncnet_ckpt_path", type=str, default="checkpoints/auxiliary/syncnet_v2.model")
+    parser.add_argument("--results_path", type=str, default=None, help="Defaults to <output_dir>/results.jsonl")
+    args = parser.parse_args()
+
+    config = OmegaConf.load(args.unet_config_path)
+    os.makedirs(args.output_dir, exist_ok=True)
+    results_path = args.results_path or os.path.join(args.output_dir, "results.jsonl")
+
+    args.scheduler = "ddim"
+    pipeline, policy = load_pipeline(config, args)
+    base_config = pipeline.scheduler.config
+
+    syncnet = SyncNetEval(device=policy.device.type)
+    syncnet.loadParameters(args.syncnet_ckpt_path)
+    detect_results_dir = os.path.join(args.output_dir, "detect_results")
+    syncnet_detector = SyncNetDetector(device=policy.device.type, detect_results_dir=detect_results_dir)
+
+    for scheduler_name in args.schedulers:
+        pipeline.scheduler = build_scheduler(scheduler_name, base_config)
+        for num_inference_steps in args.steps:
+            video_out_path = os.path.join(args.output_dir, f"{scheduler_name}_{num_inference_steps}.mp4")
+            set_seed(args.seed)
+
+            if policy.device.type == "cuda":
+                torch.cuda.synchronize(policy.device)
+            start = time.perf_counter()
+            pipeline(
+                video_path=args.video_path,
+                audio_path=args.audio_path,
+                video_out_path=video_out_path,
+                video_mask_path=video_out_path.replace(".mp4", "_mask.mp4"),
+                num_frames=config.data.num_frames,
+                num_inference_steps=num_inference_steps,
+                guidance_scale=args.guidance_scale,
+                weight_dtype=policy.unet_dtype,
+                width=config.data.resolution,
+                height=config.data.resolution,
+                mask_image_path=config.data.mask_image_path,
+            )
+            if policy.device.type == "cuda":
+                torch.cuda.synchronize(policy.device)
+            seconds = time.perf_counter() - start
+
+            try:
+                av_offset, sync_conf = syncnet_eval(
+                    syncnet,
+                    syncnet_detector,
+                    video_out_path,
+                    os.path.join(args.output_dir, "temp"),
+                    detect_results_dir=detect_results_dir,
+                )
+            except Exception as e:
+                print(e)
+                av_offset, sync_conf = None, None
+
+            result = {
+                "scheduler": scheduler_name,
+                "inference_steps": num_inference_steps,
+                "seconds": round(seconds, 3),
+                "sync_conf": sync_conf,
+                "av_offset": av_offset,
+                "video_out_path": video_out_path,
+            }
+            print(json.dumps(result))
+            with open(results_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
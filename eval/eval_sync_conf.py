@@ -14,6 +14,7 @@
 
 import argparse
 import os
+import tempfile
 import tqdm
 from statistics import fmean
 from eval.syncnet import SyncNetEval
@@ -22,19 +23,27 @@ from latentsync.utils.util import red_text
 import torch
 
 
-def syncnet_eval(syncnet, syncnet_detector, video_path, temp_dir, detect_results_dir="detect_results"):
-    syncnet_detector(video_path=video_path, min_track=50)
-    crop_videos = os.listdir(os.path.join(detect_results_dir, "crop"))
-    if crop_videos == []:
-        raise Exception(red_text(f"Face not detected in {video_path}"))
-    av_offset_list = []
-    conf_list = []
-    for video in crop_videos:
-        av_offset, _, conf = syncnet.evaluate(
-            video_path=os.path.join(detect_results_dir, "crop", video), temp_dir=temp_dir
-        )
-        av_offset_list.append(av_offset)
-        conf_list.append(conf)
+def syncnet_eval(syncnet, syncnet_detector, video_path, temp_dir=None, detect_results_dir=None):
+    """SyncNet AV offset and confidence of `video_path`.
+
+    `temp_dir` and `detect_results_dir` are emptied on every call. Left to None, they live in a private directory
+    removed afterwards, so several evaluations can run at the same time.
+    """
+    with tempfile.TemporaryDirectory(prefix="syncnet_eval_") as workspace_dir:
+        temp_dir = temp_dir or os.path.join(workspace_dir, "temp")
+        detect_results_dir = detect_results_dir or os.path.join(workspace_dir, "detect_results")
+        syncnet_detector(video_path=video_path, min_track=50, detect_results_dir=detect_results_dir)
+        crop_videos = os.listdir(os.path.join(detect_results_dir, "crop"))
+        if crop_videos == []:
+            raise Exception(red_text(f"Face not detected in {video_path}"))
+        av_offset_list = []
+        conf_list = []
+        for video in crop_videos:
+            av_offset, _, conf = syncnet.evaluate(
+                video_path=os.path.join(detect_results_dir, "crop", video), temp_dir=temp_dir
+            )
+            av_offset_list.append(av_offset)
+            conf_list.append(conf)
     av_offset = int(fmean(av_offset_list))
     conf = fmean(conf_list)
     print(f"Input video: {video_path}\nSyncNet confidence: {conf:.2f}\nAV offset: {av_offset}")
@@ -46,7 +55,7 @@ def main():
     parser.add_argument("--initial_model", type=str, default="checkpoints/auxiliary/syncnet_v2.model", help="")
     parser.add_argument("--video_path", type=str, default=None, help="")
     parser.add_argument("--videos_dir", type=str, default="/root/processed")
-    parser.add_argument("--temp_dir", type=str, default="temp", help="")
+    parser.add_argument("--temp_dir", type=str, default=None, help="Defaults to a private directory per video")
 
     args = parser.parse_args()
 
@@ -55,7 +64,7 @@ def main():
     syncnet = SyncNetEval(device=device)
     syncnet.loadParameters(args.initial_model)
 
-    syncnet_detector = SyncNetDetector(device=device, detect_results_dir="detect_results")
+    syncnet_detector = SyncNetDetector(device=device)
 
     if args.video_path is not None:
         syncnet_eval(syncnet, syncnet_detector, args.video_path, args.temp_dir)
@@ -12,11 +12,191 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import argparse
+import json
+import math
 import os
-import subprocess
+import queue
+import shutil
+import tempfile
+import threading
+import time
 from tqdm import tqdm
 import random
 
+import torch
+from omegaconf import OmegaConf
+
+from latentsync.utils.util import check_ffmpeg_installed, read_audio, read_video
+from latentsync.utils.video_encoder import OrderedEncoder
+from scripts.inference import load_pipeline, pipeline_call_kwargs
+from scripts.sharded_inference import align_faces, build_image_processor
+
+
+def read_manifest(manifest_path: str):
+    if not os.path.isfile(manifest_path):
+        return []
+    with open(manifest_path, "r", encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def prepare_pair(image_processor, video_path, audio_path, video_fps=25, audio_sample_rate=16000):
+    """Decode `video_path` and `audio_path` and align the faces, everything the pipeline does on the CPU up front."""
+    timings = {}
+    start = time.perf_counter()
+    video_frames = read_video(video_path, use_decord=False)
+    audio_samples = read_audio(audio_path, audio_sample_rate)
+    timings["decode_sec"] = time.perf_counter() - start
+
+    # Whisper gives one chunk per video frame plus two at most, the frames past them are never lipsynced
+    num_covered_frames = math.ceil(len(audio_samples) / audio_sample_rate * video_fps) + 2
+    video_frames = video_frames[:num_covered_frames]
+    start = time.perf_counter()
+    aligned_faces = align_faces(image_processor, video_frames)
+    timings["align_sec"] = time.perf_counter() - start
+    return video_frames, audio_samples, aligned_faces, timings
+
+
+def prefetch_pairs(items, image_processor, prepared_queue, stop_event):
+    for item in items:
+        if stop_event.is_set():
+            break
+        try:
+            prepared = prepare_pair(image_processor, item["video_path"], item["audio_path"])
+            prepared_queue.put((item, prepared, None))
+        except Exception as e:
+            prepared_queue.put((item, None, f"{type(e).__name__}: {e}"))
+    prepared_queue.put(None)
+
+
+def run_batch(items, config, args, manifest_path: str, num_prefetch: int = 2, video_fps=25, audio_sample_rate=16000):
+    """Lipsync every {"video_path", "audio_path", "video_out_path"} of `items` with models loaded once.
+
+    A background thread decodes and aligns the next `num_prefetch` pairs while the current one denoises. Every
+    processed pair appends a line with its status and timings to `manifest_path`; pairs whose output already exists
+    are skipped, so an interrupted batch resumes where it stopped. Outputs are written to a temporary file first and
+    renamed when complete, so an existing output is always a finished one.
+    """
+    check_ffmpeg_installed()
+    todo = [item for item in items if not os.path.exists(item["video_out_path"])]
+    print(f"{len(items) - len(todo)} of {len(items)} outputs already exist, {len(todo)} to go")
+    if len(todo) == 0:
+        return
+
+    pipeline, policy = load_pipeline(config, args)
+    call_kwargs = pipeline_call_kwargs(config, args, policy)
+    seed = args.seed if args.seed != -1 else None
+    image_processor = build_image_processor(config, args, policy.device.type)
+
+    temp_dir = tempfile.mkdtemp(prefix="latentsync_batch_")
+    prepared_queue = queue.Queue(maxsize=num_prefetch)
+    stop_event = threading.Event()
+    prefetcher = threading.Thread(
+        target=prefetch_pairs, args=(todo, image_processor, prepared_queue, stop_event), daemon=True
+    )
+    prefetcher.start()
+
+    try:
+        with tqdm(total=len(todo)) as progress_bar:
+            while True:
+                start = time.perf_counter()
+                prepared = prepared_queue.get()
+                wait_sec = time.perf_counter() - start
+                if prepared is None:
+                    break
+                item, prepared, error = prepared
+                record = dict(item, status="failed", wait_sec=round(wait_sec, 3))
+                if error is None:
+                    video_frames, audio_samples, aligned_faces, timings = prepared
+                    record.update({name: round(seconds, 3) for name, seconds in timings.items()})
+                    try:
+                        record.update(
+                            lipsync_prepared(
+                                pipeline,
+                                video_frames,
+                                audio_samples,
+                                aligned_faces,
+                                item,
+                                temp_dir,
+                                seed,
+                                call_kwargs,
+                                video_fps,
+                                audio_sample_rate,
+                            )
+                        )
+                        record["status"] = "done"
+                    except Exception as e:
+                        error = f"{type(e).__name__}: {e}"
+                if error is not None:
+                    print(f"Failed {item['video_path']} + {item['audio_path']}: {error}")
+                    record["error"] = error
+                with open(manifest_path, "a", encoding="utf-8") as file:
+                    file.write(json.dumps(record) + "\n")
+                progress_bar.update()
+    finally:
+        stop_event.set()
+        # Unblock the prefetcher if it waits on a full queue
+        while prefetcher.is_alive():
+            try:
+                prepared_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        image_processor.close()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        del pipeline
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+
+def lipsync_prepared(
+    pipeline,
+    video_frames,
+    audio_samples,
+    aligned_faces,
+    item,
+    temp_dir,
+    seed,
+    call_kwargs,
+    video_fps,
+    audio_sample_rate,
+):
+    """Denoise and encode one pair prepared by `prepare_pair`, returns its timings."""
+    timings = {}
+    start = time.perf_counter()
+    whisper_feature = pipeline.audio_encoder.audio2feat(item["audio_path"])
+    timings["whisper_sec"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    encoder = OrderedEncoder(os.path.join(temp_dir, "video.mp4"), video_fps)
+    try:
+        for window_index, batch_frames in enumerate(
+            pipeline.iter_lipsync_windows(
+                video_frames,
+                whisper_feature,
+                video_fps=video_fps,
+                aligned_faces=aligned_faces,
+                seed=seed,
+                **call_kwargs,
+            )
+        ):
+            encoder.add(window_index, batch_frames)
+    finally:
+        encoder.close()
+    if encoder.num_frames == 0:
+        raise ValueError("Video and audio must cover at least one window")
+    timings["inference_sec"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    partial_path = os.path.join(temp_dir, "output.mp4")
+    encoder.mux(audio_samples, audio_sample_rate, partial_path)
+    os.makedirs(os.path.dirname(os.path.abspath(item["video_out_path"])), exist_ok=True)
+    shutil.move(partial_path, item["video_out_path"])
+    timings["mux_sec"] = time.perf_counter() - start
+
+    result = {name: round(seconds, 3) for name, seconds in timings.items()}
+    result["num_frames"] = encoder.num_frames
+    return result
+
 
 def inference_video_from_fileslist(
     video_fileslist: str,
@@ -25,6 +205,10 @@ def inference_video_from_fileslist(
     unet_config_path: str,
     ckpt_path: str,
     seed: int = 42,
+    inference_seed: int = 1247,
+    guidance_scale: float = 1.5,
+    inference_steps: int = 20,
+    num_prefetch: int = 2,
 ):
     with open(video_fileslist, "r", encoding="utf-8") as file:
         video_paths = [line.strip() for line in file.readlines()]
@@ -48,13 +232,29 @@ def inference_video_from_fileslist(
     random.shuffle(video_paths)
     random.shuffle(audio_paths)
 
-    for index, video_path in tqdm(enumerate(video_paths), total=len(video_paths)):
+    items = []
+    for index, video_path in enumerate(video_paths):
         audio_path = audio_paths[index]
         video_name = os.path.basename(video_path)[:-4]
         audio_name = os.path.basename(audio_path)[:-4]
         video_out_path = os.path.join(output_dir, f"{video_name}__{audio_name}.mp4")
-        inference_command = f"python -m scripts.inference --guidance_scale 1.5 --unet_config_path {unet_config_path} --video_path {video_path} --audio_path {audio_path} --video_out_path {video_out_path} --inference_ckpt_path {ckpt_path}"
-        subprocess.run(inference_command, shell=True)
+        items.append({"video_path": video_path, "audio_path": audio_path, "video_out_path": video_out_path})
+
+    # The same settings as `python -m scripts.inference --guidance_scale 1.5` used to get for every pair
+    args = argparse.Namespace(
+        inference_ckpt_path=ckpt_path,
+        inference_steps=inference_steps,
+        guidance_scale=guidance_scale,
+        seed=inference_seed,
+    )
+    config = OmegaConf.load(unet_config_path)
+    manifest_path = os.path.join(output_dir, "manifest.jsonl")
+    run_batch(items, config, args, manifest_path, num_prefetch=num_prefetch)
+
+    # A pair that failed and was retried on resume has several records, the last one counts
+    statuses = {record["video_out_path"]: record["status"] for record in read_manifest(manifest_path)}
+    num_failed = sum(status == "failed" for status in statuses.values())
+    print(f"Manifest {manifest_path}: {len(statuses) - num_failed} done, {num_failed} failed")
 
 
 if __name__ == "__main__":
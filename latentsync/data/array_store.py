@@ -0,0 +1,116 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import glob
+import json
+import os
+
+import numpy as np
+
+
+class ArrayStoreWriter:
+    """Append one array per video to `.npy` shards of about `rows_per_shard` rows, concatenated along the first axis.
+
+    A shard is written to a temporary file and renamed when full, then its videos are appended to the index of the
+    writer with their offset and length, so the index only ever lists finished shards. Writers with different `part`
+    write to the same store without touching each other's files, and a writer skips nothing by itself: callers check
+    `done_video_paths` to resume.
+    """
+
+    def __init__(self, store_dir: str, metadata: dict, part: int = 0, rows_per_shard: int = 4096, dtype=np.float16):
+        self.store_dir = store_dir
+        self.part = part
+        self.rows_per_shard = rows_per_shard
+        self.dtype = dtype
+        os.makedirs(store_dir, exist_ok=True)
+
+        metadata_path = os.path.join(store_dir, "store.json")
+        if os.path.isfile(metadata_path):
+            with open(metadata_path, "r", encoding="utf-8") as f:
+                existing_metadata = json.load(f)
+            if existing_metadata != metadata:
+                raise ValueError(f"{store_dir} was written with {existing_metadata}, not {metadata}")
+        else:
+            with open(metadata_path, "w", encoding="utf-8") as f:
+                json.dump(metadata, f, indent=2)
+
+        self.index_path = os.path.join(store_dir, f"index_part{part:03d}.jsonl")
+        self.done_video_paths = set()
+        self.num_shards = 0
+        if os.path.isfile(self.index_path):
+            for entry in read_index(self.index_path):
+                self.done_video_paths.add(entry["video_path"])
+                self.num_shards = max(self.num_shards, int(entry["shard"].split("_shard")[-1][:-4]) + 1)
+
+        self.pending_entries = []
+        self.pending_arrays = []
+        self.pending_rows = 0
+
+    def add(self, video_path: str, array: np.ndarray):
+        self.pending_entries.append({"video_path": video_path, "offset": self.pending_rows, "num_frames": len(array)})
+        self.pending_arrays.append(array.astype(self.dtype))
+        self.pending_rows += len(array)
+        if self.pending_rows >= self.rows_per_shard:
+            self.flush()
+
+    def flush(self):
+        if self.pending_rows == 0:
+            return
+        shard_name = f"part{self.part:03d}_shard{self.num_shards:05d}.npy"
+        temp_path = os.path.join(self.store_dir, shard_name + ".tmp")
+        with open(temp_path, "wb") as f:
+            np.save(f, np.concatenate(self.pending_arrays))
+        os.replace(temp_path, os.path.join(self.store_dir, shard_name))
+
+        with open(self.index_path, "a", encoding="utf-8") as f:
+            for entry in self.pending_entries:
+                f.write(json.dumps(dict(entry, shard=shard_name)) + "\n")
+                self.done_video_paths.add(entry["video_path"])
+        self.num_shards += 1
+        self.pending_entries = []
+        self.pending_arrays = []
+        self.pending_rows = 0
+
+
+def read_index(index_path: str):
+    with open(index_path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class ArrayStore:
+    """Read the arrays of the videos in a store written by `ArrayStoreWriter`.
+
+    Shards are memory-mapped copy-on-write on first use in each process: dataloader workers only page in the rows
+    they read, and the views can be wrapped by `torch.from_numpy` without a copy.
+    """
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, "store.json"), "r", encoding="utf-8") as f:
+            self.metadata = json.load(f)
+        self.videos = {}
+        for index_path in sorted(glob.glob(os.path.join(store_dir, "index_part*.jsonl"))):
+            for entry in read_index(index_path):
+                self.videos[entry["video_path"]] = entry
+        self.shards = {}
+
+    def __contains__(self, video_path: str):
+        return video_path in self.videos
+
+    def video_rows(self, video_path: str) -> np.ndarray:
+        """Memory-mapped view of the array of `video_path`, nothing is read until it is indexed."""
+        entry = self.videos[video_path]
+        if entry["shard"] not in self.shards:
+            self.shards[entry["shard"]] = np.load(os.path.join(self.store_dir, entry["shard"]), mmap_mode="c")
+        return self.shards[entry["shard"]][entry["offset"] : entry["offset"] + entry["num_frames"]]
@@ -0,0 +1,80 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+import torch
+from torch.utils.data import Sampler
+
+
+def read_clip_index(index_path: str):
+    """Entries of `preprocess.build_clip_index`: video_path, num_frames, mel_frames and valid (the video decodes)."""
+    with open(index_path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def max_window_start(entry: dict, num_frames: int, min_frames: int, video_fps: int, mel_window_length: int, use_mel):
+    """Last start index of a window of the clip that has all its frames and, with `use_mel`, its whole mel window.
+
+    -1 when the clip is broken, shorter than `min_frames` or has no such window.
+    """
+    if not entry["valid"] or entry["num_frames"] < min_frames:
+        return -1
+    start_idx = entry["num_frames"] - num_frames
+    if use_mel:
+        # Same mel offset as the datasets' crop_audio_window
+        while start_idx >= 0 and int(80.0 * (start_idx / float(video_fps))) + mel_window_length > entry["mel_frames"]:
+            start_idx -= 1
+    return start_idx
+
+
+def sample_seed(seed: int, epoch: int, position: int) -> int:
+    return ((seed * 1000003 + epoch) * 1000003 + position) % 2**63
+
+
+class ClipSampler(Sampler):
+    """Deal out the clips of a dataset built on a clip index to the ranks, one (clip index, sample seed) per sample.
+
+    The clips are shuffled every epoch with `seed` like DistributedSampler does (the tail that does not divide by
+    the number of ranks is dropped, so every rank runs the same number of steps). The dataset draws the windows of a
+    sample from its seed only, which makes an epoch reproducible and lets `skip` resume it exactly after the samples
+    already trained on.
+    """
+
+    def __init__(self, num_clips: int, seed: int = 0, rank: int = 0, world_size: int = 1):
+        self.num_clips = num_clips
+        self.seed = seed
+        self.rank = rank
+        self.world_size = world_size
+        self.epoch = 0
+        self.start_index = 0
+
+    def __len__(self):
+        return self.num_clips // self.world_size
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+        self.start_index = 0
+
+    def skip(self, num_samples: int):
+        """Start the current epoch of this rank after its first `num_samples` samples."""
+        self.start_index = num_samples
+
+    def __iter__(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        clip_indices = torch.randperm(self.num_clips, generator=generator).tolist()
+        for index in range(self.start_index, len(self)):
+            position = self.rank + index * self.world_size
+            yield clip_indices[position], sample_seed(self.seed, self.epoch, position)
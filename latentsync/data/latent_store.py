@@ -0,0 +1,39 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+
+from .array_store import ArrayStore, ArrayStoreWriter
+
+
+class LatentStoreWriter(ArrayStoreWriter):
+    """Append the VAE latent distributions of whole videos to `.npy` shards of about `frames_per_shard` frames.
+
+    Every frame holds the mean and log variance (the `latent_dist.parameters` of the VAE, 2 x 4 channels) of the
+    full frame and of the masked frame, as (f, 2, 8, h, w) float16.
+    """
+
+    def __init__(self, store_dir: str, metadata: dict, part: int = 0, frames_per_shard: int = 4096):
+        super().__init__(store_dir, metadata, part=part, rows_per_shard=frames_per_shard, dtype=np.float16)
+
+
+class LatentStore(ArrayStore):
+    """Read frames of the videos in a store written by `LatentStoreWriter`."""
+
+    def video_latents(self, video_path: str) -> np.ndarray:
+        """Memory-mapped latent distributions of all frames of `video_path`, (f, 2, 8, h, w): full, masked frames.
+
+        Nothing is read until the result is indexed.
+        """
+        return self.video_rows(video_path)
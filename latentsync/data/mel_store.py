@@ -0,0 +1,42 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import torch
+
+from .array_store import ArrayStore, ArrayStoreWriter
+
+
+class MelStoreWriter(ArrayStoreWriter):
+    """Append the mel spectrograms of whole videos to `.npy` shards of about `frames_per_shard` mel frames.
+
+    Mels are stored time-major, (t, 80) float32, so the window of a video is a contiguous slice of its shard.
+    """
+
+    def __init__(self, store_dir: str, metadata: dict, part: int = 0, frames_per_shard: int = 2**20):
+        super().__init__(store_dir, metadata, part=part, rows_per_shard=frames_per_shard, dtype=np.float32)
+
+    def add(self, video_path: str, mel: np.ndarray):
+        super().add(video_path, mel.T)
+
+
+class MelStore(ArrayStore):
+    """Read the mel spectrograms of the videos in a store written by `MelStoreWriter`."""
+
+    def video_mel(self, video_path: str) -> torch.Tensor:
+        """Mel spectrogram of `video_path`, (80, t) like `melspectrogram` returns it, as a view of the mapped shard.
+
+        Cropping a window of it reads only that window.
+        """
+        return torch.from_numpy(self.video_rows(video_path)).T
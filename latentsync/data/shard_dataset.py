@@ -0,0 +1,209 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import json
+import os
+import random
+import tarfile
+
+import numpy as np
+from torch.utils.data import IterableDataset, get_worker_info
+
+
+class ShardWriter:
+    """Pack clips into `<prefix>_<n>.tar` shards of about `shard_size` bytes, read back by `iter_shard_clips`.
+
+    Every clip is a group of consecutive members named `<key>.<field>`: `json` (metadata), `mp4` (the video file as
+    is, frames stay compressed), and optionally `mel.npy` (the mel spectrogram of the whole clip) and `latents.npy`
+    (its VAE latent distributions, see `LatentStoreWriter`). A shard is written to a temporary file and renamed when
+    closed; `shards.jsonl` in the output directory lists the finished shards and the videos they hold.
+    """
+
+    def __init__(self, output_dir: str, prefix: str = "shard", shard_size: int = 1024**3):
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.shard_size = shard_size
+        os.makedirs(output_dir, exist_ok=True)
+        self.num_shards = len(glob_shards(output_dir, prefix))
+        self.tar = None
+
+    def open_shard(self):
+        self.shard_name = f"{self.prefix}_{self.num_shards:06d}.tar"
+        self.temp_path = os.path.join(self.output_dir, self.shard_name + ".tmp")
+        self.tar = tarfile.open(self.temp_path, "w")
+        self.video_paths = []
+        self.num_bytes = 0
+
+    def add_member(self, name: str, data: bytes):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        self.tar.addfile(info, io.BytesIO(data))
+        self.num_bytes += len(data)
+
+    def add(self, key: str, metadata: dict, video_bytes: bytes, mel: np.ndarray = None, latents: np.ndarray = None):
+        if self.tar is None:
+            self.open_shard()
+        self.add_member(f"{key}.json", json.dumps(metadata).encode())
+        self.add_member(f"{key}.mp4", video_bytes)
+        for field, array in [("mel", mel), ("latents", latents)]:
+            if array is not None:
+                buffer = io.BytesIO()
+                np.save(buffer, array)
+                self.add_member(f"{key}.{field}.npy", buffer.getvalue())
+        self.video_paths.append(metadata["video_path"])
+        if self.num_bytes >= self.shard_size:
+            self.close()
+
+    def close(self):
+        if self.tar is None:
+            return
+        self.tar.close()
+        os.replace(self.temp_path, os.path.join(self.output_dir, self.shard_name))
+        append_shard_list(self.output_dir, self.shard_name, self.video_paths)
+        self.num_shards += 1
+        self.tar = None
+
+
+def glob_shards(output_dir: str, prefix: str):
+    return sorted(file for file in os.listdir(output_dir) if file.startswith(prefix + "_") and file.endswith(".tar"))
+
+
+def append_shard_list(output_dir: str, shard_name: str, video_paths: list):
+    # Several packing processes add to the same list, each with one append per shard
+    with open(os.path.join(output_dir, "shards.jsonl"), "a", encoding="utf-8") as f:
+        f.write(json.dumps({"shard": shard_name, "video_paths": video_paths}) + "\n")
+
+
+def read_shard_list(shards_dir: str):
+    shard_list_path = os.path.join(shards_dir, "shards.jsonl")
+    if not os.path.isfile(shard_list_path):
+        return []
+    with open(shard_list_path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def iter_shard_clips(shard_path: str):
+    """Clips of a shard in order, read front to back in a single pass."""
+    clip, clip_key = {}, None
+    with tarfile.open(shard_path, "r|") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            key, _, field = member.name.partition(".")
+            if key != clip_key:
+                if clip:
+                    yield clip
+                clip, clip_key = {"key": key}, key
+            data = tar.extractfile(member).read()
+            if field == "json":
+                clip["metadata"] = json.loads(data)
+            elif field == "mp4":
+                clip["video_bytes"] = data
+            elif field.endswith(".npy"):
+                clip[field[: -len(".npy")]] = np.load(io.BytesIO(data))
+    if clip:
+        yield clip
+
+
+class ShardedClipDataset(IterableDataset):
+    """Stream the clips of the shards in `shards_dir` and turn them into training samples with `dataset.make_sample`.
+
+    Shards are read sequentially, which replaces the random opens and seeks of the per-file datasets by large reads.
+    Every epoch the shards are shuffled with `seed` and dealt out to the ranks and then to the dataloader workers,
+    and the clips pass through a shuffle buffer of `buffer_size`. The buffer holds the compact clip records (mp4 bytes,
+    mel, latents), a clip is only decoded into a sample when it leaves the buffer. Each rank yields exactly
+    `len(self)` samples per epoch, cycling through its shards again when clips were skipped, so all ranks run the
+    same number of steps.
+    """
+
+    def __init__(self, shards_dir: str, dataset, buffer_size: int = 100, seed: int = 0, rank=0, world_size=1):
+        self.shards_dir = shards_dir
+        self.dataset = dataset
+        self.buffer_size = buffer_size
+        self.seed = seed
+        self.rank = rank
+        self.world_size = world_size
+        self.epoch = 0
+
+        shard_list = read_shard_list(shards_dir)
+        self.shard_paths = sorted(os.path.join(shards_dir, entry["shard"]) for entry in shard_list)
+        self.num_clips = sum(len(entry["video_paths"]) for entry in shard_list)
+        if len(self.shard_paths) == 0:
+            raise ValueError(f"No shards listed in {shards_dir}")
+
+    def __len__(self):
+        return self.num_clips // self.world_size
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def worker_init_fn(self, worker_id):
+        self.dataset.worker_init_fn(worker_id)
+
+    def iter_worker_clips(self, worker_id: int, num_workers: int):
+        num_readers = self.world_size * num_workers
+        reader_index = self.rank * num_workers + worker_id
+        shard_paths = list(self.shard_paths)
+        rng = random.Random(self.seed + self.epoch)
+        rng.shuffle(shard_paths)
+        if len(shard_paths) < num_readers:
+            # Fewer shards than readers, some readers read the same shard but draw other windows of its clips
+            shard_paths = [shard_paths[index % len(shard_paths)] for index in range(num_readers)]
+        reader_shard_paths = shard_paths[reader_index::num_readers]
+        while True:
+            num_clips = 0
+            for shard_path in reader_shard_paths:
+                try:
+                    for clip in iter_shard_clips(shard_path):
+                        num_clips += 1
+                        yield clip
+                except (tarfile.TarError, OSError, ValueError) as e:
+                    print(f"{type(e).__name__} - {e} - {shard_path}")
+            if num_clips == 0:
+                raise ValueError(f"No readable clips in {reader_shard_paths}")
+            rng.shuffle(reader_shard_paths)
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        worker_id, num_workers = (worker_info.id, worker_info.num_workers) if worker_info is not None else (0, 1)
+        if worker_info is None and not hasattr(self.dataset, "worker_id"):
+            self.dataset.worker_init_fn(0)
+
+        num_samples = len(self) // num_workers + int(worker_id < len(self) % num_workers)
+        # The global random state drives the window sampling of `make_sample`, give every reader its own stream
+        reader_seed = self.seed + self.epoch * 1000003 + self.rank * num_workers + worker_id
+        random.seed(reader_seed)
+        rng = random.Random(reader_seed)
+
+        buffer = []
+        clips = self.iter_worker_clips(worker_id, num_workers)
+        while num_samples > 0:
+            clip = next(clips)
+            if len(buffer) < self.buffer_size:
+                buffer.append(clip)
+                continue
+            if buffer:
+                index = rng.randrange(len(buffer))
+                buffer[index], clip = clip, buffer[index]
+            try:
+                sample = self.dataset.make_sample(clip)
+            except Exception as e:  # Handle the exception of face not detcted
+                print(f"{type(e).__name__} - {e} - {clip['metadata']['video_path']}")
+                continue
+            if sample is None:
+                continue
+            num_samples -= 1
+            yield sample
+
@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import io
 import os
 import numpy as np
 from torch.utils.data import Dataset
@@ -20,14 +21,19 @@ import random
 from ..utils.util import gather_video_paths_recursively
 from ..utils.image_processor import ImageProcessor
 from ..utils.audio import melspectrogram
+from .clip_index import max_window_start, read_clip_index
+from .mel_store import MelStore
 import math
 
 from decord import AudioReader, VideoReader, cpu
 
 
 class SyncNetDataset(Dataset):
-    def __init__(self, data_dir: str, fileslist: str, config):
-        if fileslist != "":
+    def __init__(self, data_dir: str, fileslist: str, config, from_shards: bool = False, clip_index_path: str = ""):
+        if from_shards:
+            # The clips are streamed from shards by ShardedClipDataset, which calls `make_sample`
+            self.video_paths = []
+        elif fileslist != "":
             with open(fileslist) as file:
                 self.video_paths = [line.rstrip() for line in file]
         elif data_dir != "":
@@ -45,6 +51,33 @@ class SyncNetDataset(Dataset):
         self.image_processor = ImageProcessor(resolution=config.data.resolution, mask="half")
         self.audio_mel_cache_dir = config.data.audio_mel_cache_dir
         os.makedirs(self.audio_mel_cache_dir, exist_ok=True)
+        # Mels built ahead of training by preprocess.build_mel_store, the per-file cache covers the videos it misses
+        self.audio_mel_store_dir = config.data.get("audio_mel_store_dir", "")
+        if self.audio_mel_store_dir != "":
+            self.mel_store = MelStore(self.audio_mel_store_dir)
+            if self.mel_store.metadata["audio_sample_rate"] != self.audio_sample_rate:
+                raise ValueError(f"{self.audio_mel_store_dir} holds mels of another audio sample rate")
+        else:
+            self.mel_store = None
+
+        # Valid clips listed by preprocess.build_clip_index, ClipSampler indexes them with a seed per sample so the
+        # windows are drawn reproducibly and only where the frames and the mel are all there
+        self.clip_index_path = clip_index_path
+        if self.clip_index_path != "" and not from_shards:
+            video_paths = set(self.video_paths)
+            self.clips = []
+            self.max_start_idxs = []
+            for entry in read_clip_index(self.clip_index_path):
+                if entry["video_path"] not in video_paths:
+                    continue
+                max_start_idx = max_window_start(
+                    entry, self.num_frames, 2 * self.num_frames, self.video_fps, self.mel_window_length, True
+                )
+                if max_start_idx >= 0:
+                    self.clips.append(entry)
+                    self.max_start_idxs.append(max_start_idx)
+            print(f"{len(self.clips)} of {len(self.video_paths)} videos are valid clips in {self.clip_index_path}")
+            self.video_paths = [entry["video_path"] for entry in self.clips]
 
     def __len__(self):
         return len(self.video_paths)
@@ -59,14 +92,16 @@ class SyncNetDataset(Dataset):
         end_idx = start_idx + self.mel_window_length
         return original_mel[:, start_idx:end_idx].unsqueeze(0)
 
-    def get_frames(self, video_reader: VideoReader):
+    def get_frames(self, video_reader: VideoReader, rng=random, max_start_idx=None):
         total_num_frames = len(video_reader)
 
-        start_idx = random.randint(0, total_num_frames - self.num_frames)
+        if max_start_idx is None:
+            max_start_idx = total_num_frames - self.num_frames
+        start_idx = rng.randint(0, max_start_idx)
         frames_index = np.arange(start_idx, start_idx + self.num_frames, dtype=int)
 
         while True:
-            wrong_start_idx = random.randint(0, total_num_frames - self.num_frames)
+            wrong_start_idx = rng.randint(0, total_num_frames - self.num_frames)
             if wrong_start_idx == start_idx:
                 continue
             wrong_frames_index = np.arange(wrong_start_idx, wrong_start_idx + self.num_frames, dtype=int)
@@ -83,8 +118,86 @@ class SyncNetDataset(Dataset):
         self.worker_id = worker_id
         # setattr(self, f"image_processor_{worker_id}", ImageProcessor(self.resolution, self.mask))
 
+    def load_mel(self, video_path: str):
+        if self.mel_store is not None and video_path in self.mel_store:
+            return self.mel_store.video_mel(video_path)
+
+        mel_cache_path = os.path.join(self.audio_mel_cache_dir, os.path.basename(video_path).replace(".mp4", "_mel.pt"))
+
+        if os.path.isfile(mel_cache_path):
+            try:
+                original_mel = torch.load(mel_cache_path, weights_only=True)
+            except Exception as e:
+                print(f"{type(e).__name__} - {e} - {mel_cache_path}")
+                os.remove(mel_cache_path)
+                original_mel = self.read_audio(video_path)
+                torch.save(original_mel, mel_cache_path)
+        else:
+            original_mel = self.read_audio(video_path)
+            torch.save(original_mel, mel_cache_path)
+        return original_mel
+
+    def get_sample(self, video_path: str, vr: VideoReader, original_mel=None, rng=random, max_start_idx=None):
+        """Sample of a random window of one video, None if the video is too short.
+
+        `original_mel` defaults to the cached mel of `video_path`. The windows and the label are drawn with `rng`, the
+        window starts at `max_start_idx` at the latest.
+        """
+        if len(vr) < 2 * self.num_frames:
+            return None
+
+        frames, wrong_frames, start_idx = self.get_frames(vr, rng, max_start_idx)
+
+        if original_mel is None:
+            original_mel = self.load_mel(video_path)
+        mel = self.crop_audio_window(original_mel, start_idx)
+
+        if mel.shape[-1] != self.mel_window_length:
+            return None
+
+        if rng.choice([True, False]):
+            y = torch.ones(1).float()
+            chosen_frames = frames
+        else:
+            y = torch.zeros(1).float()
+            chosen_frames = wrong_frames
+
+        chosen_frames = self.image_processor.process_images(chosen_frames)
+
+        return dict(frames=chosen_frames, audio_samples=mel, y=y)
+
+    def make_sample(self, clip: dict):
+        """Sample of a random window of a clip streamed by ShardedClipDataset, None if the clip is too short."""
+        vr = VideoReader(io.BytesIO(clip["video_bytes"]), ctx=cpu(self.worker_id))
+        original_mel = torch.from_numpy(clip["mel"]) if "mel" in clip else None
+        try:
+            return self.get_sample(clip["metadata"]["video_path"], vr, original_mel)
+        finally:
+            vr.seek(0)  # avoid memory leak
+
+    def get_indexed_sample(self, clip_index: int, sample_seed: int):
+        """Sample of the clip drawn by ClipSampler, its windows and label depend on nothing but `sample_seed`."""
+        video_path = self.video_paths[clip_index]
+        vr = VideoReader(video_path, ctx=cpu(self.worker_id))
+        try:
+            return self.get_sample(
+                video_path, vr, rng=random.Random(sample_seed), max_start_idx=self.max_start_idxs[clip_index]
+            )
+        finally:
+            vr.seek(0)  # avoid memory leak
+
     def __getitem__(self, idx):
         # image_processor = getattr(self, f"image_processor_{self.worker_id}")
+        if isinstance(idx, (tuple, list)):
+            clip_index, sample_seed = idx
+            try:
+                sample = self.get_indexed_sample(clip_index, sample_seed)
+                if sample is not None:
+                    return sample
+            except Exception as e:
+                print(f"{type(e).__name__} - {e} - {self.video_paths[clip_index]}")
+            # The index said the clip is fine, fall back to a random one rather than fail the step
+
         while True:
             try:
                 idx = random.randint(0, len(self) - 1)
@@ -94,49 +207,15 @@ class SyncNetDataset(Dataset):
 
                 vr = VideoReader(video_path, ctx=cpu(self.worker_id))
 
-                if len(vr) < 2 * self.num_frames:
-                    continue
-
-                frames, wrong_frames, start_idx = self.get_frames(vr)
-
-                mel_cache_path = os.path.join(
-                    self.audio_mel_cache_dir, os.path.basename(video_path).replace(".mp4", "_mel.pt")
-                )
-
-                if os.path.isfile(mel_cache_path):
-                    try:
-                        original_mel = torch.load(mel_cache_path, weights_only=True)
-                    except Exception as e:
-                        print(f"{type(e).__name__} - {e} - {mel_cache_path}")
-                        os.remove(mel_cache_path)
-                        original_mel = self.read_audio(video_path)
-                        torch.save(original_mel, mel_cache_path)
-                else:
-                    original_mel = self.read_audio(video_path)
-                    torch.save(original_mel, mel_cache_path)
-
-                mel = self.crop_audio_window(original_mel, start_idx)
-
-                if mel.shape[-1] != self.mel_window_length:
-                    continue
-
-                if random.choice([True, False]):
-                    y = torch.ones(1).float()
-                    chosen_frames = frames
-                else:
-                    y = torch.zeros(1).float()
-                    chosen_frames = wrong_frames
-
-                chosen_frames = self.image_processor.process_images(chosen_frames)
+                sample = self.get_sample(video_path, vr)
 
                 vr.seek(0)  # avoid memory leak
-                break
+                if sample is not None:
+                    break
 
             except Exception as e:  # Handle the exception of face not detcted
                 print(f"{type(e).__name__} - {e} - {video_path}")
                 if "vr" in locals():
                     vr.seek(0)  # avoid memory leak
 
-        sample = dict(frames=chosen_frames, audio_samples=mel, y=y)
-
         return sample
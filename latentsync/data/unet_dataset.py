@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import io
 import os
 import math
 import numpy as np
@@ -20,14 +21,22 @@ import torch
 import random
 import cv2
 from ..utils.image_processor import ImageProcessor, load_fixed_mask
+from ..whisper.audio2feature import overlap_audio_window_index
+from .array_store import ArrayStore
+from .clip_index import max_window_start, read_clip_index
+from .latent_store import LatentStore
+from .mel_store import MelStore
 from ..utils.audio import melspectrogram
 from decord import AudioReader, VideoReader, cpu
 import torch.nn.functional as F
 
 
 class UNetDataset(Dataset):
-    def __init__(self, train_data_dir: str, config):
-        if config.data.train_fileslist != "":
+    def __init__(self, train_data_dir: str, config, from_shards: bool = False):
+        if from_shards:
+            # The clips are streamed from shards by ShardedClipDataset, which calls `make_sample`
+            self.video_paths = []
+        elif config.data.train_fileslist != "":
             with open(config.data.train_fileslist) as file:
                 self.video_paths = [line.rstrip() for line in file]
         elif train_data_dir != "":
@@ -50,6 +59,70 @@ class UNetDataset(Dataset):
         self.load_audio_data = config.model.add_audio_layer and config.run.use_syncnet
         self.audio_mel_cache_dir = config.data.audio_mel_cache_dir
         os.makedirs(self.audio_mel_cache_dir, exist_ok=True)
+        # Mels built ahead of training by preprocess.build_mel_store, the per-file cache covers the videos it misses
+        self.audio_mel_store_dir = config.data.get("audio_mel_store_dir", "")
+        if self.audio_mel_store_dir != "":
+            self.mel_store = MelStore(self.audio_mel_store_dir)
+            if self.mel_store.metadata["audio_sample_rate"] != self.audio_sample_rate:
+                raise ValueError(f"{self.audio_mel_store_dir} holds mels of another audio sample rate")
+        else:
+            self.mel_store = None
+
+        # With a latent store the samples carry VAE latent distributions instead of pixels, the pixels of the target
+        # frames are only decoded when the losses need them
+        self.latent_store_dir = config.data.get("latent_store_dir", "")
+        self.load_gt_pixel_values = config.run.pixel_space_supervise
+        if self.latent_store_dir != "" and not from_shards:
+            if self.mask != "fix_mask":
+                raise ValueError("The latent store only supports the fixed mask")
+            self.latent_store = LatentStore(self.latent_store_dir)
+            if self.latent_store.metadata["resolution"] != self.resolution:
+                raise ValueError(
+                    f"{self.latent_store_dir} holds latents of {self.latent_store.metadata['resolution']} px frames, "
+                    f"not {self.resolution} px"
+                )
+            num_videos = len(self.video_paths)
+            self.video_paths = [video_path for video_path in self.video_paths if video_path in self.latent_store]
+            print(f"{len(self.video_paths)} of {num_videos} videos are in the latent store {self.latent_store_dir}")
+        else:
+            self.latent_store = None
+
+        # Whisper embeddings extracted by preprocess.extract_audio_embeds, the samples carry their cropped windows so
+        # the training step does not run Whisper
+        self.audio_embeds_store_dir = config.data.get("audio_embeds_store_dir", "")
+        self.audio_feat_length = config.data.audio_feat_length
+        if self.audio_embeds_store_dir != "" and config.model.add_audio_layer:
+            self.audio_embeds_store = ArrayStore(self.audio_embeds_store_dir)
+            num_videos = len(self.video_paths)
+            self.video_paths = [path for path in self.video_paths if path in self.audio_embeds_store]
+            if not from_shards:
+                print(f"{len(self.video_paths)} of {num_videos} videos have audio embeddings in the store")
+        else:
+            self.audio_embeds_store = None
+
+        # Valid clips listed by preprocess.build_clip_index, ClipSampler indexes them with a seed per sample so the
+        # windows are drawn reproducibly and only where the frames and the mel are all there
+        self.clip_index_path = config.data.get("clip_index_path", "")
+        if self.clip_index_path != "" and not from_shards:
+            video_paths = set(self.video_paths)
+            self.clips = []
+            self.max_start_idxs = []
+            for entry in read_clip_index(self.clip_index_path):
+                if entry["video_path"] not in video_paths:
+                    continue
+                max_start_idx = max_window_start(
+                    entry,
+                    self.num_frames,
+                    3 * self.num_frames,
+                    self.video_fps,
+                    self.mel_window_length,
+                    self.load_audio_data,
+                )
+                if max_start_idx >= 0:
+                    self.clips.append(entry)
+                    self.max_start_idxs.append(max_start_idx)
+            print(f"{len(self.clips)} of {len(self.video_paths)} videos are valid clips in {self.clip_index_path}")
+            self.video_paths = [entry["video_path"] for entry in self.clips]
 
     def __len__(self):
         return len(self.video_paths)
@@ -64,19 +137,24 @@ class UNetDataset(Dataset):
         end_idx = start_idx + self.mel_window_length
         return original_mel[:, start_idx:end_idx].unsqueeze(0)
 
-    def get_frames(self, video_reader: VideoReader):
-        total_num_frames = len(video_reader)
-
-        start_idx = random.randint(0, total_num_frames - self.num_frames)
+    def get_frames_index(self, total_num_frames: int, rng=random, max_start_idx=None):
+        if max_start_idx is None:
+            max_start_idx = total_num_frames - self.num_frames
+        start_idx = rng.randint(0, max_start_idx)
         gt_frames_index = np.arange(start_idx, start_idx + self.num_frames, dtype=int)
 
         while True:
-            ref_start_idx = random.randint(0, total_num_frames - self.num_frames)
+            ref_start_idx = rng.randint(0, total_num_frames - self.num_frames)
             if ref_start_idx > start_idx - self.num_frames and ref_start_idx < start_idx + self.num_frames:
                 continue
             ref_frames_index = np.arange(ref_start_idx, ref_start_idx + self.num_frames, dtype=int)
             break
 
+        return gt_frames_index, ref_frames_index, start_idx
+
+    def get_frames(self, video_reader: VideoReader, rng=random, max_start_idx=None):
+        gt_frames_index, ref_frames_index, start_idx = self.get_frames_index(len(video_reader), rng, max_start_idx)
+
         gt_frames = video_reader.get_batch(gt_frames_index).asnumpy()
         ref_frames = video_reader.get_batch(ref_frames_index).asnumpy()
 
@@ -92,8 +170,164 @@ class UNetDataset(Dataset):
             ImageProcessor(self.resolution, self.mask, mask_image=self.mask_image),
         )
 
+    def load_mel(self, video_path: str):
+        if self.mel_store is not None and video_path in self.mel_store:
+            return self.mel_store.video_mel(video_path)
+
+        mel_cache_path = os.path.join(self.audio_mel_cache_dir, os.path.basename(video_path).replace(".mp4", "_mel.pt"))
+
+        if os.path.isfile(mel_cache_path):
+            try:
+                original_mel = torch.load(mel_cache_path, weights_only=True)
+            except Exception as e:
+                print(f"{type(e).__name__} - {e} - {mel_cache_path}")
+                os.remove(mel_cache_path)
+                original_mel = self.read_audio(video_path)
+                torch.save(original_mel, mel_cache_path)
+        else:
+            original_mel = self.read_audio(video_path)
+            torch.save(original_mel, mel_cache_path)
+        return original_mel
+
+    def get_latent_sample(self, image_processor: ImageProcessor, vr, latents, gt_frames_index, ref_frames_index):
+        gt_latents = torch.from_numpy(np.ascontiguousarray(latents[gt_frames_index]))  # (f, 2, 8, h, w)
+        ref_latents = torch.from_numpy(np.ascontiguousarray(latents[ref_frames_index]))
+
+        if self.load_gt_pixel_values:
+            gt_pixel_values = image_processor.process_images(vr.get_batch(gt_frames_index).asnumpy())
+        else:
+            gt_pixel_values = []
+
+        return dict(
+            gt_latent_moments=gt_latents[:, 0],
+            masked_latent_moments=gt_latents[:, 1],
+            ref_latent_moments=ref_latents[:, 0],
+            gt_pixel_values=gt_pixel_values,
+            masks=self.mask_image[0:1].unsqueeze(0).repeat(self.num_frames, 1, 1, 1),
+        )
+
+    def get_sample(
+        self,
+        image_processor: ImageProcessor,
+        video_path: str,
+        vr=None,
+        latents=None,
+        original_mel=None,
+        rng=random,
+        max_start_idx=None,
+    ):
+        """Sample of a random window of one video, None if the video is too short.
+
+        The frames come from `latents` (VAE latent distributions) when given, else from the `vr` reader. `vr` is only
+        read with latents for pixel-space supervision. `original_mel` defaults to the cached mel of `video_path`. The
+        windows are drawn with `rng`, the target one starts at `max_start_idx` at the latest.
+        """
+        total_num_frames = len(latents) if latents is not None else len(vr)
+        if total_num_frames < 3 * self.num_frames:
+            return None
+
+        if latents is not None:
+            if self.mask != "fix_mask":
+                raise ValueError("Latents only support the fixed mask")
+            gt_frames_index, ref_frames_index, start_idx = self.get_frames_index(total_num_frames, rng, max_start_idx)
+        else:
+            gt_frames, ref_frames, start_idx = self.get_frames(vr, rng, max_start_idx)
+
+        if self.load_audio_data:
+            if original_mel is None:
+                original_mel = self.load_mel(video_path)
+            mel = self.crop_audio_window(original_mel, start_idx)
+
+            if mel.shape[-1] != self.mel_window_length:
+                return None
+        else:
+            mel = []
+
+        if self.audio_embeds_store is not None:
+            if video_path not in self.audio_embeds_store:
+                return None
+            audio_feat = self.audio_embeds_store.video_rows(video_path)  # (t, layers, embedding_dim)
+            audio_feat_index = overlap_audio_window_index(
+                start_idx, self.num_frames, self.audio_feat_length, len(audio_feat), self.video_fps
+            )
+            audio_embeds = torch.from_numpy(audio_feat[audio_feat_index])
+            audio_embeds = audio_embeds.reshape(self.num_frames, -1, audio_feat.shape[-1])  # (f, 50, embedding_dim)
+
+        if latents is not None:
+            sample = self.get_latent_sample(image_processor, vr, latents, gt_frames_index, ref_frames_index)
+        else:
+            gt_pixel_values, masked_pixel_values, masks = image_processor.prepare_masks_and_masked_images(
+                gt_frames, affine_transform=False
+            )  # (f, c, h, w)
+            ref_pixel_values = image_processor.process_images(ref_frames)
+            sample = dict(
+                gt_pixel_values=gt_pixel_values,
+                masked_pixel_values=masked_pixel_values,
+                ref_pixel_values=ref_pixel_values,
+                masks=masks,
+            )
+
+        sample.update(mel=mel, video_path=video_path, start_idx=start_idx)
+        if self.audio_embeds_store is not None:
+            sample["audio_embeds"] = audio_embeds
+        return sample
+
+    def make_sample(self, clip: dict):
+        """Sample of a random window of a clip streamed by ShardedClipDataset, None if the clip is too short."""
+        image_processor: ImageProcessor = getattr(self, f"image_processor_{self.worker_id}")
+        latents = clip.get("latents")
+        vr = None
+        if latents is None or self.load_gt_pixel_values:
+            vr = VideoReader(io.BytesIO(clip["video_bytes"]), ctx=cpu(self.worker_id))
+        original_mel = torch.from_numpy(clip["mel"]) if "mel" in clip else None
+        try:
+            return self.get_sample(image_processor, clip["metadata"]["video_path"], vr, latents, original_mel)
+        finally:
+            if vr is not None:
+                vr.seek(0)  # avoid memory leak
+
+    def open_video(self, video_path: str):
+        latents = None
+        vr = None
+        if self.latent_store is not None:
+            latents = self.latent_store.video_latents(video_path)
+        if latents is None or self.load_gt_pixel_values:
+            vr = VideoReader(video_path, ctx=cpu(self.worker_id))
+        return vr, latents
+
+    def get_indexed_sample(self, image_processor: ImageProcessor, clip_index: int, sample_seed: int):
+        """Sample of the clip drawn by ClipSampler, its windows depend on nothing but `sample_seed`."""
+        video_path = self.video_paths[clip_index]
+        vr, latents = self.open_video(video_path)
+        try:
+            return self.get_sample(
+                image_processor,
+                video_path,
+                vr,
+                latents,
+                rng=random.Random(sample_seed),
+                max_start_idx=self.max_start_idxs[clip_index],
+            )
+        finally:
+            if vr is not None:
+                vr.seek(0)  # avoid memory leak
+
+    def indexed_start_idx(self, clip_index: int, sample_seed: int) -> int:
+        """Start frame of the target window `get_indexed_sample` draws, without reading the clip."""
+        return random.Random(sample_seed).randint(0, self.max_start_idxs[clip_index])
+
     def __getitem__(self, idx):
         image_processor: ImageProcessor = getattr(self, f"image_processor_{self.worker_id}")
+        if isinstance(idx, (tuple, list)):
+            clip_index, sample_seed = idx
+            try:
+                sample = self.get_indexed_sample(image_processor, clip_index, sample_seed)
+                if sample is not None:
+                    return sample
+            except Exception as e:
+                print(f"{type(e).__name__} - {e} - {self.video_paths[clip_index]}")
+            # The index said the clip is fine, fall back to a random one rather than fail the step
+
         while True:
             try:
                 idx = random.randint(0, len(self) - 1)
@@ -101,58 +335,18 @@ class UNetDataset(Dataset):
                 # Get video file path
                 video_path = self.video_paths[idx]
 
-                vr = VideoReader(video_path, ctx=cpu(self.worker_id))
-
-                if len(vr) < 3 * self.num_frames:
-                    continue
-
-                gt_frames, ref_frames, start_idx = self.get_frames(vr)
-
-                if self.load_audio_data:
-                    mel_cache_path = os.path.join(
-                        self.audio_mel_cache_dir, os.path.basename(video_path).replace(".mp4", "_mel.pt")
-                    )
-
-                    if os.path.isfile(mel_cache_path):
-                        try:
-                            original_mel = torch.load(mel_cache_path, weights_only=True)
-                        except Exception as e:
-                            print(f"{type(e).__name__} - {e} - {mel_cache_path}")
-                            os.remove(mel_cache_path)
-                            original_mel = self.read_audio(video_path)
-                            torch.save(original_mel, mel_cache_path)
-                    else:
-                        original_mel = self.read_audio(video_path)
-                        torch.save(original_mel, mel_cache_path)
-
-                    mel = self.crop_audio_window(original_mel, start_idx)
-
-                    if mel.shape[-1] != self.mel_window_length:
-                        continue
-                else:
-                    mel = []
-
-                gt_pixel_values, masked_pixel_values, masks = image_processor.prepare_masks_and_masked_images(
-                    gt_frames, affine_transform=False
-                )  # (f, c, h, w)
-                ref_pixel_values = image_processor.process_images(ref_frames)
+                vr = None
+                vr, latents = self.open_video(video_path)
+                sample = self.get_sample(image_processor, video_path, vr, latents)
 
-                vr.seek(0)  # avoid memory leak
-                break
+                if vr is not None:
+                    vr.seek(0)  # avoid memory leak
+                if sample is not None:
+                    break
 
             except Exception as e:  # Handle the exception of face not detcted
                 print(f"{type(e).__name__} - {e} - {video_path}")
-                if "vr" in locals():
+                if vr is not None:
                     vr.seek(0)  # avoid memory leak
 
-        sample = dict(
-            gt_pixel_values=gt_pixel_values,
-            masked_pixel_values=masked_pixel_values,
-            ref_pixel_values=ref_pixel_values,
-            mel=mel,
-            masks=masks,
-            video_path=video_path,
-            start_idx=start_idx,
-        )
-
         return sample
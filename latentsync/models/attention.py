@@ -81,9 +81,14 @@ class Transformer3DModel(ModelMixin, ConfigMixin):
 
     def forward(self, hidden_states, encoder_hidden_states=None, timestep=None, return_dict: bool = True):
         # Input
-        assert hidden_states.dim() == 5, f"Expected hidden_states to have ndim=5, but got ndim={hidden_states.dim()}."
-        video_length = hidden_states.shape[2]
-        hidden_states = rearrange(hidden_states, "b c f h w -> (b f) c h w")
+        assert hidden_states.dim() in (4, 5), f"Expected hidden_states to have ndim=4 or 5, got {hidden_states.dim()}."
+        # 4D inputs are already folded to `(b f) c h w`, the spatial attention never needs the frame axis
+        folded = hidden_states.dim() == 4
+        if folded:
+            video_length = None
+        else:
+            video_length = hidden_states.shape[2]
+            hidden_states = rearrange(hidden_states, "b c f h w -> (b f) c h w")
 
         batch, channel, height, weight = hidden_states.shape
         residual = hidden_states
@@ -108,16 +113,22 @@ class Transformer3DModel(ModelMixin, ConfigMixin):
             )
 
         # Output
+        # The permuted view is already laid out as channels_last, which the folded layout keeps instead of copying
         if not self.use_linear_projection:
-            hidden_states = hidden_states.reshape(batch, height, weight, inner_dim).permute(0, 3, 1, 2).contiguous()
+            hidden_states = hidden_states.reshape(batch, height, weight, inner_dim).permute(0, 3, 1, 2)
+            if not folded:
+                hidden_states = hidden_states.contiguous()
             hidden_states = self.proj_out(hidden_states)
         else:
             hidden_states = self.proj_out(hidden_states)
-            hidden_states = hidden_states.reshape(batch, height, weight, inner_dim).permute(0, 3, 1, 2).contiguous()
+            hidden_states = hidden_states.reshape(batch, height, weight, inner_dim).permute(0, 3, 1, 2)
+            if not folded:
+                hidden_states = hidden_states.contiguous()
 
         output = hidden_states + residual
 
-        output = rearrange(output, "(b f) c h w -> b c f h w", f=video_length)
+        if not folded:
+            output = rearrange(output, "(b f) c h w -> b c f h w", f=video_length)
         if not return_dict:
             return (output,)
 
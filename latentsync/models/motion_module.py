@@ -67,7 +67,11 @@ class VanillaTemporalModule(nn.Module):
 
     def forward(self, input_tensor, temb, encoder_hidden_states, attention_mask=None, anchor_frame_idx=None):
         hidden_states = input_tensor
-        hidden_states = self.temporal_transformer(hidden_states, encoder_hidden_states, attention_mask)
+        # In the folded layout the frame count is recovered from the unfolded batch size of the time embedding
+        video_length = input_tensor.shape[0] // temb.shape[0] if input_tensor.dim() == 4 else None
+        hidden_states = self.temporal_transformer(
+            hidden_states, encoder_hidden_states, attention_mask, video_length=video_length
+        )
 
         output = hidden_states
         return output
@@ -123,10 +127,15 @@ class TemporalTransformer3DModel(nn.Module):
         )
         self.proj_out = nn.Linear(inner_dim, in_channels)
 
-    def forward(self, hidden_states, encoder_hidden_states=None, attention_mask=None):
-        assert hidden_states.dim() == 5, f"Expected hidden_states to have ndim=5, but got ndim={hidden_states.dim()}."
-        video_length = hidden_states.shape[2]
-        hidden_states = rearrange(hidden_states, "b c f h w -> (b f) c h w")
+    def forward(self, hidden_states, encoder_hidden_states=None, attention_mask=None, video_length=None):
+        # 4D inputs are already folded to `(b f) c h w` and need the frame count passed in
+        folded = hidden_states.dim() == 4
+        if folded:
+            assert video_length is not None, "video_length is required for folded hidden_states"
+        else:
+            assert hidden_states.dim() == 5, f"Expected hidden_states to have ndim=5, got ndim={hidden_states.dim()}."
+            video_length = hidden_states.shape[2]
+            hidden_states = rearrange(hidden_states, "b c f h w -> (b f) c h w")
 
         batch, channel, height, weight = hidden_states.shape
         residual = hidden_states
@@ -143,10 +152,13 @@ class TemporalTransformer3DModel(nn.Module):
 
         # output
         hidden_states = self.proj_out(hidden_states)
-        hidden_states = hidden_states.reshape(batch, height, weight, channel).permute(0, 3, 1, 2).contiguous()
+        hidden_states = hidden_states.reshape(batch, height, weight, channel).permute(0, 3, 1, 2)
+        if not folded:
+            hidden_states = hidden_states.contiguous()
 
         output = hidden_states + residual
-        output = rearrange(output, "(b f) c h w -> b c f h w", f=video_length)
+        if not folded:
+            output = rearrange(output, "(b f) c h w -> b c f h w", f=video_length)
 
         return output
 
@@ -9,6 +9,10 @@ from einops import rearrange
 
 class InflatedConv3d(nn.Conv2d):
     def forward(self, x):
+        # Inputs that are already folded to `(b f) c h w` go straight through, see `enable_folded_layout`
+        if x.dim() == 4:
+            return super().forward(x)
+
         video_length = x.shape[2]
 
         x = rearrange(x, "b c f h w -> (b f) c h w")
@@ -20,6 +24,9 @@ class InflatedConv3d(nn.Conv2d):
 
 class InflatedGroupNorm(nn.GroupNorm):
     def forward(self, x):
+        if x.dim() == 4:
+            return super().forward(x)
+
         video_length = x.shape[2]
 
         x = rearrange(x, "b c f h w -> (b f) c h w")
@@ -29,6 +36,20 @@ class InflatedGroupNorm(nn.GroupNorm):
         return x
 
 
+def group_norm_over_frames(norm: nn.GroupNorm, x: torch.Tensor, video_length: int) -> torch.Tensor:
+    # A plain nn.GroupNorm applied to `b c f h w` pools its statistics over all frames. This computes the same
+    # normalization on a folded `(b f) c h w` tensor through views only, so the memory format is preserved
+    batch_frames, channels, height, width = x.shape
+    grouped = x.reshape(
+        batch_frames // video_length, video_length, norm.num_groups, channels // norm.num_groups, height, width
+    )
+    var, mean = torch.var_mean(grouped, dim=(1, 3, 4, 5), keepdim=True, correction=0)
+    x = ((grouped - mean) * torch.rsqrt(var + norm.eps)).reshape(batch_frames, channels, height, width)
+    if norm.affine:
+        x = x * norm.weight[:, None, None] + norm.bias[:, None, None]
+    return x
+
+
 class Upsample3D(nn.Module):
     def __init__(self, channels, use_conv=False, use_conv_transpose=False, out_channels=None, name="conv"):
         super().__init__()
@@ -62,7 +83,8 @@ class Upsample3D(nn.Module):
         # if `output_size` is passed we force the interpolation output
         # size and do not make use of `scale_factor=2`
         if output_size is None:
-            hidden_states = F.interpolate(hidden_states, scale_factor=[1.0, 2.0, 2.0], mode="nearest")
+            scale_factor = 2.0 if hidden_states.dim() == 4 else [1.0, 2.0, 2.0]
+            hidden_states = F.interpolate(hidden_states, scale_factor=scale_factor, mode="nearest")
         else:
             hidden_states = F.interpolate(hidden_states, size=output_size, mode="nearest")
 
@@ -179,10 +201,18 @@ class ResnetBlock3D(nn.Module):
         if self.use_in_shortcut:
             self.conv_shortcut = InflatedConv3d(in_channels, out_channels, kernel_size=1, stride=1, padding=0)
 
+    def apply_norm(self, norm, hidden_states, video_length):
+        if video_length is None or isinstance(norm, InflatedGroupNorm):
+            return norm(hidden_states)
+        return group_norm_over_frames(norm, hidden_states, video_length)
+
     def forward(self, input_tensor, temb):
         hidden_states = input_tensor
 
-        hidden_states = self.norm1(hidden_states)
+        # In the folded layout the frame count is recovered from the unfolded batch size of the time embedding
+        video_length = input_tensor.shape[0] // temb.shape[0] if input_tensor.dim() == 4 else None
+
+        hidden_states = self.apply_norm(self.norm1, hidden_states, video_length)
         hidden_states = self.nonlinearity(hidden_states)
 
         hidden_states = self.conv1(hidden_states)
@@ -201,10 +231,13 @@ class ResnetBlock3D(nn.Module):
                 temb = temb.permute(0, 2, 1)
                 temb = temb[:, :, :, None, None]
 
+            if video_length is not None:
+                temb = rearrange(temb.expand(-1, -1, video_length, -1, -1), "b c f h w -> (b f) c h w")
+
         if temb is not None and self.time_embedding_norm == "default":
             hidden_states = hidden_states + temb
 
-        hidden_states = self.norm2(hidden_states)
+        hidden_states = self.apply_norm(self.norm2, hidden_states, video_length)
 
         if temb is not None and self.time_embedding_norm == "scale_shift":
             scale, shift = torch.chunk(temb, 2, dim=1)
@@ -7,6 +7,7 @@ import copy
 import torch
 import torch.nn as nn
 import torch.utils.checkpoint
+from einops import rearrange
 
 from diffusers.configuration_utils import ConfigMixin, register_to_config
 from diffusers.models import ModelMixin
@@ -22,7 +23,7 @@ from .unet_blocks import (
     get_down_block,
     get_up_block,
 )
-from .resnet import InflatedConv3d, InflatedGroupNorm
+from .resnet import InflatedConv3d, InflatedGroupNorm, group_norm_over_frames
 
 from ..utils.util import zero_rank_log
 from .utils import zero_module
@@ -240,6 +241,24 @@ class UNet3DConditionModel(ModelMixin, ConfigMixin):
 
         self.conv_out = zero_module(InflatedConv3d(block_out_channels[0], out_channels, kernel_size=3, padding=1))
 
+        self.folded_layout = False
+        self.folded_channels_last = False
+
+    def enable_folded_layout(self, channels_last: bool = True):
+        r"""
+        Run the UNet on a folded `(b f) c h w` layout. The input is folded once and unfolded once per forward, and
+        every inflated op in between works on the folded tensor directly instead of rearranging around each op.
+        With `channels_last`, the 2D convolutions and the attention projections also avoid NCHW <-> NHWC copies.
+        """
+        self.folded_layout = True
+        self.folded_channels_last = channels_last
+        if channels_last:
+            self.to(memory_format=torch.channels_last)
+
+    def disable_folded_layout(self):
+        self.folded_layout = False
+        self.to(memory_format=torch.contiguous_format)
+
     def set_attention_slice(self, slice_size):
         r"""
         Enable sliced attention computation.
@@ -391,6 +410,12 @@ class UNet3DConditionModel(ModelMixin, ConfigMixin):
             class_emb = self.class_embedding(class_labels).to(dtype=self.dtype)
             emb = emb + class_emb
 
+        video_length = sample.shape[2]
+        if self.folded_layout:
+            sample = rearrange(sample, "b c f h w -> (b f) c h w")
+            if self.folded_channels_last:
+                sample = sample.contiguous(memory_format=torch.channels_last)
+
         # pre-process
         sample = self.conv_in(sample)
 
@@ -417,6 +442,8 @@ class UNet3DConditionModel(ModelMixin, ConfigMixin):
             for i, down_block_additional_residual in enumerate(down_block_additional_residuals):
                 if down_block_additional_residual.dim() == 4:  # boardcast
                     down_block_additional_residual = down_block_additional_residual.unsqueeze(2)
+                if self.folded_layout:
+                    down_block_additional_residual = self.fold_residual(down_block_additional_residual, video_length)
                 down_block_res_samples[i] = down_block_res_samples[i] + down_block_additional_residual
 
         # mid
@@ -428,6 +455,8 @@ class UNet3DConditionModel(ModelMixin, ConfigMixin):
         if mid_block_additional_residual is not None:
             if mid_block_additional_residual.dim() == 4:  # boardcast
                 mid_block_additional_residual = mid_block_additional_residual.unsqueeze(2)
+            if self.folded_layout:
+                mid_block_additional_residual = self.fold_residual(mid_block_additional_residual, video_length)
             sample = sample + mid_block_additional_residual
 
         # up
@@ -461,15 +490,26 @@ class UNet3DConditionModel(ModelMixin, ConfigMixin):
                 )
 
         # post-process
-        sample = self.conv_norm_out(sample)
+        if self.folded_layout and not isinstance(self.conv_norm_out, InflatedGroupNorm):
+            sample = group_norm_over_frames(self.conv_norm_out, sample, video_length)
+        else:
+            sample = self.conv_norm_out(sample)
         sample = self.conv_act(sample)
         sample = self.conv_out(sample)
 
+        if self.folded_layout:
+            sample = rearrange(sample, "(b f) c h w -> b c f h w", f=video_length)
+
         if not return_dict:
             return (sample,)
 
         return UNet3DConditionOutput(sample=sample)
 
+    @staticmethod
+    def fold_residual(residual, video_length):
+        residual = residual.expand(-1, -1, video_length, -1, -1)
+        return rearrange(residual, "b c f h w -> (b f) c h w")
+
     def load_state_dict(self, state_dict, strict=True):
         # If the loaded checkpoint's in_channels or out_channels are different from config
         if state_dict["conv_in.weight"].shape[1] != self.config.in_channels:
@@ -492,21 +532,168 @@ class UNet3DConditionModel(ModelMixin, ConfigMixin):
         return super().load_state_dict(state_dict=state_dict, strict=strict)
 
     @classmethod
-    def from_pretrained(cls, model_config: dict, ckpt_path: str, device="cpu"):
-        unet = cls.from_config(model_config).to(device)
-        if ckpt_path != "":
-            zero_rank_log(logger, f"Load from checkpoint: {ckpt_path}")
-            ckpt = torch.load(ckpt_path, map_location=device, weights_only=True)
-            if "global_step" in ckpt:
-                zero_rank_log(logger, f"resume from global_step: {ckpt['global_step']}")
-                resume_global_step = ckpt["global_step"]
+    def from_pretrained(
+        cls,
+        model_config: dict,
+        ckpt_path: str,
+        device="cpu",
+        dtype=None,
+        prune_motion_modules=False,
+        prune_threshold=0.0,
+        calibration_batch=None,
+    ):
+        if ckpt_path.endswith(".safetensors"):
+            unet, resume_global_step = cls.from_safetensors(model_config, ckpt_path, device=device, dtype=dtype)
+        else:
+            unet = cls.from_config(model_config).to(device)
+            if ckpt_path != "":
+                zero_rank_log(logger, f"Load from checkpoint: {ckpt_path}")
+                ckpt = torch.load(ckpt_path, map_location=device, weights_only=True)
+                if "global_step" in ckpt:
+                    zero_rank_log(logger, f"resume from global_step: {ckpt['global_step']}")
+                    resume_global_step = ckpt["global_step"]
+                else:
+                    resume_global_step = 0
+                unet.load_state_dict(ckpt["state_dict"], strict=False)
+
+                del ckpt
+                torch.cuda.empty_cache()
             else:
                 resume_global_step = 0
-            unet.load_state_dict(ckpt["state_dict"], strict=False)
 
-            del ckpt
-            torch.cuda.empty_cache()
+            if dtype is not None:
+                unet = unet.to(dtype=dtype)
+
+        if prune_motion_modules:
+            unet.prune_inert_motion_modules(threshold=prune_threshold, calibration_batch=calibration_batch)
+
+        return unet, resume_global_step
+
+    def named_motion_modules(self):
+        blocks = list(self.down_blocks) + [self.mid_block] + list(self.up_blocks)
+        block_names = (
+            [f"down_blocks.{i}" for i in range(len(self.down_blocks))]
+            + ["mid_block"]
+            + [f"up_blocks.{i}" for i in range(len(self.up_blocks))]
+        )
+        for block_name, block in zip(block_names, blocks):
+            for i, motion_module in enumerate(getattr(block, "motion_modules", [])):
+                if motion_module is not None:
+                    yield f"{block_name}.motion_modules.{i}", block, i, motion_module
+
+    @torch.no_grad()
+    def motion_module_contributions(self, calibration_batch: dict):
+        # Relative change ||out - in|| / ||in|| that each motion module applies to its input on a calibration batch
+        contributions = {}
+        token_counts = {}
+        hooks = []
+
+        def make_hook(name):
+            def hook(module, inputs, output):
+                hidden_states = inputs[0].float()
+                contributions[name] = ((output.float() - hidden_states).norm() / hidden_states.norm()).item()
+                token_counts[name] = hidden_states.numel() // hidden_states.shape[1]
+
+            return hook
+
+        for name, _, _, motion_module in self.named_motion_modules():
+            hooks.append(motion_module.register_forward_hook(make_hook(name)))
+        try:
+            output = self(**calibration_batch).sample
+        finally:
+            for hook in hooks:
+                hook.remove()
+        return contributions, token_counts, output
+
+    @torch.no_grad()
+    def prune_inert_motion_modules(self, threshold: float = 0.0, calibration_batch: Optional[dict] = None):
+        r"""
+        Replace motion modules that do not change their input with identity (`None`, which the blocks skip).
+
+        A module is inert when its output projection is exactly zero, e.g. a `zero_initialize` module that was
+        never trained, which makes it an identity by construction. With a `calibration_batch` (keyword arguments
+        of `forward`) and `threshold` > 0, modules whose relative contribution is at most `threshold` are pruned
+        too, and the UNet output before and after pruning is compared on that batch.
+        """
+        candidates = list(self.named_motion_modules())
+        if len(candidates) == 0:
+            return []
+
+        contributions, token_counts, reference_output = {}, {}, None
+        if calibration_batch is not None:
+            contributions, token_counts, reference_output = self.motion_module_contributions(calibration_batch)
+
+        pruned = []
+        pruned_params = 0
+        pruned_macs = 0
+        for name, block, index, motion_module in candidates:
+            proj_out = motion_module.temporal_transformer.proj_out
+            is_zero = not proj_out.weight.any() and (proj_out.bias is None or not proj_out.bias.any())
+            if not is_zero and not (name in contributions and contributions[name] <= threshold):
+                continue
+
+            # Every linear layer costs one MAC per weight per token, the temporal attention itself is negligible
+            num_params = sum(p.numel() for p in motion_module.parameters())
+            linear_weights = sum(m.weight.numel() for m in motion_module.modules() if isinstance(m, nn.Linear))
+            pruned_params += num_params
+            pruned_macs += linear_weights * token_counts.get(name, 0)
+            block.motion_modules[index] = None
+            pruned.append(name)
+
+        if len(pruned) == 0:
+            zero_rank_log(logger, "No inert motion modules found")
+            return pruned
+
+        message = (
+            f"Pruned {len(pruned)}/{len(candidates)} inert motion modules, "
+            f"{pruned_params / 1e6:.1f}M parameters removed"
+        )
+        if calibration_batch is not None:
+            message += f", {pruned_macs / 1e9:.1f} GMACs saved per forward on the calibration batch"
+            pruned_output = self(**calibration_batch).sample
+            max_diff = (pruned_output.float() - reference_output.float()).abs().max().item()
+            message += f", max abs output difference {max_diff:.3e}"
         else:
-            resume_global_step = 0
+            message += " (output projections are all zero, so the pruned UNet is numerically identical)"
+        zero_rank_log(logger, message)
+        return pruned
+
+    @classmethod
+    def from_safetensors(cls, model_config: dict, ckpt_path: str, device="cpu", dtype=None):
+        # Build the module on the meta device and materialize every tensor straight from the memory-mapped
+        # file in the target dtype and device, so the weights are never held twice in host memory
+        from accelerate import init_empty_weights
+        from accelerate.utils import set_module_tensor_to_device
+        from safetensors import safe_open
+
+        zero_rank_log(logger, f"Load from checkpoint: {ckpt_path}")
+        with init_empty_weights():
+            unet = cls.from_config(model_config)
+
+        expected_shapes = {name: tuple(tensor.shape) for name, tensor in unet.state_dict().items()}
+        with safe_open(ckpt_path, framework="pt", device="cpu") as f:
+            metadata = f.metadata() or {}
+            keys = list(f.keys())
+            # Checkpoints whose layout differs from the config (e.g. other in_channels or cross_attention_dim)
+            # need the partial loading rules of `load_state_dict`, so they go through the eager path
+            compatible = set(keys) == set(expected_shapes) and all(
+                tuple(f.get_slice(key).get_shape()) == expected_shapes[key] for key in keys
+            )
+            if compatible:
+                for key in keys:
+                    set_module_tensor_to_device(unet, key, device, value=f.get_tensor(key), dtype=dtype)
+
+        if not compatible:
+            zero_rank_log(logger, "Checkpoint does not match the model config, falling back to eager loading")
+            from safetensors.torch import load_file
+
+            unet = cls.from_config(model_config).to(device)
+            unet.load_state_dict(load_file(ckpt_path, device=str(device)), strict=False)
+            if dtype is not None:
+                unet = unet.to(dtype=dtype)
+
+        resume_global_step = int(metadata.get("global_step", 0))
+        if resume_global_step != 0:
+            zero_rank_log(logger, f"resume from global_step: {resume_global_step}")
 
         return unet, resume_global_step
@@ -2,9 +2,14 @@
 
 import inspect
 import os
+import copy
 import shutil
-from typing import Callable, List, Optional, Union
-import subprocess
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, List, Optional, Set, Union
 
 import numpy as np
 import torch
@@ -22,6 +27,7 @@ from diffusers.schedulers import (
     EulerDiscreteScheduler,
     LMSDiscreteScheduler,
     PNDMScheduler,
+    UniPCMultistepScheduler,
 )
 from diffusers.utils import deprecate, logging
 
@@ -31,13 +37,28 @@ import cv2
 from ..models.unet import UNet3DConditionModel
 from ..utils.util import read_video, read_audio, write_video, check_ffmpeg_installed
 from ..utils.image_processor import ImageProcessor, load_fixed_mask
+from ..utils.journal import WindowJournal
+from ..utils.stages import StageMetrics, prefetch
+from ..utils.video_encoder import OrderedEncoder
 from ..whisper.audio2feature import Audio2Feature
 import tqdm
-import soundfile as sf
 
 logger = logging.get_logger(__name__)  # pylint: disable=invalid-name
 
 
+class LipsyncInterrupted(Exception):
+    """Raised between windows or denoising steps when `should_stop` returns True."""
+
+    def __init__(self, num_frames_done: int):
+        super().__init__(f"Lipsync interrupted after {num_frames_done} frames")
+        self.num_frames_done = num_frames_done
+
+
+def window_seed(seed: int, window_index: int) -> int:
+    """Seed of the generator of window `window_index` in a run seeded with `seed`."""
+    return (seed * 1000003 + window_index) % (2**63)
+
+
 class LipsyncPipeline(DiffusionPipeline):
     _optional_components = []
 
@@ -53,6 +74,7 @@ class LipsyncPipeline(DiffusionPipeline):
             EulerDiscreteScheduler,
             EulerAncestralDiscreteScheduler,
             DPMSolverMultistepScheduler,
+            UniPCMultistepScheduler,
         ],
     ):
         super().__init__()
@@ -137,9 +159,22 @@ class LipsyncPipeline(DiffusionPipeline):
                 return torch.device(module._hf_hook.execution_device)
         return self.device
 
+    def for_job(self):
+        """A pipeline sharing the models of this one, with its own scheduler and face processor.
+
+        The scheduler and the face processor keep per-video state, so jobs running at the same time in threads each
+        need their own pipeline; the weights are not copied.
+        """
+        return LipsyncPipeline(
+            vae=self.vae,
+            audio_encoder=self.audio_encoder,
+            denoising_unet=self.denoising_unet,
+            scheduler=copy.deepcopy(self.scheduler),
+        )
+
     def decode_latents(self, latents):
         latents = latents / self.vae.config.scaling_factor + self.vae.config.shift_factor
-        latents = rearrange(latents, "b c f h w -> (b f) c h w")
+        latents = rearrange(latents, "b c f h w -> (b f) c h w").to(dtype=self.vae.dtype)
         decoded_latents = self.vae.decode(latents).sample
         return decoded_latents
 
@@ -182,7 +217,9 @@ class LipsyncPipeline(DiffusionPipeline):
             height // self.vae_scale_factor,
             width // self.vae_scale_factor,
         )
-        rand_device = "cpu" if device.type == "mps" else device
+        # A CPU generator draws the same noise whatever device the run is on
+        cpu_generator = isinstance(generator, torch.Generator) and generator.device.type == "cpu"
+        rand_device = "cpu" if device.type == "mps" or cpu_generator else device
         latents = torch.randn(shape, generator=generator, device=rand_device, dtype=dtype).to(device)
         latents = latents.repeat(1, 1, num_frames, 1, 1)
 
@@ -199,7 +236,7 @@ class LipsyncPipeline(DiffusionPipeline):
         mask = torch.nn.functional.interpolate(
             mask, size=(height // self.vae_scale_factor, width // self.vae_scale_factor)
         )
-        masked_image = masked_image.to(device=device, dtype=dtype)
+        masked_image = masked_image.to(device=device, dtype=self.vae.dtype)
 
         # encode the mask image into latents space so we can concatenate it to the latents
         masked_image_latents = self.vae.encode(masked_image).latent_dist.sample(generator=generator)
@@ -220,9 +257,10 @@ class LipsyncPipeline(DiffusionPipeline):
         return mask, masked_image_latents
 
     def prepare_image_latents(self, images, device, dtype, generator, do_classifier_free_guidance):
-        images = images.to(device=device, dtype=dtype)
+        images = images.to(device=device, dtype=self.vae.dtype)
         image_latents = self.vae.encode(images).latent_dist.sample(generator=generator)
         image_latents = (image_latents - self.vae.config.shift_factor) * self.vae.config.scaling_factor
+        image_latents = image_latents.to(dtype=dtype)
         image_latents = rearrange(image_latents, "f c h w -> 1 c f h w")
         image_latents = torch.cat([image_latents] * 2) if do_classifier_free_guidance else image_latents
 
@@ -280,16 +318,28 @@ class LipsyncPipeline(DiffusionPipeline):
             out_frames.append(out_frame)
         return np.stack(out_frames, axis=0)
 
-    @torch.no_grad()
-    def __call__(
+    def iter_aligned_windows(self, video_frames: np.ndarray, num_frames: int = 16):
+        """Align the faces of `video_frames` one window at a time and yield (faces, boxes, affine_matrices).
+
+        The landmark smoothing carries over from frame to frame, so the windows are aligned in order.
+        """
+        for start in range(0, len(video_frames) - num_frames + 1, num_frames):
+            faces = []
+            boxes = []
+            affine_matrices = []
+            for frame in video_frames[start : start + num_frames]:
+                face, box, affine_matrix = self.image_processor.affine_transform(frame)
+                faces.append(face)
+                boxes.append(box)
+                affine_matrices.append(affine_matrix)
+            yield torch.stack(faces), boxes, affine_matrices
+
+    def iter_denoised_windows(
         self,
-        video_path: str,
-        audio_path: str,
-        video_out_path: str,
-        video_mask_path: str = None,
+        video_frames: np.ndarray,
+        whisper_feature: torch.Tensor,
         num_frames: int = 16,
         video_fps: int = 25,
-        audio_sample_rate: int = 16000,
         height: Optional[int] = None,
         width: Optional[int] = None,
         num_inference_steps: int = 20,
@@ -298,21 +348,49 @@ class LipsyncPipeline(DiffusionPipeline):
         eta: float = 0.0,
         mask: str = "fix_mask",
         mask_image_path: str = "latentsync/utils/mask.png",
+        landmark_backend: Optional[str] = None,
+        distilled: bool = False,
         generator: Optional[Union[torch.Generator, List[torch.Generator]]] = None,
         callback: Optional[Callable[[int, int, torch.FloatTensor], None]] = None,
         callback_steps: Optional[int] = 1,
-        **kwargs,
+        should_stop: Optional[Callable[[], bool]] = None,
+        seed: Optional[int] = None,
+        window_offset: int = 0,
+        whisper_chunks: Optional[List[torch.Tensor]] = None,
+        aligned_faces: Optional[tuple] = None,
+        aligned_windows: Optional[Iterator[tuple]] = None,
+        skip_windows: Optional[Set[int]] = None,
     ):
+        """Denoise `video_frames` (f, h, w, c) RGB uint8 at `video_fps` window by window, before the faces are pasted
+        back into the frames.
+
+        Yields (window index, number of windows, faces, boxes, affine_matrices) where faces are the generated aligned
+        faces of the window, to pass to `restore_video` with the window's frames. Only whole `num_frames` windows
+        covered by the audio are generated. `should_stop` is polled before every window and denoising step, when it
+        returns True `LipsyncInterrupted` is raised.
+
+        With `seed`, the initial noise (shared by all windows) comes from a CPU generator seeded with `seed` and the
+        VAE and scheduler sampling of every window from its own generator seeded with `window_seed(seed, index)`, so
+        a window renders the same whether the video is processed whole or in shards. A shard passes the index of
+        its first window as `window_offset`, its `whisper_chunks` (then `whisper_feature` is ignored) and the
+        (faces, boxes, affine_matrices) of its frames as `aligned_faces`, because the face alignment is smoothed
+        over consecutive frames and has to run over the whole video. `aligned_windows` instead yields the
+        (faces, boxes, affine_matrices) of one window at a time, as `iter_aligned_windows` does. The windows whose
+        index (counting from `window_offset`) is in `skip_windows` are aligned but not generated nor yielded.
+        """
         is_train = self.denoising_unet.training
         self.denoising_unet.eval()
 
-        check_ffmpeg_installed()
-
         # 0. Define call parameters
         batch_size = 1
         device = self._execution_device
         mask_image = load_fixed_mask(height, mask_image_path)
-        self.image_processor = ImageProcessor(height, mask=mask, device="cuda", mask_image=mask_image)
+        if aligned_faces is not None:
+            # The MediaPipe face mesh is only created when aligning, so no landmark model is loaded
+            landmark_backend = "mediapipe"
+        self.image_processor = ImageProcessor(
+            height, mask=mask, device=device.type, mask_image=mask_image, landmark_backend=landmark_backend
+        )
         self.set_progress_bar_config(desc=f"Sample frames: {num_frames}")
 
         # 1. Default height and width to unet
@@ -325,7 +403,8 @@ class LipsyncPipeline(DiffusionPipeline):
         # here `guidance_scale` is defined analog to the guidance weight `w` of equation (2)
         # of the Imagen paper: https://arxiv.org/pdf/2205.11487.pdf . `guidance_scale = 1`
         # corresponds to doing no classifier free guidance.
-        do_classifier_free_guidance = guidance_scale > 1.0
+        # A step-distilled UNet has the guidance baked in, so it runs a single conditional pass per step
+        do_classifier_free_guidance = guidance_scale > 1.0 and not distilled
 
         # 3. set timesteps
         self.scheduler.set_timesteps(num_inference_steps, device=device)
@@ -334,22 +413,37 @@ class LipsyncPipeline(DiffusionPipeline):
         # 4. Prepare extra step kwargs.
         extra_step_kwargs = self.prepare_extra_step_kwargs(generator, eta)
 
-        whisper_feature = self.audio_encoder.audio2feat(audio_path)
-        whisper_chunks = self.audio_encoder.feature2chunks(feature_array=whisper_feature, fps=video_fps)
-
-        audio_samples = read_audio(audio_path)
-        video_frames = read_video(video_path, use_decord=False)
+        if whisper_chunks is None:
+            whisper_chunks = self.audio_encoder.feature2chunks(feature_array=whisper_feature, fps=video_fps)
 
         num_inferences = min(len(video_frames), len(whisper_chunks)) // num_frames
         video_frames = video_frames[: num_inferences * num_frames]
-        faces, boxes, affine_matrices = self.affine_transform_video(video_frames)
+        if aligned_windows is None:
+            if aligned_faces is None:
+                faces, boxes, affine_matrices = self.affine_transform_video(video_frames)
+            else:
+                faces, boxes, affine_matrices = aligned_faces
+            aligned_windows = (
+                (
+                    faces[i * num_frames : (i + 1) * num_frames],
+                    boxes[i * num_frames : (i + 1) * num_frames],
+                    affine_matrices[i * num_frames : (i + 1) * num_frames],
+                )
+                for i in range(num_inferences)
+            )
 
         num_channels_latents = self.vae.config.latent_channels
 
         # Prepare latent variables
+        if seed is not None:
+            # The noise is the same for every frame, so one window of it serves all windows
+            num_latent_frames = num_frames
+            generator = torch.Generator(device="cpu").manual_seed(seed)
+        else:
+            num_latent_frames = num_frames * num_inferences
         all_latents = self.prepare_latents(
             batch_size,
-            num_frames * num_inferences,
+            num_latent_frames,
             num_channels_latents,
             height,
             width,
@@ -357,18 +451,15 @@ class LipsyncPipeline(DiffusionPipeline):
             device,
             generator,
         )
-        
-        # Set up temp directory for saving frames
-        temp_dir = "temp"
-        frames_dir = os.path.join(temp_dir, "frames")
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
-        os.makedirs(temp_dir, exist_ok=True)
-        os.makedirs(frames_dir, exist_ok=True)
-        
-        frame_index = 0
-        
+
+        def check_stop(num_windows_done):
+            if should_stop is not None and should_stop():
+                if is_train:
+                    self.denoising_unet.train()
+                raise LipsyncInterrupted(num_windows_done * num_frames)
+
         for i in tqdm.tqdm(range(num_inferences), desc="Doing inference..."):
+            check_stop(i)
             if self.denoising_unet.add_audio_layer:
                 audio_embeds = torch.stack(whisper_chunks[i * num_frames : (i + 1) * num_frames])
                 audio_embeds = audio_embeds.to(device, dtype=weight_dtype)
@@ -377,10 +468,19 @@ class LipsyncPipeline(DiffusionPipeline):
                     audio_embeds = torch.cat([null_audio_embeds, audio_embeds])
             else:
                 audio_embeds = None
-            inference_faces = faces[i * num_frames : (i + 1) * num_frames]
-            latents = all_latents[:, :, i * num_frames : (i + 1) * num_frames]
+            inference_faces, window_boxes, window_affine_matrices = next(aligned_windows)
+            if skip_windows and window_offset + i in skip_windows:
+                # Still aligned above, the smoothing of the next windows depends on it
+                continue
+            if seed is None:
+                latents = all_latents[:, :, i * num_frames : (i + 1) * num_frames]
+            else:
+                latents = all_latents
+                generator = torch.Generator(device="cpu").manual_seed(window_seed(seed, window_offset + i))
+                extra_step_kwargs = self.prepare_extra_step_kwargs(generator, eta)
+            # The uint8 faces go to the device first, the masks are then prepared there in one batch
             ref_pixel_values, masked_pixel_values, masks = self.image_processor.prepare_masks_and_masked_images(
-                inference_faces, affine_transform=False
+                inference_faces.to(device), affine_transform=False
             )
 
             # 7. Prepare mask latent variables
@@ -405,9 +505,13 @@ class LipsyncPipeline(DiffusionPipeline):
             )
 
             # 9. Denoising loop
+            # Multistep schedulers keep their step index and previous model outputs, so reset them per window
+            self.scheduler.set_timesteps(num_inference_steps, device=device)
+            timesteps = self.scheduler.timesteps
             num_warmup_steps = len(timesteps) - num_inference_steps * self.scheduler.order
             with self.progress_bar(total=num_inference_steps) as progress_bar:
                 for j, t in enumerate(timesteps):
+                    check_stop(i)
                     # expand the latents if we are doing classifier free guidance
                     denoising_unet_input = torch.cat([latents] * 2) if do_classifier_free_guidance else latents
                     
@@ -442,40 +546,288 @@ class LipsyncPipeline(DiffusionPipeline):
             decoded_latents = self.paste_surrounding_pixels_back(
                 decoded_latents, ref_pixel_values, 1 - masks, device, weight_dtype
             )
-            
-            # Process batch and save frames to disk
-            batch_frames = self.restore_video(
-                decoded_latents, video_frames[i * num_frames : (i + 1) * num_frames], 
-                boxes[i * num_frames : (i + 1) * num_frames], 
-                affine_matrices[i * num_frames : (i + 1) * num_frames]
-            )
-            
-            # Save each frame in this batch as a JPG
-            for frame in batch_frames:
-                cv2.imwrite(os.path.join(frames_dir, f"frame_{frame_index:06d}.jpg"), cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
-                frame_index += 1
-            
+            yield i, num_inferences, decoded_latents, window_boxes, window_affine_matrices
+
             # Clear CUDA cache to prevent memory issues
             if torch.cuda.is_available():
                 torch.cuda.empty_cache()
 
-        audio_samples_remain_length = int(frame_index / video_fps * audio_sample_rate)
-        audio_samples = audio_samples[:audio_samples_remain_length].cpu().numpy()
-
         if is_train:
             self.denoising_unet.train()
 
-        # Save audio
-        sf.write(os.path.join(temp_dir, "audio.wav"), audio_samples, audio_sample_rate)
-        
-        # Create video from frames using ffmpeg
-        frames_path = os.path.join(frames_dir, "frame_%06d.jpg")
-        video_temp_path = os.path.join(temp_dir, "video.mp4")
-        
-        # Create video from frames
-        command = f"ffmpeg -y -loglevel error -framerate {video_fps} -i {frames_path} -c:v libx264 -pix_fmt yuv420p {video_temp_path}"
-        subprocess.run(command, shell=True)
-        
-        # Combine video and audio
-        command = f"ffmpeg -y -loglevel error -nostdin -i {video_temp_path} -i {os.path.join(temp_dir, 'audio.wav')} -c:v copy -c:a aac -q:v 0 -q:a 0 {video_out_path}"
-        subprocess.run(command, shell=True)
+    def iter_lipsync_windows(
+        self,
+        video_frames: np.ndarray,
+        whisper_feature: torch.Tensor,
+        num_frames: int = 16,
+        window_callback: Optional[Callable[[int, int], None]] = None,
+        **kwargs,
+    ):
+        """Lipsync `video_frames` (f, h, w, c) RGB uint8 and yield the restored frames window by window.
+
+        `window_callback` is called with (windows done, total windows) after each window. Extra kwargs are passed to
+        `iter_denoised_windows`.
+        """
+        for i, num_windows, faces, boxes, affine_matrices in self.iter_denoised_windows(
+            video_frames, whisper_feature, num_frames=num_frames, **kwargs
+        ):
+            yield self.restore_video(faces, video_frames[i * num_frames : (i + 1) * num_frames], boxes, affine_matrices)
+            if window_callback is not None:
+                window_callback(i + 1, num_windows)
+
+    def write_lipsync_frames(
+        self,
+        video_frames: np.ndarray,
+        whisper_feature: torch.Tensor,
+        encoder: OrderedEncoder,
+        num_frames: int = 16,
+        window_callback: Optional[Callable[[int, int], None]] = None,
+        overlap_stages: bool = True,
+        num_restore_workers: int = 2,
+        queue_size: int = 2,
+        journal: Optional[WindowJournal] = None,
+        **kwargs,
+    ):
+        """Lipsync `video_frames` and write the restored frames to `encoder`, window by window.
+
+        With `overlap_stages`, a producer thread aligns the faces window by window, the calling thread denoises and
+        decodes the latents, and `num_restore_workers` threads paste the faces back and write the frames. At most
+        `queue_size` windows wait between two stages, a stage running ahead blocks until the next one catches up.
+        The frames are the same as with `iter_lipsync_windows`. Windows already in `journal` are read back from it
+        instead of generated and every new window is saved to it. Returns the `StageMetrics` of the run; on
+        `LipsyncInterrupted`, every window denoised so far is written before the exception propagates.
+        """
+        metrics = StageMetrics({"align": 1, "denoise": 1, "restore": num_restore_workers if overlap_stages else 1})
+        if overlap_stages:
+            kwargs["aligned_windows"] = prefetch(
+                self.iter_aligned_windows(video_frames, num_frames), queue_size, metrics, "align", "denoise"
+            )
+        skip_windows = journal.completed_windows.copy() if journal is not None else set()
+        pending = deque()
+        num_windows_written = len(skip_windows)
+        encoder_lock = threading.Lock()
+
+        # The completed windows are mostly the first ones, the encoder only holds the others until their turn
+        for i in sorted(skip_windows):
+            encoder.add(i, journal.load_window(i))
+
+        def restore_window(i, faces, boxes, affine_matrices):
+            with metrics.timer("restore"):
+                window_frames = video_frames[i * num_frames : (i + 1) * num_frames]
+                batch_frames = self.restore_video(faces, window_frames, boxes, affine_matrices)
+                if journal is not None:
+                    journal.save_window(i, batch_frames)
+                with encoder_lock:
+                    encoder.add(i, batch_frames)
+
+        def finish_oldest():
+            nonlocal num_windows_written
+            future, num_windows = pending.popleft()
+            future.result()
+            num_windows_written += 1
+            if window_callback is not None:
+                window_callback(num_windows_written, num_windows)
+
+        with ThreadPoolExecutor(max_workers=num_restore_workers if overlap_stages else 1) as pool:
+            try:
+                for i, num_windows, faces, boxes, affine_matrices in self.iter_denoised_windows(
+                    video_frames, whisper_feature, num_frames=num_frames, skip_windows=skip_windows, **kwargs
+                ):
+                    while pending and pending[0][0].done():
+                        finish_oldest()
+                    if len(pending) >= (queue_size if overlap_stages else 1):
+                        with metrics.timer("denoise", "blocked"):
+                            finish_oldest()
+                    pending.append((pool.submit(restore_window, i, faces, boxes, affine_matrices), num_windows))
+                    if not overlap_stages:
+                        finish_oldest()
+            finally:
+                if overlap_stages:
+                    kwargs["aligned_windows"].close()
+                while pending:
+                    finish_oldest()
+
+        # The calling thread does nothing but denoise when it is neither starved nor blocked
+        denoise_sec = time.perf_counter() - metrics.start
+        denoise_sec -= metrics.seconds[("denoise", "starved")] + metrics.seconds[("denoise", "blocked")]
+        if not overlap_stages:
+            denoise_sec -= metrics.seconds[("restore", "busy")]
+        metrics.add("denoise", "busy", denoise_sec, items=num_windows_written - len(skip_windows))
+        return metrics
+
+    @torch.no_grad()
+    def lipsync_frames(
+        self,
+        video_frames: np.ndarray,
+        audio_samples: Union[np.ndarray, torch.Tensor],
+        num_frames: int = 16,
+        video_fps: int = 25,
+        audio_sample_rate: int = 16000,
+        return_partial: bool = False,
+        **kwargs,
+    ):
+        """In-memory variant of `__call__`, no container is encoded or decoded.
+
+        `video_frames` are (f, h, w, c) RGB uint8 frames already at `video_fps` and `audio_samples` is a mono
+        waveform at `audio_sample_rate` (16 kHz, the Whisper rate). Returns the lipsynced frames and the audio
+        trimmed to their duration. Extra kwargs are passed to `iter_lipsync_windows`. With `return_partial`, an
+        interrupted run returns the windows rendered so far instead of raising.
+        """
+        if torch.is_tensor(audio_samples):
+            audio_samples = audio_samples.cpu().numpy()
+        audio_samples = audio_samples.astype(np.float32)
+        whisper_feature = self.audio_encoder.audio2feat(audio_samples)
+        out_frames = []
+        try:
+            for batch_frames in self.iter_lipsync_windows(
+                video_frames, whisper_feature, num_frames=num_frames, video_fps=video_fps, **kwargs
+            ):
+                out_frames.append(batch_frames)
+        except LipsyncInterrupted as e:
+            if not return_partial or len(out_frames) == 0:
+                raise
+            print(f"{e}, returning the frames rendered so far")
+        if len(out_frames) == 0:
+            raise ValueError(f"Video and audio must cover at least {num_frames} frames")
+        out_frames = np.concatenate(out_frames, axis=0)
+        audio_samples = audio_samples[: int(len(out_frames) / video_fps * audio_sample_rate)]
+        return out_frames, audio_samples
+
+    @torch.no_grad()
+    def __call__(
+        self,
+        video_path: str,
+        audio_path: str,
+        video_out_path: str,
+        video_mask_path: str = None,
+        num_frames: int = 16,
+        video_fps: int = 25,
+        audio_sample_rate: int = 16000,
+        height: Optional[int] = None,
+        width: Optional[int] = None,
+        num_inference_steps: int = 20,
+        guidance_scale: float = 1.5,
+        weight_dtype: Optional[torch.dtype] = torch.float16,
+        eta: float = 0.0,
+        mask: str = "fix_mask",
+        mask_image_path: str = "latentsync/utils/mask.png",
+        landmark_backend: Optional[str] = None,
+        distilled: bool = False,
+        generator: Optional[Union[torch.Generator, List[torch.Generator]]] = None,
+        callback: Optional[Callable[[int, int, torch.FloatTensor], None]] = None,
+        callback_steps: Optional[int] = 1,
+        window_callback: Optional[Callable[[int, int], None]] = None,
+        should_stop: Optional[Callable[[], bool]] = None,
+        return_partial: bool = False,
+        seed: Optional[int] = None,
+        overlap_stages: bool = True,
+        num_restore_workers: int = 2,
+        stage_queue_size: int = 2,
+        job_dir: Optional[str] = None,
+        job_params: Optional[dict] = None,
+        workspace_dir: Optional[str] = None,
+        **kwargs,
+    ):
+        """Lipsync the video at `video_path` to `audio_path` and write the result to `video_out_path`.
+
+        Returns True when the whole video was rendered. With `return_partial`, an interrupted run (see
+        `iter_denoised_windows`) still writes the windows rendered so far as a valid video and returns False. With
+        `overlap_stages`, the face alignment and the restoring run in threads next to the denoising (see
+        `write_lipsync_frames`) and the stage utilization is kept in `self.stage_metrics`.
+
+        With `job_dir`, the job is resumable: its frames and a `WindowJournal` of the completed windows are kept in a
+        directory under `job_dir` keyed by the inputs and the parameters (plus `job_params`, e.g. the checkpoint),
+        and a rerun of a crashed or interrupted job only generates the missing windows. The directory is removed
+        once the video is written. Otherwise the intermediate files go to `workspace_dir`, by default a private
+        temporary directory removed at the end, whatever the outcome, so several calls can run at the same time (see
+        `for_job`). A `workspace_dir` passed in is emptied at the start and left to the caller afterwards.
+        """
+        check_ffmpeg_installed()
+
+        whisper_feature = self.audio_encoder.audio2feat(audio_path)
+        audio_samples = read_audio(audio_path)
+        video_frames = read_video(video_path, use_decord=False)
+
+        completed = True
+        window_kwargs = dict(
+            num_frames=num_frames,
+            video_fps=video_fps,
+            height=height,
+            width=width,
+            num_inference_steps=num_inference_steps,
+            guidance_scale=guidance_scale,
+            weight_dtype=weight_dtype,
+            eta=eta,
+            mask=mask,
+            mask_image_path=mask_image_path,
+            landmark_backend=landmark_backend,
+            distilled=distilled,
+            generator=generator,
+            callback=callback,
+            callback_steps=callback_steps,
+            window_callback=window_callback,
+            should_stop=should_stop,
+            seed=seed,
+        )
+
+        journal = None
+        created_dir = None  # Only the directory the pipeline created itself is removed at the end
+        if job_dir is not None:
+            params = {
+                key: value
+                for key, value in window_kwargs.items()
+                if key not in ["generator", "callback", "callback_steps", "window_callback", "should_stop", "seed"]
+            }
+            params["scheduler"] = {"class": self.scheduler.__class__.__name__, **dict(self.scheduler.config)}
+            params.update(job_params or {})
+            if seed is not None:
+                params["seed"] = seed
+            journal = WindowJournal(job_dir, video_path, audio_path, params, num_frames=num_frames)
+            window_kwargs["seed"] = journal.start(seed)
+            temp_dir = journal.job_dir
+        elif workspace_dir is None:
+            temp_dir = created_dir = tempfile.mkdtemp(prefix="latentsync_job_")
+        else:
+            temp_dir = workspace_dir
+            if os.path.exists(temp_dir):
+                shutil.rmtree(temp_dir)
+            os.makedirs(temp_dir, exist_ok=True)
+
+        # The same encoder as the sharded and batch inference, so all of them write the same video
+        encoder = OrderedEncoder(os.path.join(temp_dir, "video.mp4"), video_fps)
+        try:
+            try:
+                self.stage_metrics = self.write_lipsync_frames(
+                    video_frames,
+                    whisper_feature,
+                    encoder,
+                    overlap_stages=overlap_stages,
+                    num_restore_workers=num_restore_workers,
+                    queue_size=stage_queue_size,
+                    journal=journal,
+                    **window_kwargs,
+                )
+                print(self.stage_metrics)
+            except LipsyncInterrupted as e:
+                # Every window denoised before the interruption has been written
+                if not return_partial or encoder.num_frames == 0:
+                    del video_frames
+                    if torch.cuda.is_available():
+                        torch.cuda.empty_cache()
+                    raise
+                print(f"{e}, writing the frames rendered so far")
+                completed = False
+
+            encoder.close()
+            encoder.mux(audio_samples, audio_sample_rate, video_out_path)
+
+            if journal is not None and completed:
+                journal.remove()
+        finally:
+            encoder.close()
+            # Whatever the outcome, a journaled job keeps its frames to resume from and a caller's workspace_dir is
+            # left to the caller
+            if created_dir is not None:
+                shutil.rmtree(created_dir, ignore_errors=True)
+
+        return completed
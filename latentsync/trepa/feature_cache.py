@@ -0,0 +1,87 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+
+import torch
+
+from .loss import TREPALoss
+
+
+def cache_metadata(config) -> dict:
+    """What the ground-truth features depend on besides the window, for the UNet training `config`."""
+    return {
+        "resolution": config.data.resolution,
+        "num_frames": config.data.num_frames,
+        "model": "vit_g_hybrid_pt_1200e_ssv2_ft",
+    }
+
+
+class TrepaFeatureCache:
+    """TREPA features of the ground-truth windows of the training videos, one file per video and start frame.
+
+    The ground-truth pixels of a window only depend on its video and start frame (for a given resolution and number
+    of frames, kept in `cache.json`), so their VideoMAEv2 features are computed once, by
+    `preprocess.extract_trepa_features` or on the first step that draws the window, and loaded afterwards.
+    """
+
+    def __init__(self, cache_dir: str, metadata: dict):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        metadata_path = os.path.join(cache_dir, "cache.json")
+        if os.path.isfile(metadata_path):
+            with open(metadata_path, "r", encoding="utf-8") as f:
+                cached_metadata = json.load(f)
+            if cached_metadata != metadata:
+                raise ValueError(f"{cache_dir} holds TREPA features of {cached_metadata}, not {metadata}")
+        else:
+            temp_path = f"{metadata_path}.{os.getpid()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(metadata, f)
+            os.replace(temp_path, metadata_path)
+
+    def feature_path(self, video_path: str, start_idx: int) -> str:
+        return os.path.join(self.cache_dir, os.path.basename(video_path).replace(".mp4", ""), f"{start_idx}.pt")
+
+    def load(self, video_path: str, start_idx: int):
+        feature_path = self.feature_path(video_path, start_idx)
+        if not os.path.isfile(feature_path):
+            return None
+        try:
+            return torch.load(feature_path, weights_only=True)
+        except Exception as e:
+            print(f"{type(e).__name__} - {e} - {feature_path}")
+            os.remove(feature_path)
+            return None
+
+    def save(self, video_path: str, start_idx: int, feature: torch.Tensor):
+        feature_path = self.feature_path(video_path, start_idx)
+        os.makedirs(os.path.dirname(feature_path), exist_ok=True)
+        # Written aside and renamed, so the other ranks never load half a file
+        temp_path = f"{feature_path}.{os.getpid()}.tmp"
+        torch.save(feature.detach().cpu().clone(), temp_path)
+        os.replace(temp_path, feature_path)
+
+    def features(self, trepa_loss: TREPALoss, video_paths, start_idxs, videos_real: torch.Tensor) -> torch.Tensor:
+        """Features of the (b, c, f, h, w) ground-truth windows, only the uncached windows go through the model."""
+        start_idxs = [int(start_idx) for start_idx in start_idxs]
+        feats = [self.load(video_path, start_idx) for video_path, start_idx in zip(video_paths, start_idxs)]
+        missing = [i for i, feat in enumerate(feats) if feat is None]
+        if missing:
+            missing_feats = trepa_loss.real_features(videos_real[missing])
+            for i, feat in zip(missing, missing_feats):
+                self.save(video_paths[i], start_idxs[i], feat)
+                feats[i] = feat
+        return torch.stack([feat.to(videos_real.device) for feat in feats])
@@ -28,28 +28,29 @@ class TREPALoss:
         self.model = load_videomae_model(device, ckpt_path, with_cp).eval().to(dtype=torch.float16)
         self.model.requires_grad_(False)
 
-    def __call__(self, videos_fake, videos_real):
-        batch_size = videos_fake.shape[0]
-        num_frames = videos_fake.shape[2]
-        videos_fake = rearrange(videos_fake.clone(), "b c f h w -> (b f) c h w")
-        videos_real = rearrange(videos_real.clone(), "b c f h w -> (b f) c h w")
-
-        videos_fake = F.interpolate(videos_fake, size=(224, 224), mode="bilinear")
-        videos_real = F.interpolate(videos_real, size=(224, 224), mode="bilinear")
-
-        videos_fake = rearrange(videos_fake, "(b f) c h w -> b c f h w", f=num_frames)
-        videos_real = rearrange(videos_real, "(b f) c h w -> b c f h w", f=num_frames)
+    def features(self, videos):
+        """L2-normalized VideoMAEv2 features of (b, c, f, h, w) videos in [-1, 1]."""
+        num_frames = videos.shape[2]
+        videos = rearrange(videos.clone(), "b c f h w -> (b f) c h w")
+        videos = F.interpolate(videos, size=(224, 224), mode="bilinear")
+        videos = rearrange(videos, "(b f) c h w -> b c f h w", f=num_frames)
 
         # Because input pixel range is [-1, 1], and model expects pixel range to be [0, 1]
-        videos_fake = (videos_fake / 2 + 0.5).clamp(0, 1)
-        videos_real = (videos_real / 2 + 0.5).clamp(0, 1)
+        videos = (videos / 2 + 0.5).clamp(0, 1)
 
-        feats_fake = self.model.forward_features(videos_fake)
-        feats_real = self.model.forward_features(videos_real)
+        feats = self.model.forward_features(videos)
+        return F.normalize(feats, p=2, dim=1)
 
-        feats_fake = F.normalize(feats_fake, p=2, dim=1)
-        feats_real = F.normalize(feats_real, p=2, dim=1)
+    def real_features(self, videos_real):
+        # No gradient flows to the real videos, so there is no graph to keep
+        with torch.no_grad():
+            return self.features(videos_real)
 
+    def __call__(self, videos_fake, videos_real=None, feats_real=None):
+        """The loss between the fake and the real videos, `feats_real` (from `real_features`) replaces the latter."""
+        feats_fake = self.features(videos_fake)
+        if feats_real is None:
+            feats_real = self.real_features(videos_real)
         return F.mse_loss(feats_fake, feats_real)
 
 
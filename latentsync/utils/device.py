@@ -0,0 +1,92 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Optional, Union
+
+import cv2
+import torch
+
+PRECISIONS = {
+    "fp32": torch.float32,
+    "fp16": torch.float16,
+    "bf16": torch.bfloat16,
+}
+
+
+def resolve_device(device: Union[str, torch.device, None] = "auto") -> torch.device:
+    if device is None or (isinstance(device, str) and device == "auto"):
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    device = torch.device(device)
+    if device.type == "cuda" and not torch.cuda.is_available():
+        raise RuntimeError("CUDA was requested but is not available, use device 'cpu' instead")
+    return device
+
+
+def resolve_dtype(device: torch.device, precision: Optional[str] = "auto") -> torch.dtype:
+    if precision is None or precision == "auto":
+        # fp16 only pays off on GPUs with fast half precision kernels, CPUs run fp32 unless bf16 is asked for
+        if device.type == "cuda" and torch.cuda.get_device_capability(device)[0] > 7:
+            return torch.float16
+        return torch.float32
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision}, choose from {['auto'] + list(PRECISIONS)}")
+    if device.type == "cpu" and precision == "fp16":
+        raise ValueError("fp16 is not supported on CPU, use bf16 or fp32")
+    return PRECISIONS[precision]
+
+
+class DevicePolicy:
+    """Where each module of the inference pipeline runs and in which precision.
+
+    The UNet and the VAE get separate precisions because the VAE decode is the part most sensitive to
+    reduced precision, e.g. bf16 UNet with fp32 VAE on CPU. `num_threads` <= 0 keeps the library defaults.
+    """
+
+    def __init__(
+        self,
+        device: Union[str, torch.device, None] = "auto",
+        unet_precision: Optional[str] = "auto",
+        vae_precision: Optional[str] = "auto",
+        num_threads: int = 0,
+        channels_last: Optional[bool] = None,
+    ):
+        self.device = resolve_device(device)
+        self.unet_dtype = resolve_dtype(self.device, unet_precision)
+        self.vae_dtype = resolve_dtype(self.device, vae_precision)
+        self.num_threads = num_threads
+        # The 2D convolutions of the VAE are faster in NHWC with the oneDNN kernels used on CPU
+        self.channels_last = self.device.type == "cpu" if channels_last is None else channels_last
+
+    @property
+    def is_cpu(self) -> bool:
+        return self.device.type == "cpu"
+
+    def apply(self):
+        if self.num_threads > 0:
+            torch.set_num_threads(self.num_threads)
+            cv2.setNumThreads(self.num_threads)
+        if self.device.type == "cuda":
+            torch.backends.cudnn.benchmark = True
+
+    def prepare_vae(self, vae):
+        vae = vae.to(device=self.device, dtype=self.vae_dtype)
+        if self.channels_last:
+            vae = vae.to(memory_format=torch.channels_last)
+        return vae
+
+    def __repr__(self):
+        return (
+            f"DevicePolicy(device={self.device}, unet_dtype={self.unet_dtype}, vae_dtype={self.vae_dtype}, "
+            f"num_threads={self.num_threads}, channels_last={self.channels_last})"
+        )
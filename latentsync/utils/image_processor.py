@@ -37,13 +37,21 @@ def load_fixed_mask(resolution: int, mask_image_path="latentsync/utils/mask.png"
 
 
 class ImageProcessor:
-    def __init__(self, resolution: int = 512, mask: str = "fix_mask", device: str = "cpu", mask_image=None):
+    def __init__(
+        self,
+        resolution: int = 512,
+        mask: str = "fix_mask",
+        device: str = "cpu",
+        mask_image=None,
+        landmark_backend: str = None,
+    ):
         self.resolution = resolution
         self.resize = transforms.Resize(
             (resolution, resolution), interpolation=transforms.InterpolationMode.BILINEAR, antialias=True
         )
         self.normalize = transforms.Normalize([0.5], [0.5], inplace=True)
         self.mask = mask
+        self.pixel_masks = {}  # The mask of the batched path on each device it has run on
 
         if mask in ["mouth", "face", "eye"]:
             self.face_mesh = mp.solutions.face_mesh.FaceMesh(static_image_mode=True)  # Process single image
@@ -57,15 +65,26 @@ class ImageProcessor:
             else:
                 self.mask_image = mask_image
 
-            if device != "cpu":
+            # face_alignment (S3FD + FAN) is accurate but slow without a GPU, so CPU defaults to MediaPipe
+            if landmark_backend is None:
+                landmark_backend = "mediapipe" if str(device) == "cpu" else "face_alignment"
+            self.landmark_backend = landmark_backend
+
+            if landmark_backend == "face_alignment":
                 self.fa = face_alignment.FaceAlignment(
-                    face_alignment.LandmarksType.TWO_D, flip_input=False, device=device
+                    face_alignment.LandmarksType.TWO_D, flip_input=False, device=str(device)
                 )
-                self.face_mesh = None
-            else:
-                # self.face_mesh = mp.solutions.face_mesh.FaceMesh(static_image_mode=True)  # Process single image
-                self.face_mesh = None
+            elif landmark_backend == "mediapipe":
+                # The face mesh is created on first use in `affine_transform`, because dataset workers
+                # build an ImageProcessor but never align faces
                 self.fa = None
+            else:
+                raise ValueError(f"Invalid landmark backend: {landmark_backend}")
+
+    def reset_smoothing(self):
+        # The landmarks and the alignment are smoothed across consecutive frames, call this between videos
+        self.smoother = laplacianSmooth()
+        self.restorer = AlignRestore()
 
     def detect_facial_landmarks(self, image: np.ndarray):
         height, width, _ = image.shape
@@ -118,6 +137,8 @@ class ImageProcessor:
     def affine_transform(self, image: torch.Tensor, allow_multi_faces: bool = True) -> np.ndarray:
         # image = rearrange(image, "c h w-> h w c").numpy()
         if self.fa is None:
+            if self.face_mesh is None:
+                self.face_mesh = mp.solutions.face_mesh.FaceMesh(static_image_mode=True)  # Process single image
             landmark_coordinates = np.array(self.detect_facial_landmarks(image))
             lm68 = mediapipe_lm478_to_face_alignment_lm68(landmark_coordinates)
         else:
@@ -151,11 +172,40 @@ class ImageProcessor:
         masked_pixel_values = pixel_values * self.mask_image
         return pixel_values, masked_pixel_values, self.mask_image[0:1]
 
+    def get_pixel_mask(self, device) -> torch.Tensor:
+        """The (1 or 3, h, w) mask multiplied into the pixels by the fixed and half masks, on `device`."""
+        device = torch.device(device)
+        if device not in self.pixel_masks:
+            if self.mask == "fix_mask":
+                mask = self.mask_image
+            else:
+                mask = torch.ones((1, self.resolution, self.resolution))
+                mask[:, self.resolution // 2 :, :] = 0
+            self.pixel_masks[device] = mask.to(device)
+        return self.pixel_masks[device]
+
+    def prepare_masks_and_masked_images_batch(self, images: torch.Tensor):
+        """The per-frame results of the fixed and half masks, computed over the (f, c, h, w) frames at once.
+
+        Runs on the device of `images`. The normalization is done in place on the float copy of the frames.
+        """
+        pixel_values = self.resize(images).to(dtype=torch.float32).div_(255.0)
+        pixel_values = self.normalize(pixel_values)
+        mask = self.get_pixel_mask(pixel_values.device)
+        masked_pixel_values = pixel_values * mask
+        if self.mask == "fix_mask":
+            masks = mask[0:1]
+        else:
+            masks = 1 - mask
+        return pixel_values, masked_pixel_values, masks.unsqueeze(0).repeat(len(images), 1, 1, 1)
+
     def prepare_masks_and_masked_images(self, images: Union[torch.Tensor, np.ndarray], affine_transform=False):
         if isinstance(images, np.ndarray):
             images = torch.from_numpy(images)
         if images.shape[3] == 3:
             images = rearrange(images, "f h w c -> f c h w")
+        if self.mask in ["fix_mask", "half"] and not affine_transform:
+            return self.prepare_masks_and_masked_images_batch(images)
         if self.mask == "fix_mask":
             results = [self.preprocess_fixed_mask_image(image, affine_transform=affine_transform) for image in images]
         else:
@@ -0,0 +1,128 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import os
+import random
+import shutil
+import threading
+
+import cv2
+import numpy as np
+
+
+def file_digest(path: str, chunk_size: int = 8 * 1024 * 1024) -> str:
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def job_key(video_path: str, audio_path: str, params: dict) -> str:
+    """Key of a lipsync job: the content of its inputs and every parameter that changes the output."""
+    description = {
+        "video": file_digest(video_path),
+        "audio": file_digest(audio_path),
+        "params": params,
+    }
+    return hashlib.sha1(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+class WindowJournal:
+    """Completed windows of a lipsync job, kept in `<root_dir>/<job_key>` so a restarted job can skip them.
+
+    The restored frames of a window are written as PNGs to `frames_dir` and the window is appended to
+    `journal.jsonl` afterwards, so a window in the journal always has all its frames on disk. The frames are
+    lossless, so a resumed job encodes exactly the frames an uninterrupted one would. The first line holds
+    the seed of the job: every window draws its noise from the seed and its index, which makes a resumed job render
+    the same frames as an uninterrupted one.
+    """
+
+    def __init__(self, root_dir: str, video_path: str, audio_path: str, params: dict, num_frames: int = 16):
+        self.job_dir = os.path.join(root_dir, job_key(video_path, audio_path, params))
+        self.frames_dir = os.path.join(self.job_dir, "frames")
+        self.journal_path = os.path.join(self.job_dir, "journal.jsonl")
+        self.num_frames = num_frames
+        self.seed = None
+        self.completed_windows = set()
+        self.lock = threading.Lock()
+        os.makedirs(self.frames_dir, exist_ok=True)
+        self.load()
+
+    def load(self):
+        if not os.path.isfile(self.journal_path):
+            return
+        with open(self.journal_path, "r", encoding="utf-8") as f:
+            lines = f.read().split("\n")
+        if lines[-1] != "":
+            # The job died while writing the last line, end it so the next entries start on their own line
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                f.write("\n")
+        for line in lines:
+            if line:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if "seed" in entry:
+                    self.seed = entry["seed"]
+                elif "window" in entry and self.window_frames_exist(entry["window"]):
+                    self.completed_windows.add(entry["window"])
+        if self.completed_windows:
+            print(f"Resuming job {self.job_dir}, {len(self.completed_windows)} windows already done")
+
+    def frame_path(self, frame_index: int) -> str:
+        return os.path.join(self.frames_dir, f"frame_{frame_index:06d}.png")
+
+    def window_frame_paths(self, window_index: int):
+        first_frame = window_index * self.num_frames
+        return [self.frame_path(index) for index in range(first_frame, first_frame + self.num_frames)]
+
+    def window_frames_exist(self, window_index: int) -> bool:
+        return all(os.path.isfile(frame_path) for frame_path in self.window_frame_paths(window_index))
+
+    def save_window(self, window_index: int, batch_frames: np.ndarray):
+        """Write the (f, h, w, c) RGB frames of a window and record it as completed."""
+        for frame_path, frame in zip(self.window_frame_paths(window_index), batch_frames):
+            cv2.imwrite(frame_path, cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+        self.record(window_index)
+
+    def load_window(self, window_index: int) -> np.ndarray:
+        frames = [cv2.imread(frame_path) for frame_path in self.window_frame_paths(window_index)]
+        return np.stack([cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for frame in frames])
+
+    def start(self, seed=None) -> int:
+        """Seed of the job: the one it started with when resuming, else `seed` or a random one."""
+        if self.seed is None:
+            self.seed = seed if seed is not None else random.randrange(2**31)
+            self.append({"seed": self.seed})
+        elif seed is not None and seed != self.seed:
+            raise ValueError(f"Job {self.job_dir} was started with seed {self.seed}, not {seed}")
+        return self.seed
+
+    def record(self, window_index: int):
+        self.append({"window": window_index})
+        self.completed_windows.add(window_index)
+
+    def append(self, entry: dict):
+        with self.lock:
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def remove(self):
+        shutil.rmtree(self.job_dir, ignore_errors=True)
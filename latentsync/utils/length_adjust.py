@@ -0,0 +1,163 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+import os
+import subprocess
+from fractions import Fraction
+
+import numpy as np
+import torch
+import torchaudio
+
+LENGTH_ADJUST_MODES = ["normal", "pingpong", "loop_to_audio"]
+
+
+def length_adjust_indices(num_frames, num_samples, sample_rate, mode, fps, silent_padding_sec):
+    """Source frame index of every output frame and the output audio length in samples (zero padded past the end)."""
+    silence_samples = math.ceil(silent_padding_sec * sample_rate)
+    if mode == "normal":
+        required_frames = int((num_samples + silence_samples) / sample_rate * fps)
+        if num_frames > required_frames:
+            return np.arange(required_frames), num_samples + silence_samples
+        # The video is shorter than the padded audio, keep all frames and trim the audio
+        return np.arange(num_frames), min(int(num_frames / fps * sample_rate), num_samples + silence_samples)
+    elif mode == "pingpong":
+        if num_samples / sample_rate <= num_frames / fps:
+            # Audio is shorter than video, pad with silence up to the video duration
+            return np.arange(num_frames), int(num_frames / fps * sample_rate)
+        target_frames = math.ceil((num_samples + silence_samples) / sample_rate * fps)
+        cycle = np.concatenate([np.arange(num_frames), np.arange(num_frames)[::-1][1:-1]])
+        return np.resize(cycle, target_frames), num_samples + silence_samples
+    elif mode == "loop_to_audio":
+        target_frames = math.ceil((num_samples + silence_samples) / sample_rate * fps)
+        return np.resize(np.arange(num_frames), target_frames), num_samples + silence_samples
+    else:
+        raise ValueError(f"Unknown mode {mode}, choose from {LENGTH_ADJUST_MODES}")
+
+
+def pad_or_trim_waveform(waveform: torch.Tensor, num_samples: int) -> torch.Tensor:
+    if waveform.shape[-1] >= num_samples:
+        return waveform[..., :num_samples]
+    silence = torch.zeros((*waveform.shape[:-1], num_samples - waveform.shape[-1]), dtype=waveform.dtype)
+    return torch.cat([waveform, silence.to(waveform.device)], dim=-1)
+
+
+def ffprobe_video_stream(video_path: str, entries: str, count_packets: bool = False) -> dict:
+    command = ["ffprobe", "-v", "error", "-select_streams", "v:0"]
+    if count_packets:
+        # Reads the packets of the whole file, without decoding them
+        command.append("-count_packets")
+    command += ["-show_entries", f"stream={entries}", "-of", "default=noprint_wrappers=1", video_path]
+    output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+    return dict(line.split("=", 1) for line in output.splitlines() if "=" in line)
+
+
+def count_frames(video_path: str) -> int:
+    """Number of frames of the first video stream, counted from its packets."""
+    return int(ffprobe_video_stream(video_path, "nb_read_packets", count_packets=True)["nb_read_packets"])
+
+
+def probe_video(video_path: str):
+    """Frame rate, width, height and number of frames of the first video stream."""
+    info = ffprobe_video_stream(video_path, "r_frame_rate,width,height,nb_frames")
+    fps = float(Fraction(info["r_frame_rate"]))
+    # The stream header of an mp4 holds the frame count, other containers (webm, some mkv) leave it to be counted
+    nb_frames = info.get("nb_frames", "N/A")
+    num_frames = int(nb_frames) if nb_frames.isdigit() and int(nb_frames) > 0 else count_frames(video_path)
+    return fps, int(info["width"]), int(info["height"]), num_frames
+
+
+def iter_frames_by_index(video_path: str, width: int, height: int, fps: float, frame_indices):
+    """Yield the raw RGB24 frames of `video_path` at `frame_indices` from a single streaming decode.
+
+    Only the frames that are used again later (pingpong and loops) are kept in memory, until their last use.
+    """
+    frame_size = width * height * 3
+    last_use = {}
+    for position, index in enumerate(frame_indices):
+        last_use[int(index)] = position
+
+    command = ["ffmpeg", "-loglevel", "error", "-nostdin", "-i", video_path, "-r", str(fps)]
+    command += ["-f", "rawvideo", "-pix_fmt", "rgb24", "pipe:1"]
+    decoder = subprocess.Popen(command, stdout=subprocess.PIPE)
+    cache = {}
+    next_index = 0
+    frame = None
+    try:
+        for position, index in enumerate(frame_indices):
+            index = int(index)
+            if index in cache:
+                frame = cache[index]
+            else:
+                # Indices only go back to frames that are still cached, so the decoder never has to seek
+                while next_index <= index:
+                    data = decoder.stdout.read(frame_size)
+                    if len(data) < frame_size:
+                        # The container reported more frames than were decoded, hold the last one
+                        break
+                    frame = data
+                    if last_use.get(next_index, -1) > position:
+                        cache[next_index] = frame
+                    next_index += 1
+            if last_use[index] == position:
+                cache.pop(index, None)
+            yield frame
+    finally:
+        decoder.stdout.close()
+        decoder.kill()
+        decoder.wait()
+
+
+def adjust_video_length(video_path, audio_path, output_video_path, mode, fps, silent_padding_sec, temp_dir):
+    """Match the length of `video_path` to `audio_path` (plus silent padding) in a single pass.
+
+    The adjustment is a frame index mapping (see `length_adjust_indices`) applied while the decoded frames are
+    streamed into the encoder, no frame touches the disk. When mode is normal and the frame rate is unchanged, the
+    video only needs trimming and its stream is copied without re-encoding, unless the copy does not end on the
+    exact frame.
+    """
+    waveform, sample_rate = torchaudio.load(audio_path)
+    original_fps, width, height, num_frames = probe_video(video_path)
+
+    frame_indices, num_samples = length_adjust_indices(
+        num_frames, waveform.shape[1], sample_rate, mode, fps, silent_padding_sec
+    )
+    temp_audio_path = os.path.join(temp_dir, "adjusted_audio.wav")
+    torchaudio.save(temp_audio_path, pad_or_trim_waveform(waveform, num_samples), sample_rate)
+
+    if mode == "normal" and abs(original_fps - fps) < 1e-3:
+        duration = len(frame_indices) / fps
+        command = ["ffmpeg", "-y", "-loglevel", "error", "-nostdin", "-i", video_path, "-i", temp_audio_path]
+        command += ["-map", "0:v:0", "-map", "1:a:0", "-c:v", "copy", "-c:a", "aac", "-t", f"{duration:.6f}"]
+        subprocess.run(command + [output_video_path], check=True)
+        # A stream copy can only cut on packets, with B-frames or odd timestamps it may keep a frame too many or
+        # too few: check the frame count of the copy and re-encode when it is off
+        num_copied_frames = probe_video(output_video_path)[3]
+        if num_copied_frames == len(frame_indices):
+            return
+        print(f"Stream copy kept {num_copied_frames} frames instead of {len(frame_indices)}, re-encoding {video_path}")
+
+    command = ["ffmpeg", "-y", "-loglevel", "error", "-f", "rawvideo", "-pix_fmt", "rgb24"]
+    command += ["-s", f"{width}x{height}", "-r", str(fps), "-i", "pipe:0", "-i", temp_audio_path]
+    command += ["-c:v", "libx264", "-pix_fmt", "yuv420p", "-c:a", "aac", output_video_path]
+    encoder = subprocess.Popen(command, stdin=subprocess.PIPE)
+    try:
+        for frame in iter_frames_by_index(video_path, width, height, original_fps, frame_indices):
+            encoder.stdin.write(frame)
+    finally:
+        encoder.stdin.close()
+        encoder.wait()
+    if encoder.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to encode {output_video_path}")
@@ -0,0 +1,46 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from diffusers.schedulers import (
+    DDIMScheduler,
+    DPMSolverMultistepScheduler,
+    EulerAncestralDiscreteScheduler,
+    EulerDiscreteScheduler,
+    LMSDiscreteScheduler,
+    PNDMScheduler,
+    UniPCMultistepScheduler,
+)
+
+# name -> (scheduler class, overrides applied on top of the DDIM training config)
+SCHEDULERS = {
+    "ddim": (DDIMScheduler, {}),
+    "dpm_solver++": (DPMSolverMultistepScheduler, {"algorithm_type": "dpmsolver++", "solver_order": 2}),
+    "dpm_solver++_karras": (
+        DPMSolverMultistepScheduler,
+        {"algorithm_type": "dpmsolver++", "solver_order": 2, "use_karras_sigmas": True},
+    ),
+    "unipc": (UniPCMultistepScheduler, {"solver_order": 2, "predict_x0": True}),
+    "euler": (EulerDiscreteScheduler, {}),
+    "euler_ancestral": (EulerAncestralDiscreteScheduler, {}),
+    "lms": (LMSDiscreteScheduler, {}),
+    "pndm": (PNDMScheduler, {}),
+}
+
+
+def build_scheduler(name: str, base_config):
+    """Build the scheduler `name` from the DDIM config the UNet was trained with (same betas and timesteps)."""
+    if name not in SCHEDULERS:
+        raise ValueError(f"Unknown scheduler {name}, choose from {list(SCHEDULERS)}")
+    scheduler_cls, overrides = SCHEDULERS[name]
+    return scheduler_cls.from_config(base_config, **overrides)
@@ -0,0 +1,120 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import queue
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+class StageMetrics:
+    """Time the stages of an overlapped pipeline spend working, starved of input and blocked on a full output queue.
+
+    `workers` maps every stage to its number of threads, utilization is busy time / (wall time * workers).
+    """
+
+    def __init__(self, workers: dict):
+        self.workers = workers
+        self.seconds = defaultdict(float)
+        self.items = defaultdict(int)
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+
+    def add(self, stage: str, kind: str, seconds: float, items: int = 0):
+        with self.lock:
+            self.seconds[(stage, kind)] += seconds
+            self.items[stage] += items
+
+    @contextmanager
+    def timer(self, stage: str, kind: str = "busy"):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, kind, time.perf_counter() - start, items=int(kind == "busy"))
+
+    def summary(self):
+        wall = time.perf_counter() - self.start
+        summary = {"wall_sec": round(wall, 3)}
+        for stage, workers in self.workers.items():
+            busy = self.seconds[(stage, "busy")]
+            summary[stage] = {
+                "items": self.items[stage],
+                "busy_sec": round(busy, 3),
+                "starved_sec": round(self.seconds[(stage, "starved")], 3),
+                "blocked_sec": round(self.seconds[(stage, "blocked")], 3),
+                "utilization": round(busy / (wall * workers), 3) if wall > 0 else 0.0,
+            }
+        return summary
+
+    def __str__(self):
+        summary = self.summary()
+        stages = [
+            f"{stage} {summary[stage]['utilization']:.0%} (starved {summary[stage]['starved_sec']:.1f} s, "
+            f"blocked {summary[stage]['blocked_sec']:.1f} s)"
+            for stage in self.workers
+        ]
+        return f"Stage utilization over {summary['wall_sec']:.1f} s: " + ", ".join(stages)
+
+
+def prefetch(iterable, maxsize: int, metrics: StageMetrics, stage: str, consumer: str):
+    """Iterate `iterable` in a producer thread that runs at most `maxsize` items ahead of the consumer.
+
+    The producer's work is timed as `stage` busy and its waits on the full queue as `stage` blocked, the consumer's
+    waits on the empty queue as `consumer` starved. Exceptions of the producer are raised in the consumer. The
+    producer starts on the first item requested, and stops when the consumer closes the generator.
+    """
+    items = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+    end = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def produce():
+        try:
+            iterator = iter(iterable)
+            while not stop.is_set():
+                start = time.perf_counter()
+                item = next(iterator, end)
+                if item is end:
+                    break
+                metrics.add(stage, "busy", time.perf_counter() - start, items=1)
+                with metrics.timer(stage, "blocked"):
+                    put((item, None))
+        except BaseException as e:
+            put((None, e))
+            return
+        put((end, None))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            with metrics.timer(consumer, "starved"):
+                item, error = items.get()
+            if error is not None:
+                raise error
+            if item is end:
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
@@ -0,0 +1,181 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import json
+import os
+import time
+
+import torch
+
+
+class StepProfiler:
+    """Time the phases of the training steps, report throughput and optionally capture a torch profiler trace.
+
+    The phases are the `phase` blocks of the step, plus "data", the wait for the batch in `iter_batches`. The device
+    is synchronized around every phase so the kernels are counted in the phase that launched them, which slows the
+    training down a little: the profiler is opt-in and, when disabled, every call is a no-op. Every `log_steps` steps
+    the samples/s and the mean time, share and peak memory of each phase are sent to `log` and appended to `jsonl_path`.
+    With `trace_start_step >= 0` a trace of `trace_num_steps` steps is written to `trace_dir` for chrome://tracing
+    or TensorBoard, the phases show up in it as labeled ranges.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        device=None,
+        samples_per_step: int = 1,
+        log_steps: int = 50,
+        jsonl_path: str = "",
+        trace_start_step: int = -1,
+        trace_num_steps: int = 5,
+        trace_dir: str = "",
+        log=print,
+    ):
+        self.enabled = enabled
+        self.device = device
+        self.use_cuda = enabled and torch.cuda.is_available() and torch.device(device).type == "cuda"
+        self.samples_per_step = samples_per_step
+        self.log_steps = log_steps
+        self.jsonl_path = jsonl_path
+        self.trace_start_step = trace_start_step
+        self.trace_num_steps = trace_num_steps
+        self.trace_dir = trace_dir
+        self.log = log
+
+        self.step_phases = {}  # Seconds of each phase of the current step
+        self.step_start = 0.0
+        self.window_seconds = {}  # Summed over the steps since the last report
+        self.window_peak_memory = {}  # Bytes, max over the steps since the last report
+        self.window_steps = 0
+        self.torch_profiler = None
+
+    def synchronize(self):
+        if self.use_cuda:
+            torch.cuda.synchronize(self.device)
+
+    @contextlib.contextmanager
+    def record(self, name: str):
+        self.synchronize()
+        if self.use_cuda:
+            torch.cuda.reset_peak_memory_stats(self.device)
+        if self.torch_profiler is not None:
+            range_context = torch.profiler.record_function(name)
+        else:
+            range_context = contextlib.nullcontext()
+        start = time.perf_counter()
+        try:
+            with range_context:
+                yield
+        finally:
+            self.synchronize()
+            self.step_phases[name] = self.step_phases.get(name, 0.0) + time.perf_counter() - start
+            if self.use_cuda:
+                peak_memory = torch.cuda.max_memory_allocated(self.device)
+                self.window_peak_memory[name] = max(self.window_peak_memory.get(name, 0), peak_memory)
+
+    def phase(self, name: str):
+        """Context manager timing one phase of the step, a phase entered several times in a step is summed."""
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self.record(name)
+
+    def iter_batches(self, dataloader):
+        """Iterate over `dataloader`, timing the wait for every batch as the "data" phase of its step."""
+        iterator = iter(dataloader)
+        while True:
+            # A step that ended early (the batch was skipped) is dropped with its phases
+            self.step_phases = {}
+            if self.enabled:
+                self.step_start = time.perf_counter()
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                return
+            if self.enabled:
+                self.step_phases["data"] = time.perf_counter() - self.step_start
+            yield batch
+
+    def end_step(self, global_step: int):
+        """Account for the step that just finished, `global_step` counts it already."""
+        if not self.enabled:
+            return
+        self.synchronize()
+        # The code between the phases, the step time is then the wall time from the batch request to here
+        self.step_phases["other"] = max(time.perf_counter() - self.step_start - sum(self.step_phases.values()), 0.0)
+        for name, seconds in self.step_phases.items():
+            self.window_seconds[name] = self.window_seconds.get(name, 0.0) + seconds
+        self.step_phases = {}
+        self.window_steps += 1
+
+        if self.torch_profiler is not None:
+            self.torch_profiler.step()
+            if global_step >= self.trace_start_step + self.trace_num_steps:
+                self.stop_trace(global_step)
+        elif self.trace_start_step >= 0 and global_step == self.trace_start_step:
+            self.start_trace()
+
+        if global_step % self.log_steps == 0:
+            self.report(global_step)
+
+    def start_trace(self):
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if self.use_cuda:
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self.torch_profiler = torch.profiler.profile(
+            activities=activities, record_shapes=True, profile_memory=True, with_stack=False
+        )
+        self.torch_profiler.start()
+
+    def stop_trace(self, global_step: int):
+        self.torch_profiler.stop()
+        os.makedirs(self.trace_dir, exist_ok=True)
+        trace_path = os.path.join(self.trace_dir, f"trace-{self.trace_start_step}-{global_step}.json")
+        self.torch_profiler.export_chrome_trace(trace_path)
+        self.torch_profiler = None
+        self.log(f"Saved the profiler trace of steps {self.trace_start_step + 1} to {global_step} to {trace_path}")
+
+    def report(self, global_step: int):
+        if self.window_steps == 0:
+            return
+        # The throughput of the steps themselves, the validation between steps does not count
+        total_seconds = sum(self.window_seconds.values())
+        phases = {
+            name: {
+                "ms": 1000 * seconds / self.window_steps,
+                "share": seconds / total_seconds,
+                "peak_memory_gb": self.window_peak_memory.get(name, 0) / 1024**3,
+            }
+            for name, seconds in sorted(self.window_seconds.items(), key=lambda item: -item[1])
+        }
+        record = {
+            "step": global_step,
+            "num_steps": self.window_steps,
+            "step_ms": 1000 * total_seconds / self.window_steps,
+            "samples_per_second": self.samples_per_step * self.window_steps / total_seconds,
+            "phases": phases,
+        }
+
+        breakdown = ", ".join(f"{name} {phase['ms']:.0f} ms ({phase['share']:.0%})" for name, phase in phases.items())
+        self.log(
+            f"Step {global_step}: {record['samples_per_second']:.2f} samples/s, "
+            f"{record['step_ms']:.0f} ms/step - {breakdown}"
+        )
+        if self.jsonl_path != "":
+            with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+
+        self.window_seconds = {}
+        self.window_peak_memory = {}
+        self.window_steps = 0
@@ -42,24 +42,55 @@ def read_json(filepath: str):
     return json_dict
 
 
-def read_video(video_path: str, change_fps=True, use_decord=True):
+def probe_video_stream(video_path: str):
+    """r_frame_rate, avg_frame_rate, displayed width and height, and rotation of the first video stream."""
+    command = ["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries"]
+    command += ["stream=width,height,r_frame_rate,avg_frame_rate:stream_tags=rotate:stream_side_data=rotation"]
+    command += ["-of", "default=noprint_wrappers=1", video_path]
+    output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+    info = {}
+    for line in output.splitlines():
+        key, _, value = line.partition("=")
+        info.setdefault(key.replace("TAG:", ""), value)
+
+    def parse_rate(rate):
+        numerator, _, denominator = rate.partition("/")
+        return float(numerator) / float(denominator or 1) if float(denominator or 1) != 0 else 0.0
+
+    width, height = int(info["width"]), int(info["height"])
+    # ffmpeg applies the display rotation when decoding, so portrait phone videos come out transposed
+    rotation = int(float(info.get("rotation") or info.get("rotate") or 0))
+    if rotation % 180 != 0:
+        width, height = height, width
+    return parse_rate(info["r_frame_rate"]), parse_rate(info["avg_frame_rate"]), width, height, rotation
+
+
+def read_video_ffmpeg(video_path: str, fps: float, width: int, height: int):
+    """Decode `video_path` resampled to `fps` straight to RGB24 frames, without an intermediate file."""
+    command = ["ffmpeg", "-loglevel", "error", "-nostdin", "-i", video_path, "-r", str(fps)]
+    command += ["-f", "rawvideo", "-pix_fmt", "rgb24", "pipe:1"]
+    output = subprocess.run(command, capture_output=True, check=True).stdout
+    frame_size = width * height * 3
+    num_frames = len(output) // frame_size
+    return np.frombuffer(output, dtype=np.uint8)[: num_frames * frame_size].reshape(num_frames, height, width, 3)
+
+
+def read_video(video_path: str, change_fps=True, use_decord=True, fps: int = 25):
+    """Decode `video_path` to (f, h, w, c) RGB uint8, at `fps` frames per second with `change_fps`.
+
+    A video already at `fps` is decoded as is. Any other is resampled by ffmpeg (dropping or repeating frames like
+    `-r`) while it is decoded, no re-encoded copy is written. A rotated video always goes through ffmpeg, the only
+    decoder here that applies the display rotation.
+    """
     if change_fps:
-        temp_dir = "temp"
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
-        os.makedirs(temp_dir, exist_ok=True)
-        command = (
-            f"ffmpeg -loglevel error -y -nostdin -i {video_path} -r 25 -crf 18 {os.path.join(temp_dir, 'video.mp4')}"
-        )
-        subprocess.run(command, shell=True)
-        target_video_path = os.path.join(temp_dir, "video.mp4")
-    else:
-        target_video_path = video_path
+        r_frame_rate, avg_frame_rate, width, height, rotation = probe_video_stream(video_path)
+        if abs(r_frame_rate - fps) > 1e-3 or abs(avg_frame_rate - fps) > 1e-3 or rotation % 360 != 0:
+            return read_video_ffmpeg(video_path, fps, width, height)
 
     if use_decord:
-        return read_video_decord(target_video_path)
+        return read_video_decord(video_path)
     else:
-        return read_video_cv2(target_video_path)
+        return read_video_cv2(video_path)
 
 
 def read_video_decord(video_path: str):
@@ -151,6 +182,13 @@ def check_video_fps(video_path: str):
         raise ValueError(f"Video FPS is not 25, it is {fps}. Please convert the video to 25 FPS.")
 
 
+def sample_latent_moments(moments: torch.Tensor, generator=None) -> torch.Tensor:
+    """Sample the VAE latent distribution whose mean and log variance are stacked on dim 1, like `latent_dist`."""
+    mean, logvar = torch.chunk(moments, 2, dim=1)
+    std = torch.exp(0.5 * torch.clamp(logvar, -30.0, 20.0))
+    return mean + std * torch.randn(mean.shape, generator=generator, device=mean.device, dtype=mean.dtype)
+
+
 def one_step_sampling(ddim_scheduler, pred_noise, timesteps, x_t):
     # Compute alphas, betas
     alpha_prod_t = ddim_scheduler.alphas_cumprod[timesteps].to(dtype=pred_noise.dtype)
@@ -171,6 +209,43 @@ def one_step_sampling(ddim_scheduler, pred_noise, timesteps, x_t):
     return pred_original_sample
 
 
+def _alpha_prod(ddim_scheduler, timesteps, dtype):
+    # Negative timesteps are the end of the trajectory, where DDIM uses final_alpha_cumprod
+    alphas_cumprod = ddim_scheduler.alphas_cumprod.to(device=timesteps.device)
+    final_alpha_cumprod = torch.as_tensor(ddim_scheduler.final_alpha_cumprod, device=timesteps.device)
+    alpha_prod = torch.where(timesteps >= 0, alphas_cumprod[timesteps.clamp(min=0)], final_alpha_cumprod)
+    return alpha_prod.to(dtype=dtype)[:, None, None, None, None]
+
+
+def ddim_sampling_step(ddim_scheduler, pred_noise, timesteps, prev_timesteps, x_t):
+    # Deterministic (eta = 0) DDIM update x_t -> x_prev, formula (12) from https://arxiv.org/abs/2010.02502,
+    # with per-sample timesteps so a batch can sit at different points of the trajectory
+    alpha_prod_t = _alpha_prod(ddim_scheduler, timesteps, x_t.dtype)
+    alpha_prod_prev = _alpha_prod(ddim_scheduler, prev_timesteps, x_t.dtype)
+    pred_original_sample = (x_t - (1 - alpha_prod_t) ** 0.5 * pred_noise) / alpha_prod_t**0.5
+    return alpha_prod_prev**0.5 * pred_original_sample + (1 - alpha_prod_prev) ** 0.5 * pred_noise
+
+
+def ddim_target_noise(ddim_scheduler, x_t, x_prev, timesteps, prev_timesteps):
+    # Inverse of ddim_sampling_step: the noise prediction that takes x_t to x_prev in a single DDIM step
+    alpha_prod_t = _alpha_prod(ddim_scheduler, timesteps, x_t.dtype)
+    alpha_prod_prev = _alpha_prod(ddim_scheduler, prev_timesteps, x_t.dtype)
+    ratio = (alpha_prod_prev / alpha_prod_t) ** 0.5
+    return (x_prev - ratio * x_t) / ((1 - alpha_prod_prev) ** 0.5 - ratio * (1 - alpha_prod_t) ** 0.5)
+
+
+def check_ddim_target_noise(ddim_scheduler, timesteps, prev_timesteps):
+    # ddim_target_noise has to give back the noise of a single ddim_sampling_step from timesteps to prev_timesteps
+    shape = (len(timesteps), 4, 1, 2, 2)
+    pred_noise = torch.randn(shape, dtype=torch.float64, device=timesteps.device)
+    x_t = torch.randn(shape, dtype=torch.float64, device=timesteps.device)
+    x_prev = ddim_sampling_step(ddim_scheduler, pred_noise, timesteps, prev_timesteps, x_t)
+    target = ddim_target_noise(ddim_scheduler, x_t, x_prev, timesteps, prev_timesteps)
+    max_error = (target - pred_noise).abs().max().item()
+    if max_error > 1e-6:
+        raise RuntimeError(f"The DDIM target noise is off by {max_error} from {timesteps} to {prev_timesteps}")
+
+
 def plot_loss_chart(save_path: str, *args):
     # Creating the plot
     plt.figure()
@@ -0,0 +1,72 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import subprocess
+
+import soundfile as sf
+
+
+class OrderedEncoder:
+    """Encode windows arriving in any order as a single video, in window order.
+
+    The frames are piped as raw RGB to a single libx264 encoder. The serial pipeline, the sharded inference and the
+    batch inference all write through this class, so they produce the same file for the same frames.
+    """
+
+    def __init__(self, video_path: str, video_fps: int):
+        self.video_path = video_path
+        self.video_fps = video_fps
+        self.pending = {}
+        self.next_window = 0
+        self.num_frames = 0
+        self.process = None
+
+    def add(self, window_index, batch_frames):
+        # A shard that was queued again may render windows that already arrived
+        if window_index < self.next_window or window_index in self.pending:
+            return 0
+        self.pending[window_index] = batch_frames
+        num_written = 0
+        while self.next_window in self.pending:
+            self.write(self.pending.pop(self.next_window))
+            self.next_window += 1
+            num_written += 1
+        return num_written
+
+    def write(self, batch_frames):
+        if self.process is None:
+            height, width = batch_frames.shape[1:3]
+            command = ["ffmpeg", "-y", "-loglevel", "error", "-f", "rawvideo", "-pix_fmt", "rgb24"]
+            command += ["-s", f"{width}x{height}", "-r", str(self.video_fps), "-i", "pipe:0"]
+            command += ["-c:v", "libx264", "-pix_fmt", "yuv420p", self.video_path]
+            self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+        self.process.stdin.write(batch_frames.tobytes())
+        self.num_frames += len(batch_frames)
+
+    def close(self):
+        if self.process is None or self.process.stdin.closed:
+            return
+        self.process.stdin.close()
+        self.process.wait()
+        if self.process.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed to encode {self.video_path}")
+
+    def mux(self, audio_samples, audio_sample_rate: int, video_out_path: str):
+        """Write the encoded frames with `audio_samples` trimmed to their duration to `video_out_path`."""
+        audio_samples = audio_samples[: int(self.num_frames / self.video_fps * audio_sample_rate)].cpu().numpy()
+        audio_path = os.path.join(os.path.dirname(self.video_path), "audio.wav")
+        sf.write(audio_path, audio_samples, audio_sample_rate)
+        command = f"ffmpeg -y -loglevel error -nostdin -i {self.video_path} -i {audio_path} -c:v copy -c:a aac -q:v 0 -q:a 0 {video_out_path}"
+        subprocess.run(command, shell=True)
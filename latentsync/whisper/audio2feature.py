@@ -4,6 +4,17 @@ from .whisper import load_model
 import numpy as np
 import torch
 import os
+from typing import Union
+
+
+def overlap_audio_window_index(start_index, num_frames, audio_feat_length, feature_length, fps=25):
+    """Feature rows `Audio2Feature.crop_overlap_audio_window` gathers for each of `num_frames` video frames.
+
+    `features[index].reshape(num_frames, -1, embedding_dim)` equals the cropped window, for any array of features.
+    """
+    center_idx = (np.arange(start_index, start_index + num_frames) * 50 / fps).astype(int)
+    offsets = np.arange(-audio_feat_length[0] * 2, (audio_feat_length[1] + 1) * 2)
+    return np.clip(center_idx[:, None] + offsets[None, :], 0, feature_length - 1)
 
 
 class Audio2Feature:
@@ -99,7 +110,7 @@ class Audio2Feature:
 
         return whisper_chunks
 
-    def _audio2feat(self, audio_path: str):
+    def _audio2feat(self, audio_path: Union[str, np.ndarray]):
         # get the sample rate of the audio
         result = self.model.transcribe(audio_path)
         embed_list = []
@@ -114,8 +125,9 @@ class Audio2Feature:
         concatenated_array = torch.from_numpy(np.concatenate(embed_list, axis=0))
         return concatenated_array
 
-    def audio2feat(self, audio_path):
-        if self.audio_embeds_cache_dir == "" or self.audio_embeds_cache_dir is None:
+    def audio2feat(self, audio_path: Union[str, np.ndarray]):
+        # A 16 kHz waveform can be passed instead of a path, it is never cached
+        if self.audio_embeds_cache_dir == "" or self.audio_embeds_cache_dir is None or not isinstance(audio_path, str):
             return self._audio2feat(audio_path)
 
         audio_embeds_cache_path = os.path.join(self.audio_embeds_cache_dir, os.path.basename(audio_path) + ".pt")
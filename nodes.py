@@ -1,11 +1,21 @@
 import os
-import tempfile
-import torchaudio
-import uuid
 import sys
+import json
+import uuid
+import random
 import shutil
-from collections.abc import Mapping
+import atexit
+import hashlib
+import argparse
+import platform
 import datetime
+import tempfile
+import subprocess
+import importlib.util
+
+# torch, torchaudio, numpy, omegaconf, diffusers and the face landmark backends are only imported when a node
+# executes, so registering the nodes at ComfyUI startup is cheap and has no side effects
+MODULE_TEMP_DIR = None
 
 # Function to find ComfyUI directories
 def get_comfyui_temp_dir():
@@ -74,55 +84,20 @@ def cleanup_comfyui_temp_directories():
     except Exception as e:
         print(f"Error cleaning up temp directories: {str(e)}")
 
-# Create a module-level function to set up system-wide temp directory
-def init_temp_directories():
-    """Initialize global temporary directory settings"""
-    # First clean up any existing temp directories
-    cleanup_comfyui_temp_directories()
-    
-    # Generate a unique base directory for this module
-    system_temp = tempfile.gettempdir()
-    unique_id = str(uuid.uuid4())[:8]
-    temp_base_path = os.path.join(system_temp, f"latentsync_{unique_id}")
-    os.makedirs(temp_base_path, exist_ok=True)
-    
-    # Override environment variables that control temp directories
-    os.environ['TMPDIR'] = temp_base_path
-    os.environ['TEMP'] = temp_base_path
-    os.environ['TMP'] = temp_base_path
-    
-    # Force Python's tempfile module to use our directory
-    tempfile.tempdir = temp_base_path
-    
-    # Final check for ComfyUI temp directory
-    comfyui_temp = get_comfyui_temp_dir()
-    if comfyui_temp and os.path.exists(comfyui_temp):
-        try:
-            shutil.rmtree(comfyui_temp)
-            print(f"Removed ComfyUI temp directory: {comfyui_temp}")
-        except Exception as e:
-            print(f"Could not remove {comfyui_temp}, trying to rename: {str(e)}")
-            try:
-                backup_name = f"{comfyui_temp}_backup_{unique_id}"
-                os.rename(comfyui_temp, backup_name)
-                print(f"Renamed {comfyui_temp} to {backup_name}")
-                # Try to remove the renamed directory as well
-                try:
-                    shutil.rmtree(backup_name)
-                    print(f"Removed renamed temp directory: {backup_name}")
-                except:
-                    pass
-            except:
-                print(f"Failed to rename {comfyui_temp}")
-    
-    print(f"Set up system temp directory: {temp_base_path}")
-    return temp_base_path
+def get_module_temp_dir():
+    """Private temp directory of this extension, created on first use"""
+    global MODULE_TEMP_DIR
+    if MODULE_TEMP_DIR is None:
+        MODULE_TEMP_DIR = tempfile.mkdtemp(prefix="latentsync_")
+        # Register the cleanup handler to run when Python exits
+        atexit.register(module_cleanup)
+        print(f"Set up module temp directory: {MODULE_TEMP_DIR}")
+    os.makedirs(MODULE_TEMP_DIR, exist_ok=True)
+    return MODULE_TEMP_DIR
 
 # Function to clean up everything when the module exits
 def module_cleanup():
     """Clean up all resources when the module is unloaded"""
-    global MODULE_TEMP_DIR
-    
     # Clean up our module temp directory
     if MODULE_TEMP_DIR and os.path.exists(MODULE_TEMP_DIR):
         try:
@@ -130,41 +105,6 @@ def module_cleanup():
             print(f"Cleaned up module temp directory: {MODULE_TEMP_DIR}")
         except:
             pass
-    
-    # Do a final sweep for any ComfyUI temp directories
-    cleanup_comfyui_temp_directories()
-
-# Call this before anything else
-MODULE_TEMP_DIR = init_temp_directories()
-
-# Register the cleanup handler to run when Python exits
-import atexit
-atexit.register(module_cleanup)
-
-# Now import regular dependencies
-import math
-import torch
-import random
-import torchaudio
-import folder_paths
-import numpy as np
-import platform
-import subprocess
-import importlib.util
-import importlib.machinery
-import argparse
-from omegaconf import OmegaConf
-from PIL import Image
-from decimal import Decimal, ROUND_UP
-import requests
-
-# Modify folder_paths module to use our temp directory
-if hasattr(folder_paths, "get_temp_directory"):
-    original_get_temp = folder_paths.get_temp_directory
-    folder_paths.get_temp_directory = lambda: MODULE_TEMP_DIR
-else:
-    # Add the function if it doesn't exist
-    setattr(folder_paths, 'get_temp_directory', lambda: MODULE_TEMP_DIR)
 
 def import_inference_script(script_path):
     """Import a Python file as a module using its file path."""
@@ -263,9 +203,8 @@ def get_ext_dir(subpath=None, mkdir=False):
     
     # Special case for temp directories
     if subpath and ("temp" in subpath.lower() or "tmp" in subpath.lower()):
-        # Use our global temp directory instead
-        global MODULE_TEMP_DIR
-        sub_temp = os.path.join(MODULE_TEMP_DIR, subpath)
+        # Use our module temp directory instead
+        sub_temp = os.path.join(get_module_temp_dir(), subpath)
         if mkdir and not os.path.exists(sub_temp):
             os.makedirs(sub_temp, exist_ok=True)
         return sub_temp
@@ -280,6 +219,8 @@ def get_ext_dir(subpath=None, mkdir=False):
 
 def download_model(url, save_path):
     """Download a model from a URL and save it to the specified path."""
+    import requests
+
     os.makedirs(os.path.dirname(save_path), exist_ok=True)
     response = requests.get(url, stream=True)
     with open(save_path, "wb") as f:
@@ -293,7 +234,8 @@ def pre_download_models():
         # Add other models here
     }
 
-    cache_dir = os.path.join(MODULE_TEMP_DIR, "model_cache")
+    # Persistent, so the models are downloaded once and not on every start
+    cache_dir = os.path.join(get_ext_dir(), "checkpoints", "model_cache")
     os.makedirs(cache_dir, exist_ok=True)
     
     for model_name, url in models.items():
@@ -306,9 +248,6 @@ def pre_download_models():
 
 def setup_models():
     """Setup and pre-download all required models."""
-    # Use our global temp directory
-    global MODULE_TEMP_DIR
-    
     # Pre-download additional models
     pre_download_models()
 
@@ -320,7 +259,7 @@ def setup_models():
     os.makedirs(whisper_dir, exist_ok=True)
 
     # Create a temp_downloads directory in our system temp
-    temp_downloads = os.path.join(MODULE_TEMP_DIR, "downloads")
+    temp_downloads = os.path.join(get_module_temp_dir(), "downloads")
     os.makedirs(temp_downloads, exist_ok=True)
     
     unet_path = os.path.join(ckpt_dir, "latentsync_unet.pt")
@@ -345,25 +284,145 @@ def setup_models():
             print(f"   with whisper/tiny.pt in: {whisper_dir}")
             raise RuntimeError("Model download failed. See instructions above.")
 
-class VideoBasicLatentSyncNode:
-    def __init__(self):
-        # Make sure our temp directory is the current one
-        global MODULE_TEMP_DIR
-        if not os.path.exists(MODULE_TEMP_DIR):
-            os.makedirs(MODULE_TEMP_DIR, exist_ok=True)
-        
-        # Ensure ComfyUI temp doesn't exist
-        comfyui_temp = get_comfyui_temp_dir()
-        if comfyui_temp and os.path.exists(comfyui_temp):
-            backup_name = f"{comfyui_temp}_backup_{uuid.uuid4().hex[:8]}"
-            try:
-                os.rename(comfyui_temp, backup_name)
-            except:
-                pass
-        
+MANIFEST_FILES = [
+    "latentsync_unet.pt",
+    os.path.join("whisper", "tiny.pt"),
+    os.path.join("model_cache", "s3fd-e19a316812.pth"),
+]
+SETUP_DONE = False
+
+def quick_file_hash(path, chunk_size=1 << 20):
+    """sha256 of the size, first and last MiB of a file, cheap enough to check multi-GB checkpoints on each start"""
+    size = os.path.getsize(path)
+    sha = hashlib.sha256(str(size).encode())
+    with open(path, "rb") as f:
+        sha.update(f.read(chunk_size))
+        if size > chunk_size:
+            f.seek(max(size - chunk_size, chunk_size))
+            sha.update(f.read(chunk_size))
+    return sha.hexdigest()
+
+def build_manifest(ckpt_dir):
+    files = {}
+    for name in MANIFEST_FILES:
+        path = os.path.join(ckpt_dir, name)
+        if os.path.exists(path):
+            files[name] = {"size": os.path.getsize(path), "hash": quick_file_hash(path)}
+    return {
+        "python": sys.executable,
+        "ffmpeg": shutil.which("ffmpeg"),
+        "files": files,
+    }
+
+def manifest_is_valid(manifest, ckpt_dir):
+    if manifest.get("python") != sys.executable:
+        return False
+    ffmpeg_path = manifest.get("ffmpeg")
+    if not ffmpeg_path or not os.path.exists(ffmpeg_path):
+        return False
+    # check_ffmpeg may have found ffmpeg outside of PATH on Windows
+    ffmpeg_dir = os.path.dirname(ffmpeg_path)
+    if shutil.which("ffmpeg") is None:
+        os.environ["PATH"] = ffmpeg_dir + os.pathsep + os.environ.get("PATH", "")
+    for name in MANIFEST_FILES:
+        path = os.path.join(ckpt_dir, name)
+        entry = manifest.get("files", {}).get(name)
+        if entry is None or not os.path.exists(path) or os.path.getsize(path) != entry["size"]:
+            return False
+        if quick_file_hash(path) != entry["hash"]:
+            return False
+    return True
+
+def ensure_setup():
+    """Check the dependencies and model files once per process.
+
+    The result is cached in checkpoints/.latentsync_manifest.json, later processes only verify the recorded
+    ffmpeg and the size and hash of the model files instead of probing packages and downloading.
+    """
+    global SETUP_DONE
+    if SETUP_DONE:
+        return
+
+    ckpt_dir = os.path.join(get_ext_dir(), "checkpoints")
+    manifest_path = os.path.join(ckpt_dir, ".latentsync_manifest.json")
+    manifest = {}
+    if os.path.exists(manifest_path):
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable manifest {manifest_path}: {str(e)}")
+
+    if not manifest_is_valid(manifest, ckpt_dir):
         check_and_install_dependencies()
         setup_models()
+        try:
+            with open(manifest_path, "w", encoding="utf-8") as f:
+                json.dump(build_manifest(ckpt_dir), f, indent=2)
+        except OSError as e:
+            print(f"Could not write manifest {manifest_path}: {str(e)}")
+
+    SETUP_DONE = True
+
+def get_comfy_progress_hooks():
+    """Progress and interruption hooks of the ComfyUI executor, no-ops when running outside ComfyUI"""
+    try:
+        import comfy.model_management
+        import comfy.utils
+    except ImportError:
+        return None, lambda: False, lambda: None
+
+    progress_bar = comfy.utils.ProgressBar(1)
+
+    def window_callback(windows_done, total_windows):
+        progress_bar.update_absolute(windows_done, total_windows)
+
+    def clear_interrupt():
+        comfy.model_management.interrupt_current_processing(False)
+
+    return window_callback, comfy.model_management.processing_interrupted, clear_interrupt
 
+def raise_if_interrupted(e):
+    """Report a cancelled lipsync run to ComfyUI as an interruption rather than as a failure"""
+    if type(e).__name__ != "LipsyncInterrupted":
+        return
+    try:
+        import comfy.model_management
+    except ImportError:
+        return
+    comfy.model_management.throw_exception_if_processing_interrupted()
+
+def load_inference_config(cur_dir):
+    """Resolve the UNet config, checkpoint and mask image of the extension"""
+    config_path = os.path.join(cur_dir, "configs", "unet", "stage2.yaml")
+    ckpt_path = os.path.join(cur_dir, "checkpoints", "latentsync_unet.pt")
+    # Prefer the safetensors conversion (tools/convert_unet_to_safetensors.py) when present
+    safetensors_ckpt_path = os.path.join(cur_dir, "checkpoints", "latentsync_unet.safetensors")
+    if os.path.exists(safetensors_ckpt_path):
+        ckpt_path = safetensors_ckpt_path
+
+    from omegaconf import OmegaConf
+
+    config = OmegaConf.load(config_path)
+
+    # Set the correct mask image path
+    mask_image_path = os.path.join(cur_dir, "latentsync", "utils", "mask.png")
+    # Make sure the mask image exists
+    if not os.path.exists(mask_image_path):
+        # Try to find it in the utils directory directly
+        alt_mask_path = os.path.join(cur_dir, "utils", "mask.png")
+        if os.path.exists(alt_mask_path):
+            mask_image_path = alt_mask_path
+        else:
+            print(f"Warning: Could not find mask image at expected locations")
+
+    # Set mask path in config
+    if hasattr(config, "data") and hasattr(config.data, "mask_image_path"):
+        config.data.mask_image_path = mask_image_path
+
+    return config_path, config, ckpt_path, mask_image_path
+
+class VideoBasicLatentSyncNode:
     @classmethod
     def INPUT_TYPES(s):
         return {"required": {
@@ -372,6 +431,15 @@ class VideoBasicLatentSyncNode:
                     "seed": ("INT", {"default": 1247}),
                     "lips_expression": ("FLOAT", {"default": 1.5, "min": 1.0, "max": 3.0, "step": 0.1}),
                     "inference_steps": ("INT", {"default": 20, "min": 1, "max": 999, "step": 1}),
+                 },
+                "optional": {
+                    "device": (["auto", "cuda", "cpu"], {"default": "auto"}),
+                    "precision": (["auto", "fp32", "fp16", "bf16"], {"default": "auto"}),
+                    # Keep in sync with latentsync/utils/scheduler.py, listed here so diffusers is not imported at startup
+                    "scheduler": (["ddim", "dpm_solver++", "dpm_solver++_karras", "unipc", "euler", "euler_ancestral",
+                                   "lms", "pndm"], {"default": "ddim"}),
+                    # What to do when the job is cancelled: fail, or return the frames rendered so far
+                    "on_interrupt": (["discard", "return_partial"], {"default": "discard"}),
                  },}
 
     CATEGORY = "LatentSyncNode"
@@ -381,6 +449,8 @@ class VideoBasicLatentSyncNode:
     FUNCTION = "inference"
 
     def process_batch(self, batch, use_mixed_precision=False):
+        import torch
+
         with torch.cuda.amp.autocast(enabled=use_mixed_precision):
             processed_batch = batch.float() / 255.0
             if len(processed_batch.shape) == 3:
@@ -391,10 +461,12 @@ class VideoBasicLatentSyncNode:
                 processed_batch = processed_batch[..., :3]
             return processed_batch
 
-    def inference(self, video_path, audio_path, seed, lips_expression=1.5, inference_steps=20):
-        # Use our module temp directory
-        global MODULE_TEMP_DIR
-        
+    def inference(self, video_path, audio_path, seed, lips_expression=1.5, inference_steps=20, device="auto",
+                  precision="auto", scheduler="ddim", on_interrupt="discard"):
+        import torch
+
+        ensure_setup()
+
         # Validate input paths
         if not os.path.exists(video_path):
             raise FileNotFoundError(f"Input video file not found: {video_path}")
@@ -402,10 +474,12 @@ class VideoBasicLatentSyncNode:
             raise FileNotFoundError(f"Input audio file not found: {audio_path}")
         
         # Get GPU capabilities and memory
-        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        if device == "auto":
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        device = torch.device(device)
         BATCH_SIZE = 4
         use_mixed_precision = False
-        if torch.cuda.is_available():
+        if device.type == "cuda":
             gpu_mem = torch.cuda.get_device_properties(0).total_memory
             # Convert to GB
             gpu_mem_gb = gpu_mem / (1024 ** 3)
@@ -436,7 +510,7 @@ class VideoBasicLatentSyncNode:
 
         # Create a run-specific subdirectory in our temp directory
         run_id = ''.join(random.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(5))
-        temp_dir = os.path.join(MODULE_TEMP_DIR, f"run_{run_id}")
+        temp_dir = os.path.join(get_module_temp_dir(), f"run_{run_id}")
         os.makedirs(temp_dir, exist_ok=True)
         
         # Ensure ComfyUI temp doesn't exist again (in case something recreated it)
@@ -459,28 +533,11 @@ class VideoBasicLatentSyncNode:
             
             # Define paths to required files and configs
             inference_script_path = os.path.join(cur_dir, "scripts", "inference.py")
-            config_path = os.path.join(cur_dir, "configs", "unet", "stage2.yaml")
             scheduler_config_path = os.path.join(cur_dir, "configs")
-            ckpt_path = os.path.join(cur_dir, "checkpoints", "latentsync_unet.pt")
             whisper_ckpt_path = os.path.join(cur_dir, "checkpoints", "whisper", "tiny.pt")
 
             # Create config and args
-            config = OmegaConf.load(config_path)
-
-            # Set the correct mask image path
-            mask_image_path = os.path.join(cur_dir, "latentsync", "utils", "mask.png")
-            # Make sure the mask image exists
-            if not os.path.exists(mask_image_path):
-                # Try to find it in the utils directory directly
-                alt_mask_path = os.path.join(cur_dir, "utils", "mask.png")
-                if os.path.exists(alt_mask_path):
-                    mask_image_path = alt_mask_path
-                else:
-                    print(f"Warning: Could not find mask image at expected locations")
-
-            # Set mask path in config
-            if hasattr(config, "data") and hasattr(config.data, "mask_image_path"):
-                config.data.mask_image_path = mask_image_path
+            config_path, config, ckpt_path, mask_image_path = load_inference_config(cur_dir)
 
             args = argparse.Namespace(
                 unet_config_path=config_path,
@@ -492,13 +549,19 @@ class VideoBasicLatentSyncNode:
                 inference_steps=inference_steps,
                 guidance_scale=lips_expression,  # Using lips_expression for the guidance_scale
                 scheduler_config_path=scheduler_config_path,
+                scheduler=scheduler,
                 whisper_ckpt_path=whisper_ckpt_path,
                 device=device,
+                unet_precision=precision,
+                vae_precision="auto",
+                num_threads=0,
                 batch_size=BATCH_SIZE,
                 use_mixed_precision=use_mixed_precision,
                 temp_dir=temp_dir,
-                mask_image_path=mask_image_path
+                mask_image_path=mask_image_path,
+                return_partial=on_interrupt == "return_partial",
             )
+            args.window_callback, args.should_stop, clear_interrupt = get_comfy_progress_hooks()
 
             # Set PYTHONPATH to include our directories 
             package_root = os.path.dirname(cur_dir)
@@ -526,12 +589,16 @@ class VideoBasicLatentSyncNode:
             if hasattr(inference_module, 'get_temp_dir'):
                 inference_module.get_temp_dir = lambda *args, **kwargs: temp_dir
                 
-            # Create subdirectories that the inference module might expect
+            # The pipeline writes its frames there (see scripts/inference.main)
             inference_temp = os.path.join(temp_dir, "temp")
             os.makedirs(inference_temp, exist_ok=True)
             
             # Run inference
-            inference_module.main(config, args)
+            completed = inference_module.main(config, args)
+            if completed is False:
+                # Let the rest of the workflow run on the partial video
+                print("LatentSync was interrupted, returning the frames rendered so far")
+                clear_interrupt()
 
             # Clean GPU cache after inference
             if torch.cuda.is_available():
@@ -555,6 +622,7 @@ class VideoBasicLatentSyncNode:
             return (permanent_output_path,)
 
         except Exception as e:
+            raise_if_interrupted(e)
             print(f"Error during inference: {str(e)}")
             import traceback
             traceback.print_exc()
@@ -609,169 +677,25 @@ class VideoBasicLatentSyncLengthAdjuster:
         if not os.path.exists(audio_path):
             raise FileNotFoundError(f"Input audio file not found: {audio_path}")
         
-        # Use our module temp directory
-        global MODULE_TEMP_DIR
-        
+        # Only ffmpeg is needed here, the model setup is left to the lipsync nodes
+        if not check_ffmpeg():
+            raise RuntimeError("FFmpeg is required but not found")
+
         # Create a run-specific subdirectory in our temp directory
         run_id = ''.join(random.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(5))
-        temp_dir = os.path.join(MODULE_TEMP_DIR, f"vla_run_{run_id}")
+        temp_dir = os.path.join(get_module_temp_dir(), f"vla_run_{run_id}")
         os.makedirs(temp_dir, exist_ok=True)
         
         # Create output video path in our system temp directory
         output_video_path = os.path.join(temp_dir, f"adjusted_{run_id}.mp4")
         
         try:
-            # Load audio file
-            waveform, sample_rate = torchaudio.load(audio_path)
-            
-            # Extract frames from video using ffmpeg
-            import ffmpeg
-            
-            # Get video info
-            probe = ffmpeg.probe(video_path)
-            video_info = next(s for s in probe['streams'] if s['codec_type'] == 'video')
-            original_fps = float(eval(video_info.get('r_frame_rate', str(fps))))
-            width = int(video_info['width'])
-            height = int(video_info['height'])
-            
-            # Create temp directory for frames
-            frames_dir = os.path.join(temp_dir, "frames")
-            os.makedirs(frames_dir, exist_ok=True)
-            
-            # Extract frames
-            (
-                ffmpeg
-                .input(video_path)
-                .output(os.path.join(frames_dir, "frame%04d.png"), r=original_fps)
-                .run(quiet=True, overwrite_output=True)
-            )
-            
-            # Get list of frames
-            frame_files = sorted([f for f in os.listdir(frames_dir) if f.startswith("frame") and f.endswith(".png")])
-            
-            # Process based on mode
-            if mode == "normal":
-                # Add silent padding to the audio
-                audio_duration = waveform.shape[1] / sample_rate
-                silence_samples = math.ceil(silent_padding_sec * sample_rate)
-                silence = torch.zeros((waveform.shape[0], silence_samples), dtype=waveform.dtype)
-                padded_audio = torch.cat([waveform, silence], dim=1)
-                
-                # Calculate required frames based on the padded audio
-                padded_audio_duration = (waveform.shape[1] + silence_samples) / sample_rate
-                required_frames = int(padded_audio_duration * fps)
-                
-                if len(frame_files) > required_frames:
-                    # Trim video frames to match padded audio duration
-                    adjusted_frames = frame_files[:required_frames]
-                else:
-                    # If video is shorter than padded audio, keep all video frames
-                    # and trim the audio accordingly
-                    adjusted_frames = frame_files
-                    required_samples = int(len(frame_files) / fps * sample_rate)
-                    padded_audio = padded_audio[:, :required_samples]
-                
-                # Save adjusted audio
-                temp_audio_path = os.path.join(temp_dir, "adjusted_audio.wav")
-                torchaudio.save(temp_audio_path, padded_audio.unsqueeze(0), sample_rate)
-                
-                # Create output directory for adjusted frames
-                adjusted_frames_dir = os.path.join(temp_dir, "adjusted_frames")
-                os.makedirs(adjusted_frames_dir, exist_ok=True)
-                
-                # Copy selected frames to adjusted directory
-                for i, frame in enumerate(adjusted_frames):
-                    shutil.copy2(
-                        os.path.join(frames_dir, frame),
-                        os.path.join(adjusted_frames_dir, f"adjusted_frame{i:04d}.png")
-                    )
-                
-            elif mode == "pingpong":
-                video_duration = len(frame_files) / original_fps
-                audio_duration = waveform.shape[1] / sample_rate
-                
-                if audio_duration <= video_duration:
-                    # Audio is shorter than video, pad with silence
-                    required_samples = int(video_duration * sample_rate)
-                    silence = torch.zeros((waveform.shape[0], required_samples - waveform.shape[1]), dtype=waveform.dtype)
-                    adjusted_audio = torch.cat([waveform, silence], dim=1)
-                    
-                    # Save adjusted audio
-                    temp_audio_path = os.path.join(temp_dir, "adjusted_audio.wav")
-                    torchaudio.save(temp_audio_path, adjusted_audio.unsqueeze(0), sample_rate)
-                    
-                    # Use all original frames
-                    adjusted_frames_dir = frames_dir
-                    
-                else:
-                    # Audio is longer than video, create pingpong effect
-                    silence_samples = math.ceil(silent_padding_sec * sample_rate)
-                    silence = torch.zeros((waveform.shape[0], silence_samples), dtype=waveform.dtype)
-                    padded_audio = torch.cat([waveform, silence], dim=1)
-                    total_duration = (waveform.shape[1] + silence_samples) / sample_rate
-                    target_frames = math.ceil(total_duration * fps)
-                    
-                    # Create pingpong frame sequence
-                    reversed_frames = frame_files[::-1][1:-1]  # Remove endpoints
-                    pingpong_frames = frame_files + reversed_frames
-                    
-                    # Loop if needed
-                    while len(pingpong_frames) < target_frames:
-                        pingpong_frames += pingpong_frames[:target_frames - len(pingpong_frames)]
-                    
-                    # Save adjusted audio
-                    temp_audio_path = os.path.join(temp_dir, "adjusted_audio.wav")
-                    torchaudio.save(temp_audio_path, padded_audio.unsqueeze(0), sample_rate)
-                    
-                    # Create output directory for adjusted frames
-                    adjusted_frames_dir = os.path.join(temp_dir, "adjusted_frames")
-                    os.makedirs(adjusted_frames_dir, exist_ok=True)
-                    
-                    # Copy selected frames to adjusted directory
-                    for i, frame in enumerate(pingpong_frames[:target_frames]):
-                        source_frame = os.path.join(frames_dir, frame_files[int(frame_files.index(frame) if frame in frame_files else 0)])
-                        shutil.copy2(
-                            source_frame,
-                            os.path.join(adjusted_frames_dir, f"adjusted_frame{i:04d}.png")
-                        )
-                
-            elif mode == "loop_to_audio":
-                # Add silent padding then simple loop
-                silence_samples = math.ceil(silent_padding_sec * sample_rate)
-                silence = torch.zeros((waveform.shape[0], silence_samples), dtype=waveform.dtype)
-                padded_audio = torch.cat([waveform, silence], dim=1)
-                total_duration = (waveform.shape[1] + silence_samples) / sample_rate
-                target_frames = math.ceil(total_duration * fps)
-                
-                # Create looped frame sequence
-                looped_frames = []
-                while len(looped_frames) < target_frames:
-                    looped_frames += frame_files[:target_frames - len(looped_frames)]
-                
-                # Save adjusted audio
-                temp_audio_path = os.path.join(temp_dir, "adjusted_audio.wav")
-                torchaudio.save(temp_audio_path, padded_audio.unsqueeze(0), sample_rate)
-                
-                # Create output directory for adjusted frames
-                adjusted_frames_dir = os.path.join(temp_dir, "adjusted_frames")
-                os.makedirs(adjusted_frames_dir, exist_ok=True)
-                
-                # Copy selected frames to adjusted directory
-                for i, frame in enumerate(looped_frames[:target_frames]):
-                    source_frame = os.path.join(frames_dir, frame)
-                    shutil.copy2(
-                        source_frame,
-                        os.path.join(adjusted_frames_dir, f"adjusted_frame{i:04d}.png")
-                    )
-            
-            # Combine frames and audio into output video
-            (
-                ffmpeg
-                .input(os.path.join(adjusted_frames_dir, "adjusted_frame%04d.png"), r=fps)
-                .input(temp_audio_path)
-                .output(output_video_path, vcodec='libx264', pix_fmt='yuv420p', acodec='aac', strict='experimental')
-                .run(quiet=True, overwrite_output=True)
-            )
+            cur_dir = get_ext_dir()
+            if cur_dir not in sys.path:
+                sys.path.insert(0, cur_dir)
+            from latentsync.utils.length_adjust import adjust_video_length
+
+            adjust_video_length(video_path, audio_path, output_video_path, mode, fps, silent_padding_sec, temp_dir)
             
             # Create a permanent output location
             output_dir = os.path.join(get_ext_dir(), "outputs")
@@ -781,8 +705,8 @@ class VideoBasicLatentSyncLengthAdjuster:
             timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
             permanent_output_path = os.path.join(output_dir, f"adjusted_video_{timestamp}.mp4")
             
-            # Copy the output file to the permanent location
-            shutil.copy2(output_video_path, permanent_output_path)
+            # Move the output file to the permanent location, it is on the same volume most of the time
+            shutil.move(output_video_path, permanent_output_path)
             
             return (permanent_output_path,)
             
@@ -801,14 +725,164 @@ class VideoBasicLatentSyncLengthAdjuster:
                 except Exception as e:
                     print(f"Failed to remove temp directory: {str(e)}")
 
+def resample_frame_indices(num_frames, src_fps, dst_fps):
+    """Indices of the source frames shown at each frame of the same clip played at dst_fps"""
+    import numpy as np
+
+    num_dst_frames = int(round(num_frames / src_fps * dst_fps))
+    indices = np.floor(np.arange(num_dst_frames) * src_fps / dst_fps).astype(np.int64)
+    return np.minimum(indices, num_frames - 1)
+
+class VideoBasicLatentSyncImageNode(VideoBasicLatentSyncNode):
+    """VideoBasicLatentSyncNode on IMAGE frames and an AUDIO dict, the pipeline runs in memory without
+    encoding or decoding any video container"""
+
+    @classmethod
+    def INPUT_TYPES(s):
+        input_types = VideoBasicLatentSyncNode.INPUT_TYPES()
+        required = {
+            "images": ("IMAGE",),
+            "audio": ("AUDIO",),
+            "fps": ("FLOAT", {"default": 25.0, "min": 1.0, "max": 120.0}),
+        }
+        for name, value in input_types["required"].items():
+            if name not in ("video_path", "audio_path"):
+                required[name] = value
+        return {"required": required, "optional": input_types["optional"]}
+
+    RETURN_TYPES = ("IMAGE", "AUDIO")
+    RETURN_NAMES = ("images", "audio")
+    FUNCTION = "inference"
+
+    def inference(self, images, audio, fps, seed, lips_expression=1.5, inference_steps=20, device="auto",
+                  precision="auto", scheduler="ddim", on_interrupt="discard"):
+        import torch
+        import torchaudio
+        from accelerate.utils import set_seed
+
+        ensure_setup()
+
+        cur_dir = get_ext_dir()
+        if cur_dir not in sys.path:
+            sys.path.insert(0, cur_dir)
+        config_path, config, ckpt_path, mask_image_path = load_inference_config(cur_dir)
+        args = argparse.Namespace(
+            unet_config_path=config_path,
+            inference_ckpt_path=ckpt_path,
+            seed=seed,
+            inference_steps=inference_steps,
+            guidance_scale=lips_expression,  # Using lips_expression for the guidance_scale
+            scheduler=scheduler,
+            device=device,
+            unet_precision=precision,
+            vae_precision="auto",
+            num_threads=0,
+        )
+        inference_module = import_inference_script(os.path.join(cur_dir, "scripts", "inference.py"))
+        pipeline, policy = inference_module.load_pipeline(config, args)
+
+        model_fps = config.data.video_fps
+        audio_sample_rate = config.data.audio_sample_rate
+
+        # IMAGE is (f, h, w, c) float in [0, 1], the pipeline works on RGB uint8 frames at the model frame rate
+        frames = (images[..., :3].clamp(0, 1) * 255).round().to(torch.uint8).cpu().numpy()
+        frames = frames[resample_frame_indices(len(frames), fps, model_fps)]
+
+        # AUDIO is {"waveform": (b, c, t), "sample_rate": int}, Whisper wants a mono 16 kHz waveform
+        waveform, sample_rate = audio["waveform"], audio["sample_rate"]
+        audio_samples = waveform[0].float().mean(dim=0)
+        if sample_rate != audio_sample_rate:
+            audio_samples = torchaudio.functional.resample(audio_samples, sample_rate, audio_sample_rate)
+
+        if seed != -1:
+            set_seed(seed)
+        else:
+            torch.seed()
+        print(f"Initial seed: {torch.initial_seed()}")
+
+        window_callback, should_stop, clear_interrupt = get_comfy_progress_hooks()
+        try:
+            out_frames, _ = pipeline.lipsync_frames(
+                frames,
+                audio_samples,
+                num_frames=config.data.num_frames,
+                video_fps=model_fps,
+                audio_sample_rate=audio_sample_rate,
+                num_inference_steps=inference_steps,
+                guidance_scale=lips_expression,
+                weight_dtype=policy.unet_dtype,
+                width=config.data.resolution,
+                height=config.data.resolution,
+                mask_image_path=mask_image_path,
+                window_callback=window_callback,
+                should_stop=should_stop,
+                return_partial=on_interrupt == "return_partial",
+            )
+            if should_stop():
+                # Interrupted with return_partial, let the rest of the workflow run on the rendered prefix
+                clear_interrupt()
+        except Exception as e:
+            raise_if_interrupted(e)
+            raise
+        finally:
+            del pipeline
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+        # Back to the input frame rate, with the original audio trimmed to the same duration
+        out_frames = out_frames[resample_frame_indices(len(out_frames), model_fps, fps)]
+        out_images = torch.from_numpy(out_frames).float() / 255.0
+        num_samples = int(len(out_frames) / fps * sample_rate)
+        return (out_images, {"waveform": waveform[..., :num_samples], "sample_rate": sample_rate})
+
+class VideoBasicLatentSyncLengthAdjusterImage:
+    """VideoBasicLatentSyncLengthAdjuster on IMAGE frames and an AUDIO dict, frames are only reindexed"""
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "images": ("IMAGE",),
+                "audio": ("AUDIO",),
+                "mode": (["normal", "pingpong", "loop_to_audio"], {"default": "normal"}),
+                "fps": ("FLOAT", {"default": 25.0, "min": 1.0, "max": 120.0}),
+                "silent_padding_sec": ("FLOAT", {"default": 0.5, "min": 0.1, "max": 3.0, "step": 0.1}),
+            }
+        }
+
+    CATEGORY = "LatentSyncNode"
+    RETURN_TYPES = ("IMAGE", "AUDIO")
+    RETURN_NAMES = ("images", "audio")
+    FUNCTION = "adjust"
+
+    def adjust(self, images, audio, mode, fps=25.0, silent_padding_sec=0.5):
+        import torch
+
+        cur_dir = get_ext_dir()
+        if cur_dir not in sys.path:
+            sys.path.insert(0, cur_dir)
+        from latentsync.utils.length_adjust import length_adjust_indices, pad_or_trim_waveform
+
+        waveform, sample_rate = audio["waveform"], audio["sample_rate"]
+        frame_indices, num_samples = length_adjust_indices(
+            len(images), waveform.shape[-1], sample_rate, mode, fps, silent_padding_sec
+        )
+        adjusted_images = images[torch.from_numpy(frame_indices).to(images.device)]
+        adjusted_waveform = pad_or_trim_waveform(waveform, num_samples)
+        return (adjusted_images, {"waveform": adjusted_waveform, "sample_rate": sample_rate})
+
 # Node Mappings for ComfyUI
 NODE_CLASS_MAPPINGS = {
     "VideoBasicLatentSyncNode": VideoBasicLatentSyncNode,
     "VideoBasicLatentSyncLengthAdjuster": VideoBasicLatentSyncLengthAdjuster,
+    "VideoBasicLatentSyncImageNode": VideoBasicLatentSyncImageNode,
+    "VideoBasicLatentSyncLengthAdjusterImage": VideoBasicLatentSyncLengthAdjusterImage,
 }
 
 # Display Names for ComfyUI
 NODE_DISPLAY_NAME_MAPPINGS = {
     "VideoBasicLatentSyncNode": "VideoBasic LatentSync Node",
     "VideoBasicLatentSyncLengthAdjuster": "VideoBasic LatentSync Length Adjuster",
+    "VideoBasicLatentSyncImageNode": "VideoBasic LatentSync Node (Images)",
+    "VideoBasicLatentSyncLengthAdjusterImage": "VideoBasic LatentSync Length Adjuster (Images)",
  }
\ No newline at end of file
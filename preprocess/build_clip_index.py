@@ -0,0 +1,111 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Record the frame count and mel length of every training video, and whether it decodes at all.
+
+    python -m preprocess.build_clip_index --fileslist <fileslist> --index_path <clip_index.jsonl> --num_workers 32
+
+Then set `data.clip_index_path` in the UNet or SyncNet config: the datasets only draw windows that have all their
+frames and mel, and `ClipSampler` makes the samples of every step reproducible. Videos already in the index are
+skipped, so the index can be extended or an interrupted run restarted.
+"""
+
+import argparse
+import json
+import os
+from functools import partial
+from multiprocessing import Pool
+
+import tqdm
+from decord import VideoReader, cpu
+
+from latentsync.data.clip_index import read_clip_index
+from latentsync.data.mel_store import MelStore
+from latentsync.utils.util import gather_video_paths_recursively
+from preprocess.build_mel_store import read_mel
+
+
+mel_stores = {}
+
+
+def index_clip(video_path, audio_sample_rate, audio_mel_cache_dir, audio_mel_store_dir):
+    entry = {"video_path": video_path, "num_frames": 0, "mel_frames": 0, "valid": False}
+    try:
+        vr = VideoReader(video_path, ctx=cpu(0))
+        entry["num_frames"] = len(vr)
+        # The first and last frames have to decode too, a truncated file fails on them
+        vr.get_batch([0, len(vr) - 1])
+        vr.seek(0)  # avoid memory leak
+        if audio_mel_store_dir != "" and audio_mel_store_dir not in mel_stores:
+            mel_stores[audio_mel_store_dir] = MelStore(audio_mel_store_dir)
+        if audio_mel_store_dir != "" and video_path in mel_stores[audio_mel_store_dir]:
+            entry["mel_frames"] = mel_stores[audio_mel_store_dir].video_mel(video_path).shape[-1]
+        else:
+            entry["mel_frames"] = read_mel(video_path, audio_sample_rate, audio_mel_cache_dir).shape[-1]
+        entry["valid"] = True
+    except Exception as e:
+        entry["error"] = f"{type(e).__name__}: {e}"
+    return entry
+
+
+def build_clip_index(
+    video_paths, index_path, num_workers, audio_sample_rate=16000, audio_mel_cache_dir="", audio_mel_store_dir=""
+):
+    indexed_video_paths = set()
+    if os.path.isfile(index_path):
+        indexed_video_paths = {entry["video_path"] for entry in read_clip_index(index_path)}
+    video_paths = [video_path for video_path in video_paths if video_path not in indexed_video_paths]
+    print(f"{len(indexed_video_paths)} videos already indexed, {len(video_paths)} to go")
+
+    func = partial(
+        index_clip,
+        audio_sample_rate=audio_sample_rate,
+        audio_mel_cache_dir=audio_mel_cache_dir,
+        audio_mel_store_dir=audio_mel_store_dir,
+    )
+    num_invalid = 0
+    with Pool(num_workers) as pool, open(index_path, "a", encoding="utf-8") as f:
+        for entry in tqdm.tqdm(pool.imap_unordered(func, video_paths, chunksize=16), total=len(video_paths)):
+            num_invalid += not entry["valid"]
+            f.write(json.dumps(entry) + "\n")
+    print(f"Indexed {len(video_paths)} videos, {num_invalid} do not decode")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fileslist", type=str, default="")
+    parser.add_argument("--data_dir", type=str, default="")
+    parser.add_argument("--index_path", type=str, required=True)
+    parser.add_argument("--num_workers", type=int, default=16)
+    parser.add_argument("--audio_sample_rate", type=int, default=16000)
+    parser.add_argument("--audio_mel_cache_dir", type=str, default="")
+    parser.add_argument("--audio_mel_store_dir", type=str, default="")
+    args = parser.parse_args()
+
+    if args.fileslist != "":
+        with open(args.fileslist) as file:
+            video_paths = [line.rstrip() for line in file]
+    elif args.data_dir != "":
+        video_paths = gather_video_paths_recursively(args.data_dir)
+    else:
+        raise ValueError("data_dir and fileslist cannot be both empty")
+
+    build_clip_index(
+        video_paths,
+        args.index_path,
+        args.num_workers,
+        args.audio_sample_rate,
+        args.audio_mel_cache_dir,
+        args.audio_mel_store_dir,
+    )
@@ -0,0 +1,98 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compute the mel spectrograms of the training videos ahead of training, into one memory-mapped store.
+
+    python -m preprocess.build_mel_store --fileslist <fileslist> --store_dir <mel_store> --num_workers 32
+
+Then set `data.audio_mel_store_dir` in the UNet or SyncNet config. Mels already in the per-file cache of the datasets
+(`--audio_mel_cache_dir`) are copied instead of recomputed. Every worker writes its own shards, an interrupted run
+resumes after the last finished shard of each worker.
+"""
+
+import argparse
+import os
+from multiprocessing import Process
+
+import numpy as np
+import torch
+import tqdm
+from decord import AudioReader, cpu
+
+from latentsync.data.mel_store import MelStoreWriter
+from latentsync.utils.audio import melspectrogram
+from latentsync.utils.util import gather_video_paths_recursively
+
+
+def read_mel(video_path: str, audio_sample_rate: int, audio_mel_cache_dir: str = ""):
+    """The mel spectrogram the datasets would compute, taken from their cache when it is there."""
+    if audio_mel_cache_dir != "":
+        mel_cache_path = os.path.join(audio_mel_cache_dir, os.path.basename(video_path).replace(".mp4", "_mel.pt"))
+        if os.path.isfile(mel_cache_path):
+            return torch.load(mel_cache_path, weights_only=True).numpy()
+    ar = AudioReader(video_path, ctx=cpu(0), sample_rate=audio_sample_rate)
+    return melspectrogram(ar[:].asnumpy().squeeze(0)).astype(np.float32)
+
+
+def func(video_paths, store_dir, part, audio_sample_rate, audio_mel_cache_dir):
+    writer = MelStoreWriter(store_dir, {"audio_sample_rate": audio_sample_rate}, part=part)
+    for video_path in tqdm.tqdm(video_paths, position=part):
+        if video_path in writer.done_video_paths:
+            continue
+        try:
+            writer.add(video_path, read_mel(video_path, audio_sample_rate, audio_mel_cache_dir))
+        except Exception as e:
+            print(f"{type(e).__name__} - {e} - {video_path}")
+    writer.flush()
+
+
+def split(a, n):
+    k, m = divmod(len(a), n)
+    return (a[i * k + min(i, m) : (i + 1) * k + min(i + 1, m)] for i in range(n))
+
+
+def build_mel_store_multiprocessing(video_paths, store_dir, num_workers, audio_sample_rate, audio_mel_cache_dir=""):
+    processes = []
+    for i, part_video_paths in enumerate(split(video_paths, num_workers)):
+        process = Process(
+            target=func, args=(part_video_paths, store_dir, i, audio_sample_rate, audio_mel_cache_dir)
+        )
+        process.start()
+        processes.append(process)
+
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fileslist", type=str, default="")
+    parser.add_argument("--data_dir", type=str, default="")
+    parser.add_argument("--store_dir", type=str, required=True)
+    parser.add_argument("--num_workers", type=int, default=16)
+    parser.add_argument("--audio_sample_rate", type=int, default=16000)
+    parser.add_argument("--audio_mel_cache_dir", type=str, default="")
+    args = parser.parse_args()
+
+    if args.fileslist != "":
+        with open(args.fileslist) as file:
+            video_paths = [line.rstrip() for line in file]
+    elif args.data_dir != "":
+        video_paths = gather_video_paths_recursively(args.data_dir)
+    else:
+        raise ValueError("data_dir and fileslist cannot be both empty")
+
+    build_mel_store_multiprocessing(
+        video_paths, args.store_dir, args.num_workers, args.audio_sample_rate, args.audio_mel_cache_dir
+    )
@@ -0,0 +1,132 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Encode the training videos with the frozen VAE once, so UNet training reads latents instead of encoding frames.
+
+    python -m preprocess.encode_latents --unet_config_path configs/unet/stage2.yaml --store_dir latent_store
+
+Then set `data.latent_store_dir` in the UNet config. Every GPU encodes its own part of the videos, an interrupted
+run resumes after the last finished shard of each part.
+"""
+
+import argparse
+import os
+from multiprocessing import Process
+
+import torch
+import tqdm
+from decord import VideoReader, cpu
+from diffusers import AutoencoderKL
+from omegaconf import OmegaConf
+
+from latentsync.data.latent_store import LatentStoreWriter
+from latentsync.utils.image_processor import ImageProcessor, load_fixed_mask
+
+
+def store_metadata(config):
+    """Everything the stored latents depend on, a store is only reused with the same values."""
+    return {
+        "vae": "stabilityai/sd-vae-ft-mse",
+        "resolution": config.data.resolution,
+        "mask": config.data.mask,
+        "mask_image_path": config.data.mask_image_path,
+    }
+
+
+def read_video_paths(config):
+    """The videos `UNetDataset` trains on."""
+    if config.data.train_fileslist != "":
+        with open(config.data.train_fileslist) as file:
+            return [line.rstrip() for line in file]
+    elif config.data.train_data_dir != "":
+        return [
+            os.path.join(config.data.train_data_dir, file)
+            for file in os.listdir(config.data.train_data_dir)
+            if file.endswith(".mp4")
+        ]
+    else:
+        raise ValueError("data_dir and fileslist cannot be both empty")
+
+
+@torch.no_grad()
+def encode_frames(vae, image_processor, frames, batch_size, device):
+    pixel_values, masked_pixel_values, _ = image_processor.prepare_masks_and_masked_images(
+        frames, affine_transform=False
+    )
+    latents = []
+    for start in range(0, len(frames), batch_size):
+        batch = torch.cat([pixel_values[start : start + batch_size], masked_pixel_values[start : start + batch_size]])
+        parameters = vae.encode(batch.to(device, dtype=torch.float16)).latent_dist.parameters
+        full, masked = parameters.chunk(2)
+        latents.append(torch.stack([full, masked], dim=1).cpu())
+    return torch.cat(latents).numpy()  # (f, 2, 8, h, w)
+
+
+def func(video_paths, config, store_dir, part, device_id, batch_size, frames_per_shard):
+    device = f"cuda:{device_id}"
+    vae = AutoencoderKL.from_pretrained("stabilityai/sd-vae-ft-mse", torch_dtype=torch.float16).to(device)
+    vae.requires_grad_(False)
+    mask_image = load_fixed_mask(config.data.resolution, config.data.mask_image_path)
+    image_processor = ImageProcessor(config.data.resolution, config.data.mask, mask_image=mask_image)
+    writer = LatentStoreWriter(store_dir, store_metadata(config), part=part, frames_per_shard=frames_per_shard)
+
+    for video_path in tqdm.tqdm(video_paths, position=part):
+        if video_path in writer.done_video_paths:
+            continue
+        try:
+            vr = VideoReader(video_path, ctx=cpu(0))
+            # UNetDataset skips these videos, it needs a reference window apart from the target one
+            if len(vr) < 3 * config.data.num_frames:
+                continue
+            frames = vr[:].asnumpy()
+            vr.seek(0)  # avoid memory leak
+            writer.add(video_path, encode_frames(vae, image_processor, frames, batch_size, device))
+        except Exception as e:
+            print(f"{type(e).__name__} - {e} - {video_path}")
+    writer.flush()
+
+
+def split(a, n):
+    k, m = divmod(len(a), n)
+    return (a[i * k + min(i, m) : (i + 1) * k + min(i + 1, m)] for i in range(n))
+
+
+def encode_latents_multi_gpus(config, store_dir, batch_size=32, frames_per_shard=4096):
+    video_paths = read_video_paths(config)
+    num_devices = torch.cuda.device_count()
+    if num_devices == 0:
+        raise RuntimeError("No GPUs found")
+
+    processes = []
+    for i, part_video_paths in enumerate(split(video_paths, num_devices)):
+        process = Process(
+            target=func, args=(part_video_paths, config, store_dir, i, i, batch_size, frames_per_shard)
+        )
+        process.start()
+        processes.append(process)
+
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--unet_config_path", type=str, default="configs/unet/stage2.yaml")
+    parser.add_argument("--store_dir", type=str, required=True)
+    parser.add_argument("--batch_size", type=int, default=32, help="Frames per VAE forward pass")
+    parser.add_argument("--frames_per_shard", type=int, default=4096)
+    args = parser.parse_args()
+
+    config = OmegaConf.load(args.unet_config_path)
+    encode_latents_multi_gpus(config, args.store_dir, args.batch_size, args.frames_per_shard)
@@ -0,0 +1,96 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Extract the Whisper embeddings of the training videos ahead of UNet training, one process per GPU.
+
+    python -m preprocess.extract_audio_embeds --unet_config_path configs/unet/stage2.yaml --store_dir <embeds_store>
+
+Then set `data.audio_embeds_store_dir` in the UNet config: the dataloader workers crop the audio windows and the
+training step no longer runs Whisper. Embeddings already in `data.audio_embeds_cache_dir` are copied instead of
+recomputed, an interrupted run resumes after the last finished shard of each GPU.
+"""
+
+import argparse
+from multiprocessing import Process
+
+import torch
+import tqdm
+from omegaconf import OmegaConf
+
+from latentsync.data.array_store import ArrayStoreWriter
+from latentsync.whisper.audio2feature import Audio2Feature
+from preprocess.encode_latents import read_video_paths, split
+
+
+def whisper_model_path(cross_attention_dim: int) -> str:
+    if cross_attention_dim == 768:
+        return "checkpoints/whisper/small.pt"
+    elif cross_attention_dim == 384:
+        return "checkpoints/whisper/tiny.pt"
+    else:
+        raise NotImplementedError("cross_attention_dim must be 768 or 384")
+
+
+def store_metadata(config):
+    return {"whisper_model": whisper_model_path(config.model.cross_attention_dim)}
+
+
+def func(video_paths, config, store_dir, part, device_id, frames_per_shard):
+    audio_encoder = Audio2Feature(
+        model_path=whisper_model_path(config.model.cross_attention_dim),
+        device=f"cuda:{device_id}",
+        audio_embeds_cache_dir=config.data.audio_embeds_cache_dir,
+        num_frames=config.data.num_frames,
+        audio_feat_length=config.data.audio_feat_length,
+    )
+    # Embeddings are float16 in the training step, storing them as such loses nothing
+    writer = ArrayStoreWriter(store_dir, store_metadata(config), part=part, rows_per_shard=frames_per_shard)
+
+    for video_path in tqdm.tqdm(video_paths, position=part):
+        if video_path in writer.done_video_paths:
+            continue
+        try:
+            with torch.no_grad():
+                audio_feat = audio_encoder.audio2feat(video_path)  # (t, layers, embedding_dim) at 50 fps
+            writer.add(video_path, audio_feat.numpy())
+        except Exception as e:
+            print(f"{type(e).__name__} - {e} - {video_path}")
+    writer.flush()
+
+
+def extract_audio_embeds_multi_gpus(config, store_dir, frames_per_shard=2**18):
+    video_paths = read_video_paths(config)
+    num_devices = torch.cuda.device_count()
+    if num_devices == 0:
+        raise RuntimeError("No GPUs found")
+
+    processes = []
+    for i, part_video_paths in enumerate(split(video_paths, num_devices)):
+        process = Process(target=func, args=(part_video_paths, config, store_dir, i, i, frames_per_shard))
+        process.start()
+        processes.append(process)
+
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--unet_config_path", type=str, default="configs/unet/stage2.yaml")
+    parser.add_argument("--store_dir", type=str, required=True)
+    parser.add_argument("--frames_per_shard", type=int, default=2**18, help="Whisper frames (50 per second)")
+    args = parser.parse_args()
+
+    config = OmegaConf.load(args.unet_config_path)
+    extract_audio_embeds_multi_gpus(config, args.store_dir, args.frames_per_shard)
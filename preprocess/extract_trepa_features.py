@@ -0,0 +1,107 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compute the ground-truth TREPA features of the windows UNet training will draw, one process per GPU.
+
+    python -m preprocess.extract_trepa_features --unet_config_path configs/unet/stage2.yaml --epochs 0 1 2
+
+The config needs `data.clip_index_path` and `data.trepa_feature_cache_dir`: with a clip index, ClipSampler derives the
+windows of every epoch from `run.seed`, so they are known before the training starts. Windows already in the cache
+are skipped. Training computes the windows missing from the cache (e.g. those of a fallback sample) on first use.
+"""
+
+import argparse
+from multiprocessing import Process
+
+import torch
+import tqdm
+from einops import rearrange
+from omegaconf import OmegaConf
+
+from latentsync.data.clip_index import ClipSampler
+from latentsync.data.unet_dataset import UNetDataset
+from latentsync.trepa.feature_cache import TrepaFeatureCache, cache_metadata
+from latentsync.trepa.loss import TREPALoss
+from preprocess.encode_latents import split
+
+
+def uncached_samples(config, epochs):
+    """(clip index, sample seed) of the windows of `epochs` that are not in the cache yet, one per window."""
+    dataset = UNetDataset(config.data.train_data_dir, config)
+    cache = TrepaFeatureCache(config.data.trepa_feature_cache_dir, cache_metadata(config))
+    sampler = ClipSampler(len(dataset), seed=config.run.seed)
+
+    samples = []
+    windows = set()
+    for epoch in epochs:
+        sampler.set_epoch(epoch)
+        for clip_index, sample_seed in sampler:
+            window = (dataset.video_paths[clip_index], dataset.indexed_start_idx(clip_index, sample_seed))
+            if window in windows or cache.load(*window) is not None:
+                continue
+            windows.add(window)
+            samples.append((clip_index, sample_seed))
+    return samples
+
+
+def func(samples, config, part, device_id, batch_size, num_workers):
+    device = f"cuda:{device_id}"
+    trepa_loss = TREPALoss(device=device)
+    cache = TrepaFeatureCache(config.data.trepa_feature_cache_dir, cache_metadata(config))
+    dataset = UNetDataset(config.data.train_data_dir, config)
+    if num_workers == 0:
+        dataset.worker_init_fn(0)
+    dataloader = torch.utils.data.DataLoader(
+        dataset,
+        batch_size=batch_size,
+        sampler=samples,
+        num_workers=num_workers,
+        worker_init_fn=dataset.worker_init_fn,
+    )
+
+    for batch in tqdm.tqdm(dataloader, position=part):
+        videos_real = rearrange(batch["gt_pixel_values"], "b f c h w -> b c f h w").to(device, dtype=torch.float16)
+        cache.features(trepa_loss, batch["video_path"], batch["start_idx"], videos_real)
+
+
+def extract_trepa_features_multi_gpus(config, epochs, batch_size=4, num_workers=8):
+    if config.data.get("clip_index_path", "") == "" or config.data.get("trepa_feature_cache_dir", "") == "":
+        raise ValueError("data.clip_index_path and data.trepa_feature_cache_dir must be set")
+    num_devices = torch.cuda.device_count()
+    if num_devices == 0:
+        raise RuntimeError("No GPUs found")
+
+    samples = uncached_samples(config, epochs)
+    print(f"{len(samples)} windows to extract")
+
+    processes = []
+    for i, part_samples in enumerate(split(samples, num_devices)):
+        process = Process(target=func, args=(part_samples, config, i, i, batch_size, num_workers))
+        process.start()
+        processes.append(process)
+
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--unet_config_path", type=str, default="configs/unet/stage2.yaml")
+    parser.add_argument("--epochs", type=int, nargs="+", default=[0])
+    parser.add_argument("--batch_size", type=int, default=4, help="Windows per VideoMAEv2 forward pass")
+    parser.add_argument("--num_workers", type=int, default=8, help="Dataloader workers per GPU")
+    args = parser.parse_args()
+
+    config = OmegaConf.load(args.unet_config_path)
+    extract_trepa_features_multi_gpus(config, args.epochs, args.batch_size, args.num_workers)
@@ -0,0 +1,122 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Pack training clips into large tar shards that the training datasets stream sequentially.
+
+    python -m preprocess.pack_shards --fileslist <fileslist> --output_dir <shards_dir> --num_workers 16
+
+Each clip keeps its mp4 bytes (compressed frames) and gets its mel spectrogram, and with `--latent_store_dir` its VAE
+latents from `preprocess.encode_latents`. Then set `data.train_shards_dir` in the UNet or SyncNet config. Clips that
+are already in a finished shard are skipped, so an interrupted run can be started again.
+"""
+
+import argparse
+import os
+from multiprocessing import Process
+
+import numpy as np
+import tqdm
+
+from latentsync.data.latent_store import LatentStore
+from latentsync.data.shard_dataset import ShardWriter, read_shard_list
+from latentsync.utils.util import gather_video_paths_recursively
+from preprocess.build_mel_store import read_mel
+
+
+def func(video_paths, output_dir, part, shard_size, audio_sample_rate, audio_mel_cache_dir, latent_store_dir):
+    writer = ShardWriter(output_dir, prefix=f"part{part:03d}", shard_size=shard_size)
+    latent_store = LatentStore(latent_store_dir) if latent_store_dir != "" else None
+
+    for index, video_path in enumerate(tqdm.tqdm(video_paths, position=part)):
+        try:
+            if latent_store is not None:
+                if video_path not in latent_store:
+                    continue
+                latents = np.asarray(latent_store.video_latents(video_path))
+            else:
+                latents = None
+            mel = read_mel(video_path, audio_sample_rate, audio_mel_cache_dir)
+            with open(video_path, "rb") as f:
+                video_bytes = f.read()
+        except Exception as e:
+            print(f"{type(e).__name__} - {e} - {video_path}")
+            continue
+        metadata = {"video_path": video_path}
+        writer.add(f"{part:03d}{index:09d}", metadata, video_bytes, mel=mel, latents=latents)
+    writer.close()
+
+
+def split(a, n):
+    k, m = divmod(len(a), n)
+    return (a[i * k + min(i, m) : (i + 1) * k + min(i + 1, m)] for i in range(n))
+
+
+def pack_shards_multiprocessing(
+    video_paths, output_dir, num_workers, shard_size, audio_sample_rate, audio_mel_cache_dir, latent_store_dir
+):
+    os.makedirs(output_dir, exist_ok=True)
+    packed_video_paths = {path for entry in read_shard_list(output_dir) for path in entry["video_paths"]}
+    video_paths = [video_path for video_path in video_paths if video_path not in packed_video_paths]
+    print(f"{len(packed_video_paths)} videos already packed, {len(video_paths)} to go")
+
+    processes = []
+    for i, part_video_paths in enumerate(split(video_paths, num_workers)):
+        process = Process(
+            target=func,
+            args=(
+                part_video_paths,
+                output_dir,
+                i,
+                shard_size,
+                audio_sample_rate,
+                audio_mel_cache_dir,
+                latent_store_dir,
+            ),
+        )
+        process.start()
+        processes.append(process)
+
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fileslist", type=str, default="")
+    parser.add_argument("--data_dir", type=str, default="")
+    parser.add_argument("--output_dir", type=str, required=True)
+    parser.add_argument("--num_workers", type=int, default=8)
+    parser.add_argument("--shard_size_mb", type=int, default=1024)
+    parser.add_argument("--audio_sample_rate", type=int, default=16000)
+    parser.add_argument("--audio_mel_cache_dir", type=str, default="")
+    parser.add_argument("--latent_store_dir", type=str, default="")
+    args = parser.parse_args()
+
+    if args.fileslist != "":
+        with open(args.fileslist) as file:
+            video_paths = [line.rstrip() for line in file]
+    elif args.data_dir != "":
+        video_paths = gather_video_paths_recursively(args.data_dir)
+    else:
+        raise ValueError("data_dir and fileslist cannot be both empty")
+
+    pack_shards_multiprocessing(
+        video_paths,
+        args.output_dir,
+        args.num_workers,
+        args.shard_size_mb * 1024**2,
+        args.audio_sample_rate,
+        args.audio_mel_cache_dir,
+        args.latent_store_dir,
+    )
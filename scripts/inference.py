@@ -21,20 +21,53 @@ from latentsync.models.unet import UNet3DConditionModel
 from latentsync.pipelines.lipsync_pipeline import LipsyncPipeline
 from accelerate.utils import set_seed
 from latentsync.whisper.audio2feature import Audio2Feature
+from latentsync.utils.device import DevicePolicy
+from latentsync.utils.scheduler import SCHEDULERS, build_scheduler
 
 
-def main(config, args):
-    if not os.path.exists(args.video_path):
-        raise RuntimeError(f"Video path '{args.video_path}' not found")
-    if not os.path.exists(args.audio_path):
-        raise RuntimeError(f"Audio path '{args.audio_path}' not found")
+def load_audio_encoder(config, device):
+    # Use relative paths for whisper models as well
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    if config.model.cross_attention_dim == 768:
+        whisper_model_path = os.path.join(current_dir, "..", "checkpoints", "whisper", "small.pt")
+    elif config.model.cross_attention_dim == 384:
+        whisper_model_path = os.path.join(current_dir, "..", "checkpoints", "whisper", "tiny.pt")
+    else:
+        raise NotImplementedError("cross_attention_dim must be 768 or 384")
 
-    # Check if the GPU supports float16
-    is_fp16_supported = torch.cuda.is_available() and torch.cuda.get_device_capability()[0] > 7
-    dtype = torch.float16 if is_fp16_supported else torch.float32
+    return Audio2Feature(
+        model_path=whisper_model_path,
+        device=device,
+        num_frames=config.data.num_frames,
+        audio_feat_length=config.data.audio_feat_length,
+    )
 
-    print(f"Input video path: {args.video_path}")
-    print(f"Input audio path: {args.audio_path}")
+
+def pipeline_call_kwargs(config, args, policy):
+    """Generation settings shared by every way of running the pipeline (whole video or shards)."""
+    return dict(
+        num_frames=config.data.num_frames,
+        num_inference_steps=args.inference_steps,
+        guidance_scale=args.guidance_scale,
+        weight_dtype=policy.unet_dtype,
+        width=config.data.resolution,
+        height=config.data.resolution,
+        mask_image_path=config.data.mask_image_path,
+        landmark_backend=getattr(args, "landmark_backend", None),
+        distilled=getattr(args, "distilled", False),
+    )
+
+
+def load_pipeline(config, args):
+    policy = DevicePolicy(
+        device=getattr(args, "device", "auto"),
+        unet_precision=getattr(args, "unet_precision", "auto"),
+        vae_precision=getattr(args, "vae_precision", "auto"),
+        num_threads=getattr(args, "num_threads", 0),
+    )
+    policy.apply()
+    dtype = policy.unet_dtype
+    print(f"Device policy: {policy}")
     print(f"Loaded checkpoint path: {args.inference_ckpt_path}")
 
     # Use relative path for scheduler configuration
@@ -89,39 +122,54 @@ def main(config, args):
             skip_prk_steps=True
         )
 
-    # Use relative paths for whisper models as well
-    if config.model.cross_attention_dim == 768:
-        whisper_model_path = os.path.join(current_dir, "..", "checkpoints", "whisper", "small.pt")
-    elif config.model.cross_attention_dim == 384:
-        whisper_model_path = os.path.join(current_dir, "..", "checkpoints", "whisper", "tiny.pt")
-    else:
-        raise NotImplementedError("cross_attention_dim must be 768 or 384")
+    # Every scheduler reuses the betas and timesteps of the DDIM config the UNet was trained with
+    scheduler_name = getattr(args, "scheduler", "ddim")
+    scheduler = build_scheduler(scheduler_name, scheduler.config)
+    print(f"Using scheduler: {scheduler_name} ({scheduler.__class__.__name__})")
 
-    audio_encoder = Audio2Feature(
-        model_path=whisper_model_path,
-        device="cuda",
-        num_frames=config.data.num_frames,
-        audio_feat_length=config.data.audio_feat_length,
-    )
+    audio_encoder = load_audio_encoder(config, policy.device)
 
-    vae = AutoencoderKL.from_pretrained("stabilityai/sd-vae-ft-mse", torch_dtype=dtype)
+    vae = AutoencoderKL.from_pretrained("stabilityai/sd-vae-ft-mse", torch_dtype=policy.vae_dtype)
     vae.config.scaling_factor = 0.18215
     vae.config.shift_factor = 0
+    vae = policy.prepare_vae(vae)
 
     denoising_unet, _ = UNet3DConditionModel.from_pretrained(
         OmegaConf.to_container(config.model),
         args.inference_ckpt_path,
         device="cpu",
+        dtype=dtype,
+        prune_motion_modules=not getattr(args, "keep_motion_modules", False),
     )
 
-    denoising_unet = denoising_unet.to(dtype=dtype)
+    if getattr(args, "folded_layout", False):
+        denoising_unet.enable_folded_layout()
 
     pipeline = LipsyncPipeline(
         vae=vae,
         audio_encoder=audio_encoder,
         denoising_unet=denoising_unet,
         scheduler=scheduler,
-    ).to("cuda")
+    ).to(policy.device)
+
+    return pipeline, policy
+
+
+def main(config, args):
+    if not os.path.exists(args.video_path):
+        raise RuntimeError(f"Video path '{args.video_path}' not found")
+    if not os.path.exists(args.audio_path):
+        raise RuntimeError(f"Audio path '{args.audio_path}' not found")
+
+    print(f"Input video path: {args.video_path}")
+    print(f"Input audio path: {args.audio_path}")
+
+    if getattr(args, "devices", None):
+        from scripts.sharded_inference import run_sharded
+
+        return run_sharded(config, args)
+
+    pipeline, policy = load_pipeline(config, args)
 
     if args.seed != -1:
         set_seed(args.seed)
@@ -130,20 +178,34 @@ def main(config, args):
 
     print(f"Initial seed: {torch.initial_seed()}")
 
-    pipeline(
-        video_path=args.video_path,
-        audio_path=args.audio_path,
-        video_out_path=args.video_out_path,
-        video_mask_path=args.video_out_path.replace(".mp4", "_mask.mp4"),
-        num_frames=config.data.num_frames,
-        num_inference_steps=args.inference_steps,
-        guidance_scale=args.guidance_scale,
-        weight_dtype=dtype,
-        width=config.data.resolution,
-        height=config.data.resolution,
-        mask_image_path=config.data.mask_image_path,
-    )
+    # From the ComfyUI node, the frames go to the "temp" subdirectory of its per-run temp_dir, which the node removes
+    workspace_dir = os.path.join(args.temp_dir, "temp") if getattr(args, "temp_dir", None) else None
 
+    try:
+        return pipeline(
+            video_path=args.video_path,
+            audio_path=args.audio_path,
+            video_out_path=args.video_out_path,
+            video_mask_path=args.video_out_path.replace(".mp4", "_mask.mp4"),
+            window_callback=getattr(args, "window_callback", None),
+            should_stop=getattr(args, "should_stop", None),
+            return_partial=getattr(args, "return_partial", False),
+            seed=args.seed if args.seed != -1 else None,
+            overlap_stages=not getattr(args, "no_overlap_stages", False),
+            num_restore_workers=getattr(args, "num_restore_workers", 2),
+            job_dir=getattr(args, "job_dir", None),
+            workspace_dir=workspace_dir,
+            job_params={
+                "inference_ckpt_path": os.path.abspath(args.inference_ckpt_path),
+                "inference_ckpt_mtime": os.path.getmtime(args.inference_ckpt_path),
+            },
+            **pipeline_call_kwargs(config, args, policy),
+        )
+    finally:
+        # Release the models as soon as the run ends, also when it was interrupted
+        del pipeline
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -155,6 +217,44 @@ if __name__ == "__main__":
     parser.add_argument("--inference_steps", type=int, default=20)
     parser.add_argument("--guidance_scale", type=float, default=1.0)
     parser.add_argument("--seed", type=int, default=1247)
+    parser.add_argument("--scheduler", type=str, default="ddim", choices=list(SCHEDULERS))
+    parser.add_argument("--device", type=str, default="auto", help="auto, cpu, cuda or cuda:N")
+    parser.add_argument("--unet_precision", type=str, default="auto", choices=["auto", "fp32", "fp16", "bf16"])
+    parser.add_argument("--vae_precision", type=str, default="auto", choices=["auto", "fp32", "fp16", "bf16"])
+    parser.add_argument("--num_threads", type=int, default=0, help="Threads for torch and OpenCV, 0 keeps defaults")
+    parser.add_argument(
+        "--keep_motion_modules", action="store_true", help="Do not prune motion modules with all-zero outputs"
+    )
+    parser.add_argument(
+        "--folded_layout", action="store_true", help="Run the UNet on a folded (b f) layout with channels_last"
+    )
+    parser.add_argument(
+        "--distilled", action="store_true", help="The checkpoint is step-distilled, skip classifier-free guidance"
+    )
+    parser.add_argument("--landmark_backend", type=str, default=None, choices=["face_alignment", "mediapipe"])
+    parser.add_argument(
+        "--no_overlap_stages",
+        action="store_true",
+        help="Align, denoise and restore one after the other instead of in overlapped threads",
+    )
+    parser.add_argument("--num_restore_workers", type=int, default=2)
+    parser.add_argument(
+        "--job_dir",
+        type=str,
+        default=None,
+        help="Keep the finished windows here so that a crashed or preempted run resumes where it stopped",
+    )
+    parser.add_argument(
+        "--devices",
+        type=str,
+        default=None,
+        help="Comma separated devices, one worker process each (e.g. cuda:0,cuda:1 or cpu,cpu), to split the windows",
+    )
+    parser.add_argument("--windows_per_shard", type=int, default=4)
+    parser.add_argument("--max_shard_retries", type=int, default=2)
+    parser.add_argument(
+        "--shard_timeout", type=float, default=600, help="Seconds without progress before a worker is restarted"
+    )
     args = parser.parse_args()
 
     config = OmegaConf.load(args.unet_config_path)
@@ -0,0 +1,271 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Split the windows of one video across worker processes, each with its own models on its own device.
+
+The parent decodes the video, computes the Whisper features and aligns the faces once (the alignment is smoothed over
+consecutive frames, so it cannot be split), then hands out shards of `windows_per_shard` consecutive windows. Every
+window is seeded from the run seed and its index (see `window_seed`), so the frames equal those of the serial run.
+Rendered windows stream back to the parent, which feeds them in order to a single encoder.
+
+A shard whose worker raises, dies or stops making progress for `shard_timeout` seconds is queued again and the dead
+worker is restarted, at most `max_shard_retries` times per shard.
+
+    python -m scripts.inference --unet_config_path configs/unet/stage2.yaml \\
+        --inference_ckpt_path checkpoints/latentsync_unet.pt --video_path assets/demo1_video.mp4 \\
+        --audio_path assets/demo1_audio.wav --video_out_path video_out.mp4 --devices cuda:0,cuda:1
+"""
+
+import argparse
+import os
+import queue
+import random
+import shutil
+import tempfile
+import time
+import traceback
+from collections import deque
+
+import torch
+import torch.multiprocessing as mp
+import tqdm
+from omegaconf import OmegaConf
+
+from latentsync.pipelines.lipsync_pipeline import LipsyncInterrupted
+from latentsync.utils.image_processor import ImageProcessor, load_fixed_mask
+from latentsync.utils.util import check_ffmpeg_installed, read_audio, read_video
+from latentsync.utils.video_encoder import OrderedEncoder
+from scripts.inference import load_audio_encoder, load_pipeline, pipeline_call_kwargs
+
+
+def shard_worker(worker_id, device, config_container, args_dict, seed, task_queue, result_queue):
+    args = argparse.Namespace(**args_dict)
+    args.device = device
+    config = OmegaConf.create(config_container)
+    pipeline, policy = load_pipeline(config, args)
+    call_kwargs = pipeline_call_kwargs(config, args, policy)
+    result_queue.put(("ready", worker_id, None, None))
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        shard_id, first_window, video_frames, whisper_chunks, aligned_faces = task
+        try:
+            for i, batch_frames in enumerate(
+                pipeline.iter_lipsync_windows(
+                    video_frames,
+                    None,
+                    whisper_chunks=whisper_chunks,
+                    aligned_faces=aligned_faces,
+                    window_offset=first_window,
+                    seed=seed,
+                    **call_kwargs,
+                )
+            ):
+                result_queue.put(("window", worker_id, shard_id, (first_window + i, batch_frames)))
+            result_queue.put(("done", worker_id, shard_id, None))
+        except Exception:
+            result_queue.put(("failed", worker_id, shard_id, traceback.format_exc()))
+
+
+class ShardWorker:
+    def __init__(self, context, worker_id, device, config_container, args_dict, seed, result_queue):
+        self.worker_id = worker_id
+        self.device = device
+        self.shard_id = None
+        self.ready = False
+        self.restarts = 0
+        self.last_progress = time.monotonic()
+        self.task_queue = context.Queue()
+        self.process = context.Process(
+            target=shard_worker,
+            args=(worker_id, device, config_container, args_dict, seed, self.task_queue, result_queue),
+            daemon=True,
+        )
+        self.process.start()
+
+    def assign(self, shard_id, task):
+        self.shard_id = shard_id
+        self.last_progress = time.monotonic()
+        self.task_queue.put(task)
+
+    def stop(self, timeout: float = 10):
+        if self.process.is_alive():
+            self.task_queue.put(None)
+            self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+
+
+def parse_devices(devices: str):
+    return [device.strip() for device in devices.split(",") if device.strip()]
+
+
+def build_image_processor(config, args, device):
+    """The face aligner `LipsyncPipeline.iter_lipsync_windows` would build, for aligning outside the pipeline."""
+    mask_image = load_fixed_mask(config.data.resolution, config.data.mask_image_path)
+    return ImageProcessor(
+        config.data.resolution,
+        mask="fix_mask",
+        device=device,
+        mask_image=mask_image,
+        landmark_backend=getattr(args, "landmark_backend", None),
+    )
+
+
+def align_faces(image_processor, video_frames):
+    """(faces, boxes, affine_matrices) of `video_frames`, to pass as `aligned_faces` to the pipeline."""
+    image_processor.reset_smoothing()
+    faces, boxes, affine_matrices = [], [], []
+    print(f"Affine transforming {len(video_frames)} faces...")
+    for frame in tqdm.tqdm(video_frames):
+        face, box, affine_matrix = image_processor.affine_transform(frame)
+        faces.append(face)
+        boxes.append(box)
+        affine_matrices.append(affine_matrix)
+    return torch.stack(faces), boxes, affine_matrices
+
+
+def run_sharded(config, args, video_fps: int = 25, audio_sample_rate: int = 16000):
+    """Sharded counterpart of `scripts.inference.main`, one worker per entry of `args.devices`."""
+    check_ffmpeg_installed()
+    devices = parse_devices(args.devices)
+    num_frames = config.data.num_frames
+    windows_per_shard = getattr(args, "windows_per_shard", 4)
+    max_shard_retries = getattr(args, "max_shard_retries", 2)
+    shard_timeout = getattr(args, "shard_timeout", 600)
+    window_callback = getattr(args, "window_callback", None)
+    should_stop = getattr(args, "should_stop", None)
+
+    # Shards only make sense when every worker draws the same noise, so an unseeded run gets a random seed
+    seed = args.seed if args.seed != -1 else random.randrange(2**31)
+    print(f"Sharded inference on {devices} with seed {seed}")
+
+    # Only plain values cross the process boundary, callbacks stay in the parent
+    args_dict = {k: v for k, v in vars(args).items() if isinstance(v, (str, int, float, bool, type(None)))}
+    num_cpu_workers = sum(device == "cpu" for device in devices)
+    if num_cpu_workers > 1 and args_dict.get("num_threads", 0) <= 0:
+        args_dict["num_threads"] = max(1, (os.cpu_count() or 1) // num_cpu_workers)
+    config_container = OmegaConf.to_container(config)
+
+    context = mp.get_context("spawn")
+    result_queue = context.Queue()
+
+    def start_worker(worker_id):
+        return ShardWorker(
+            context, worker_id, devices[worker_id], config_container, args_dict, seed, result_queue
+        )
+
+    # The workers load their models while the parent prepares the inputs
+    workers = [start_worker(worker_id) for worker_id in range(len(devices))]
+    temp_dir = tempfile.mkdtemp(prefix="latentsync_shards_")
+    encoder = OrderedEncoder(os.path.join(temp_dir, "video.mp4"), video_fps)
+    try:
+        parent_device = devices[0] if devices[0] == "cpu" or torch.cuda.is_available() else "cpu"
+        audio_encoder = load_audio_encoder(config, parent_device)
+        whisper_chunks = audio_encoder.feature2chunks(
+            feature_array=audio_encoder.audio2feat(args.audio_path), fps=video_fps
+        )
+        del audio_encoder
+        audio_samples = read_audio(args.audio_path)
+        video_frames = read_video(args.video_path, use_decord=False)
+
+        num_windows = min(len(video_frames), len(whisper_chunks)) // num_frames
+        if num_windows == 0:
+            raise ValueError(f"Video and audio must cover at least {num_frames} frames")
+        video_frames = video_frames[: num_windows * num_frames]
+        image_processor = build_image_processor(config, args, parent_device)
+        faces, boxes, affine_matrices = align_faces(image_processor, video_frames)
+        image_processor.close()
+
+        tasks = {}
+        for shard_id, first_window in enumerate(range(0, num_windows, windows_per_shard)):
+            start = first_window * num_frames
+            end = min(first_window + windows_per_shard, num_windows) * num_frames
+            aligned_faces = (faces[start:end], boxes[start:end], affine_matrices[start:end])
+            tasks[shard_id] = (
+                shard_id, first_window, video_frames[start:end], whisper_chunks[start:end], aligned_faces
+            )
+        pending = deque(tasks)
+        attempts = {shard_id: 0 for shard_id in tasks}
+
+        def requeue(shard_id, reason):
+            attempts[shard_id] += 1
+            if attempts[shard_id] > max_shard_retries:
+                raise RuntimeError(f"Shard {shard_id} failed {attempts[shard_id]} times, last error:\n{reason}")
+            print(f"Shard {shard_id} queued again: {reason}")
+            pending.appendleft(shard_id)
+
+        with tqdm.tqdm(total=num_windows, desc="Doing inference...") as progress_bar:
+            while encoder.next_window < num_windows:
+                if should_stop is not None and should_stop():
+                    raise LipsyncInterrupted(encoder.num_frames)
+
+                for worker in workers:
+                    stalled = worker.shard_id is not None and time.monotonic() - worker.last_progress > shard_timeout
+                    if worker.process.is_alive() and not stalled:
+                        continue
+                    if worker.shard_id is not None:
+                        requeue(worker.shard_id, f"worker {worker.worker_id} on {worker.device} stopped responding")
+                        worker.shard_id = None
+                    if worker.restarts >= max_shard_retries:
+                        continue
+                    restarts = worker.restarts + 1
+                    worker.stop(timeout=0)
+                    print(f"Restarting worker {worker.worker_id} on {worker.device}")
+                    workers[worker.worker_id] = start_worker(worker.worker_id)
+                    workers[worker.worker_id].restarts = restarts
+                if not any(worker.process.is_alive() for worker in workers):
+                    raise RuntimeError("Every shard worker died, see the errors above")
+
+                for worker in workers:
+                    if pending and worker.ready and worker.shard_id is None and worker.process.is_alive():
+                        shard_id = pending.popleft()
+                        worker.assign(shard_id, tasks[shard_id])
+
+                try:
+                    kind, worker_id, shard_id, payload = result_queue.get(timeout=1)
+                except queue.Empty:
+                    continue
+                worker = workers[worker_id]
+                if kind == "ready":
+                    worker.ready = True
+                elif worker.shard_id != shard_id:
+                    # A message from a shard that was already given up on (the worker was restarted)
+                    continue
+                elif kind == "window":
+                    worker.last_progress = time.monotonic()
+                    num_written = encoder.add(*payload)
+                    if num_written > 0:
+                        progress_bar.update(num_written)
+                        if window_callback is not None:
+                            window_callback(encoder.next_window, num_windows)
+                elif kind == "done":
+                    worker.shard_id = None
+                elif kind == "failed":
+                    worker.shard_id = None
+                    requeue(shard_id, payload)
+    except BaseException:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+    finally:
+        for worker in workers:
+            worker.stop()
+        encoder.close()
+
+    encoder.mux(audio_samples, audio_sample_rate, args.video_out_path)
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    return True
@@ -19,6 +19,8 @@ from omegaconf import OmegaConf
 import shutil
 
 from latentsync.data.syncnet_dataset import SyncNetDataset
+from latentsync.data.shard_dataset import ShardedClipDataset
+from latentsync.data.clip_index import ClipSampler
 from latentsync.models.stable_syncnet import StableSyncNet
 from latentsync.models.wav2lip_syncnet import Wav2LipSyncNet
 from latentsync.utils.util import gather_loss, plot_loss_chart
@@ -74,17 +76,36 @@ def main(config):
         vae = None
 
     # Dataset and Dataloader setup
-    train_dataset = SyncNetDataset(config.data.train_data_dir, config.data.train_fileslist, config)
+    if config.data.get("train_shards_dir", "") != "":
+        train_dataset = ShardedClipDataset(
+            config.data.train_shards_dir,
+            SyncNetDataset(config.data.train_data_dir, config.data.train_fileslist, config, from_shards=True),
+            buffer_size=config.data.get("shuffle_buffer_size", 100),
+            seed=config.run.seed,
+            rank=global_rank,
+            world_size=num_processes,
+        )
+        train_distributed_sampler = None
+    else:
+        clip_index_path = config.data.get("clip_index_path", "")
+        train_dataset = SyncNetDataset(
+            config.data.train_data_dir, config.data.train_fileslist, config, clip_index_path=clip_index_path
+        )
+        if clip_index_path != "":
+            # Yields (clip index, sample seed) pairs, a resumed run skips the samples it already trained on
+            train_distributed_sampler = ClipSampler(
+                len(train_dataset), seed=config.run.seed, rank=global_rank, world_size=num_processes
+            )
+        else:
+            train_distributed_sampler = DistributedSampler(
+                train_dataset,
+                num_replicas=num_processes,
+                rank=global_rank,
+                shuffle=True,
+                seed=config.run.seed,
+            )
     val_dataset = SyncNetDataset(config.data.val_data_dir, config.data.val_fileslist, config)
 
-    train_distributed_sampler = DistributedSampler(
-        train_dataset,
-        num_replicas=num_processes,
-        rank=global_rank,
-        shuffle=True,
-        seed=config.run.seed,
-    )
-
     # DataLoaders creation:
     train_dataloader = torch.utils.data.DataLoader(
         train_dataset,
@@ -165,7 +186,12 @@ def main(config):
     scaler = torch.amp.GradScaler("cuda") if config.run.mixed_precision_training else None
 
     for epoch in range(first_epoch, num_train_epochs):
-        train_dataloader.sampler.set_epoch(epoch)
+        if train_distributed_sampler is not None:
+            train_distributed_sampler.set_epoch(epoch)
+        else:
+            train_dataset.set_epoch(epoch)
+        if isinstance(train_distributed_sampler, ClipSampler) and epoch == first_epoch:
+            train_distributed_sampler.skip((global_step % num_update_steps_per_epoch) * config.data.batch_size)
         syncnet.train()
 
         for step, batch in enumerate(train_dataloader):
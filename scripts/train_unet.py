@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import os
+import copy
 import math
 import argparse
 import shutil
@@ -37,6 +38,8 @@ from diffusers.optimization import get_scheduler
 from accelerate.utils import set_seed
 
 from latentsync.data.unet_dataset import UNetDataset
+from latentsync.data.shard_dataset import ShardedClipDataset
+from latentsync.data.clip_index import ClipSampler
 from latentsync.models.unet import UNet3DConditionModel
 from latentsync.models.stable_syncnet import StableSyncNet
 from latentsync.pipelines.lipsync_pipeline import LipsyncPipeline
@@ -44,19 +47,46 @@ from latentsync.utils.util import (
     init_dist,
     cosine_loss,
     one_step_sampling,
+    ddim_sampling_step,
+    ddim_target_noise,
+    check_ddim_target_noise,
+    sample_latent_moments,
 )
 from latentsync.utils.util import plot_loss_chart
+from latentsync.utils.step_profiler import StepProfiler
 from latentsync.whisper.audio2feature import Audio2Feature
 from latentsync.trepa.loss import TREPALoss
+from latentsync.trepa.feature_cache import TrepaFeatureCache, cache_metadata
 from eval.syncnet import SyncNetEval
 from eval.syncnet_detect import SyncNetDetector
 from eval.eval_sync_conf import syncnet_eval
+from eval.async_validation import AsyncValidator, validation_kwargs
 import lpips
 
 
 logger = get_logger(__name__)
 
 
+def log_validation_result(result: dict, config, output_dir: str, val_step_list: list, sync_conf_list: list):
+    """Record a result of the async validation process the way the synchronous validation does."""
+    step = result["step"]
+    if "error" in result:
+        logger.info(f"Validation of step {step} failed: {result['error']}")
+    else:
+        logger.info(f"Saved validation video output to {result['video_path']}")
+
+    val_step_list.append(step)
+
+    if config.model.add_audio_layer:
+        conf = result.get("sync_conf", 0)
+        logger.info(f"SyncNet confidence at step {step}: {conf:.2f}")
+        sync_conf_list.append(conf)
+        plot_loss_chart(
+            os.path.join(output_dir, f"sync_conf_results/sync_conf_chart-{step}.png"),
+            ("Sync confidence", val_step_list, sync_conf_list),
+        )
+
+
 def main(config):
     # Initialize distributed training
     local_rank = init_dist()
@@ -103,10 +133,13 @@ def main(config):
     if config.run.pixel_space_supervise:
         vae.enable_gradient_checkpointing()
 
-    syncnet_eval_model = SyncNetEval(device=device)
-    syncnet_eval_model.loadParameters("checkpoints/auxiliary/syncnet_v2.model")
+    # With async validation the validation process loads its own SyncNet evaluation models
+    async_validation = config.run.get("async_validation", False)
+    if not async_validation:
+        syncnet_eval_model = SyncNetEval(device=device)
+        syncnet_eval_model.loadParameters("checkpoints/auxiliary/syncnet_v2.model")
 
-    syncnet_detector = SyncNetDetector(device=device, detect_results_dir="detect_results")
+        syncnet_detector = SyncNetDetector(device=device, detect_results_dir="detect_results")
 
     if config.model.cross_attention_dim == 768:
         whisper_model_path = "checkpoints/whisper/small.pt"
@@ -129,6 +162,41 @@ def main(config):
         device=device,
     )
 
+    # Step distillation: the student learns to match, in one DDIM step with a single conditional pass,
+    # several classifier-free guided DDIM steps of the frozen teacher
+    distill_config = config.get("distill", None)
+    distill = distill_config is not None and distill_config.enabled
+    if distill:
+        num_train_timesteps = noise_scheduler.config.num_train_timesteps
+        num_teacher_steps = distill_config.student_steps * distill_config.teacher_steps_per_student_step
+        if num_train_timesteps % num_teacher_steps != 0:
+            raise ValueError(f"student_steps x teacher_steps_per_student_step must divide {num_train_timesteps}")
+        student_step_ratio = num_train_timesteps // distill_config.student_steps
+        teacher_step_ratio = num_train_timesteps // num_teacher_steps
+        # Same spacing as DDIMScheduler.set_timesteps, from the noisiest timestep down
+        steps_offset = noise_scheduler.config.steps_offset
+        student_timesteps = (
+            torch.arange(distill_config.student_steps - 1, -1, -1, device=device) * student_step_ratio + steps_offset
+        )
+        # The teacher steps of a student step run from its timestep down to the next student timestep, with a single
+        # teacher step the target has to be the teacher's own guided noise prediction
+        check_ddim_target_noise(noise_scheduler, student_timesteps, student_timesteps - student_step_ratio)
+
+        if distill_config.teacher_ckpt_path == "":
+            # Only meant for smoke tests on tiny configs, the teacher is the randomly initialized student
+            teacher_unet = copy.deepcopy(denoising_unet)
+        else:
+            teacher_unet, _ = UNet3DConditionModel.from_pretrained(
+                OmegaConf.to_container(config.model), distill_config.teacher_ckpt_path, device=device
+            )
+        teacher_unet = teacher_unet.to(dtype=torch.float16)
+        teacher_unet.requires_grad_(False)
+        teacher_unet.eval()
+
+        if config.ckpt.resume_ckpt_path == distill_config.teacher_ckpt_path:
+            # The student is initialized from the teacher and starts counting its own steps
+            resume_global_step = 0
+
     if config.model.add_audio_layer and config.run.use_syncnet:
         syncnet_config = OmegaConf.load(config.data.syncnet_config_path)
         if syncnet_config.ckpt.inference_ckpt_path == "":
@@ -171,14 +239,31 @@ def main(config):
         denoising_unet.enable_gradient_checkpointing()
 
     # Get the training dataset
-    train_dataset = UNetDataset(config.data.train_data_dir, config)
-    distributed_sampler = DistributedSampler(
-        train_dataset,
-        num_replicas=num_processes,
-        rank=global_rank,
-        shuffle=True,
-        seed=config.run.seed,
-    )
+    if config.data.get("train_shards_dir", "") != "":
+        train_dataset = ShardedClipDataset(
+            config.data.train_shards_dir,
+            UNetDataset(config.data.train_data_dir, config, from_shards=True),
+            buffer_size=config.data.get("shuffle_buffer_size", 100),
+            seed=config.run.seed,
+            rank=global_rank,
+            world_size=num_processes,
+        )
+        distributed_sampler = None
+    else:
+        train_dataset = UNetDataset(config.data.train_data_dir, config)
+        if config.data.get("clip_index_path", "") != "":
+            # Yields (clip index, sample seed) pairs, a resumed run skips the samples it already trained on
+            distributed_sampler = ClipSampler(
+                len(train_dataset), seed=config.run.seed, rank=global_rank, world_size=num_processes
+            )
+        else:
+            distributed_sampler = DistributedSampler(
+                train_dataset,
+                num_replicas=num_processes,
+                rank=global_rank,
+                shuffle=True,
+                seed=config.run.seed,
+            )
 
     # DataLoaders creation:
     train_dataloader = torch.utils.data.DataLoader(
@@ -210,6 +295,12 @@ def main(config):
 
     if config.run.trepa_loss_weight != 0 and config.run.pixel_space_supervise:
         trepa_loss_func = TREPALoss(device=device, with_cp=True)
+        # Ground-truth features by video and start frame, the backbone then mostly runs on the predictions only
+        trepa_feature_cache_dir = config.data.get("trepa_feature_cache_dir", "")
+        if trepa_feature_cache_dir != "":
+            trepa_feature_cache = TrepaFeatureCache(trepa_feature_cache_dir, cache_metadata(config))
+        else:
+            trepa_feature_cache = None
 
     # Validation pipeline
     pipeline = LipsyncPipeline(
@@ -220,6 +311,12 @@ def main(config):
     ).to(device)
     pipeline.set_progress_bar_config(disable=True)
 
+    if async_validation and is_main_process:
+        # Validates the saved checkpoints in its own process, on run.validation_device (the training GPU by default)
+        async_validator = AsyncValidator(config, config.run.get("validation_device", "") or device)
+    else:
+        async_validator = None
+
     # DDP warpper
     denoising_unet = DDP(denoising_unet, device_ids=[local_rank], output_device=local_rank)
 
@@ -256,50 +353,86 @@ def main(config):
     # Support mixed-precision training
     scaler = torch.amp.GradScaler("cuda") if config.run.mixed_precision_training else None
 
+    # Opt-in timing of the phases of the steps on the main process, the other ranks are not synchronized by it
+    profiler_config = config.get("profiler", None)
+    profiler = StepProfiler(
+        enabled=is_main_process and profiler_config is not None and profiler_config.enabled,
+        device=device,
+        samples_per_step=total_batch_size,
+        log_steps=profiler_config.log_steps if profiler_config is not None else 50,
+        jsonl_path=os.path.join(output_dir, "step_profile.jsonl"),
+        trace_start_step=profiler_config.trace_start_step if profiler_config is not None else -1,
+        trace_num_steps=profiler_config.trace_num_steps if profiler_config is not None else 5,
+        trace_dir=os.path.join(output_dir, "profiler_traces"),
+        log=logger.info,
+    )
+
     for epoch in range(first_epoch, num_train_epochs):
-        train_dataloader.sampler.set_epoch(epoch)
+        if distributed_sampler is not None:
+            distributed_sampler.set_epoch(epoch)
+        else:
+            train_dataset.set_epoch(epoch)
+        if isinstance(distributed_sampler, ClipSampler) and epoch == first_epoch:
+            distributed_sampler.skip((resume_global_step % num_update_steps_per_epoch) * config.data.batch_size)
         denoising_unet.train()
 
-        for step, batch in enumerate(train_dataloader):
+        for step, batch in enumerate(profiler.iter_batches(train_dataloader)):
             ### >>>> Training >>>> ###
 
-            if config.model.add_audio_layer:
-                if batch["mel"] != []:
-                    mel = batch["mel"].to(device, dtype=torch.float16)
-
-                audio_embeds_list = []
-                try:
-                    for idx in range(len(batch["video_path"])):
-                        video_path = batch["video_path"][idx]
-                        start_idx = batch["start_idx"][idx]
-
-                        with torch.no_grad():
-                            audio_feat = audio_encoder.audio2feat(video_path)
-                        audio_embeds = audio_encoder.crop_overlap_audio_window(audio_feat, start_idx)
-                        audio_embeds_list.append(audio_embeds)
-                except Exception as e:
-                    logger.info(f"{type(e).__name__} - {e} - {video_path}")
-                    continue
-                audio_embeds = torch.stack(audio_embeds_list)  # (B, 16, 50, 384)
-                audio_embeds = audio_embeds.to(device, dtype=torch.float16)
-            else:
-                audio_embeds = None
+            with profiler.phase("audio"):
+                if config.model.add_audio_layer:
+                    if batch["mel"] != []:
+                        mel = batch["mel"].to(device, dtype=torch.float16)
+
+                    if "audio_embeds" in batch:
+                        # Extracted offline and cropped by the dataloader workers
+                        audio_embeds = batch["audio_embeds"]
+                    else:
+                        audio_embeds_list = []
+                        try:
+                            for idx in range(len(batch["video_path"])):
+                                video_path = batch["video_path"][idx]
+                                start_idx = batch["start_idx"][idx]
+
+                                with torch.no_grad():
+                                    audio_feat = audio_encoder.audio2feat(video_path)
+                                audio_embeds = audio_encoder.crop_overlap_audio_window(audio_feat, start_idx)
+                                audio_embeds_list.append(audio_embeds)
+                        except Exception as e:
+                            logger.info(f"{type(e).__name__} - {e} - {video_path}")
+                            continue
+                        audio_embeds = torch.stack(audio_embeds_list)  # (B, 16, 50, 384)
+                    audio_embeds = audio_embeds.to(device, dtype=torch.float16)
+                else:
+                    audio_embeds = None
 
-            # Convert videos to latent space
-            gt_pixel_values = batch["gt_pixel_values"].to(device, dtype=torch.float16)
-            masked_pixel_values = batch["masked_pixel_values"].to(device, dtype=torch.float16)
             masks = batch["masks"].to(device, dtype=torch.float16)
-            ref_pixel_values = batch["ref_pixel_values"].to(device, dtype=torch.float16)
-
-            gt_pixel_values = rearrange(gt_pixel_values, "b f c h w -> (b f) c h w")
-            masked_pixel_values = rearrange(masked_pixel_values, "b f c h w -> (b f) c h w")
             masks = rearrange(masks, "b f c h w -> (b f) c h w")
-            ref_pixel_values = rearrange(ref_pixel_values, "b f c h w -> (b f) c h w")
 
-            with torch.no_grad():
-                gt_latents = vae.encode(gt_pixel_values).latent_dist.sample()
-                masked_latents = vae.encode(masked_pixel_values).latent_dist.sample()
-                ref_latents = vae.encode(ref_pixel_values).latent_dist.sample()
+            with profiler.phase("latents"):
+                if "gt_latent_moments" in batch:
+                    # The latent distributions were encoded offline, only sampling them is left
+                    gt_latents, masked_latents, ref_latents = [
+                        sample_latent_moments(rearrange(batch[key].to(device), "b f c h w -> (b f) c h w"))
+                        for key in ["gt_latent_moments", "masked_latent_moments", "ref_latent_moments"]
+                    ]
+                    if config.run.pixel_space_supervise:
+                        gt_pixel_values = batch["gt_pixel_values"].to(device, dtype=torch.float16)
+                        gt_pixel_values = rearrange(gt_pixel_values, "b f c h w -> (b f) c h w")
+                else:
+                    # Convert videos to latent space
+                    gt_pixel_values = batch["gt_pixel_values"].to(device, dtype=torch.float16)
+                    masked_pixel_values = batch["masked_pixel_values"].to(device, dtype=torch.float16)
+                    ref_pixel_values = batch["ref_pixel_values"].to(device, dtype=torch.float16)
+
+                    gt_pixel_values = rearrange(gt_pixel_values, "b f c h w -> (b f) c h w")
+                    masked_pixel_values = rearrange(masked_pixel_values, "b f c h w -> (b f) c h w")
+                    ref_pixel_values = rearrange(ref_pixel_values, "b f c h w -> (b f) c h w")
+
+                    with torch.no_grad():
+                        gt_latents = vae.encode(gt_pixel_values).latent_dist.sample()
+                        masked_latents = vae.encode(masked_pixel_values).latent_dist.sample()
+                        ref_latents = vae.encode(ref_pixel_values).latent_dist.sample()
 
             masks = torch.nn.functional.interpolate(masks, size=config.data.resolution // vae_scale_factor)
 
@@ -333,8 +466,15 @@ def main(config):
 
             bsz = gt_latents.shape[0]
 
-            # Sample a random timestep for each video
-            timesteps = torch.randint(0, noise_scheduler.config.num_train_timesteps, (bsz,), device=gt_latents.device)
+            if distill:
+                # Sample one of the student timesteps for each video
+                step_indices = torch.randint(0, distill_config.student_steps, (bsz,), device=gt_latents.device)
+                timesteps = student_timesteps[step_indices]
+            else:
+                # Sample a random timestep for each video
+                timesteps = torch.randint(
+                    0, noise_scheduler.config.num_train_timesteps, (bsz,), device=gt_latents.device
+                )
             timesteps = timesteps.long()
 
             # Add noise to the latents according to the noise magnitude at each timestep
@@ -342,18 +482,56 @@ def main(config):
             noisy_gt_latents = noise_scheduler.add_noise(gt_latents, noise, timesteps)
 
             # Get the target for loss depending on the prediction type
-            if noise_scheduler.config.prediction_type == "epsilon":
-                target = noise
-            elif noise_scheduler.config.prediction_type == "v_prediction":
-                raise NotImplementedError
-            else:
+            if noise_scheduler.config.prediction_type != "epsilon":
+                if noise_scheduler.config.prediction_type == "v_prediction":
+                    raise NotImplementedError
                 raise ValueError(f"Unknown prediction type {noise_scheduler.config.prediction_type}")
+            if distill:
+                # Run the guided teacher from the student timestep to the next one, the target is the noise that
+                # makes a single DDIM step of the student land on the teacher's latents
+                with profiler.phase("teacher"), torch.no_grad():
+                    teacher_latents = noisy_gt_latents.float()
+                    for k in range(distill_config.teacher_steps_per_student_step):
+                        teacher_t = timesteps - k * teacher_step_ratio
+                        # Past the last timestep the trajectory has ended, DDIM lands on the clean latents there
+                        active = teacher_t >= 0
+                        if not active.any():
+                            break
+                        teacher_t = teacher_t.clamp(min=0)
+                        teacher_input = torch.cat([teacher_latents, masks, masked_latents, ref_latents], dim=1)
+                        teacher_input = torch.cat([teacher_input] * 2).to(dtype=torch.float16)
+                        if audio_embeds is not None:
+                            teacher_audio_embeds = torch.cat([torch.zeros_like(audio_embeds), audio_embeds])
+                        else:
+                            teacher_audio_embeds = None
+                        teacher_noise = teacher_unet(
+                            teacher_input, torch.cat([teacher_t] * 2), encoder_hidden_states=teacher_audio_embeds
+                        ).sample.float()
+                        noise_uncond, noise_audio = teacher_noise.chunk(2)
+                        teacher_noise = noise_uncond + distill_config.guidance_scale * (noise_audio - noise_uncond)
+                        next_teacher_latents = ddim_sampling_step(
+                            noise_scheduler, teacher_noise, teacher_t, teacher_t - teacher_step_ratio, teacher_latents
+                        )
+                        teacher_latents = torch.where(
+                            active[:, None, None, None, None], next_teacher_latents, teacher_latents
+                        )
+                    target = ddim_target_noise(
+                        noise_scheduler,
+                        noisy_gt_latents.float(),
+                        teacher_latents,
+                        timesteps,
+                        timesteps - student_step_ratio,
+                    )
+            else:
+                target = noise
 
             denoising_unet_input = torch.cat([noisy_gt_latents, masks, masked_latents, ref_latents], dim=1)
 
             # Predict the noise and compute loss
             # Mixed-precision training
-            with torch.autocast(device_type="cuda", dtype=torch.float16, enabled=config.run.mixed_precision_training):
+            with profiler.phase("unet_forward"), torch.autocast(
+                device_type="cuda", dtype=torch.float16, enabled=config.run.mixed_precision_training
+            ):
                 pred_noise = denoising_unet(denoising_unet_input, timesteps, encoder_hidden_states=audio_embeds).sample
 
             if config.run.recon_loss_weight != 0:
@@ -364,45 +542,55 @@ def main(config):
             pred_latents = one_step_sampling(noise_scheduler, pred_noise, timesteps, noisy_gt_latents)
 
             if config.run.pixel_space_supervise:
-                pred_pixel_values = vae.decode(
-                    rearrange(pred_latents, "b c f h w -> (b f) c h w") / vae.config.scaling_factor
-                    + vae.config.shift_factor
-                ).sample
+                with profiler.phase("vae_decode"):
+                    pred_pixel_values = vae.decode(
+                        rearrange(pred_latents, "b c f h w -> (b f) c h w") / vae.config.scaling_factor
+                        + vae.config.shift_factor
+                    ).sample
 
             if config.run.perceptual_loss_weight != 0 and config.run.pixel_space_supervise:
-                pred_pixel_values_perceptual = pred_pixel_values[:, :, pred_pixel_values.shape[2] // 2 :, :]
-                gt_pixel_values_perceptual = gt_pixel_values[:, :, gt_pixel_values.shape[2] // 2 :, :]
-                lpips_loss = lpips_loss_func(
-                    pred_pixel_values_perceptual.float(), gt_pixel_values_perceptual.float()
-                ).mean()
+                with profiler.phase("lpips"):
+                    pred_pixel_values_perceptual = pred_pixel_values[:, :, pred_pixel_values.shape[2] // 2 :, :]
+                    gt_pixel_values_perceptual = gt_pixel_values[:, :, gt_pixel_values.shape[2] // 2 :, :]
+                    lpips_loss = lpips_loss_func(
+                        pred_pixel_values_perceptual.float(), gt_pixel_values_perceptual.float()
+                    ).mean()
             else:
                 lpips_loss = 0
 
             if config.run.trepa_loss_weight != 0 and config.run.pixel_space_supervise:
-                trepa_pred_pixel_values = rearrange(
-                    pred_pixel_values, "(b f) c h w -> b c f h w", f=config.data.num_frames
-                )
-                trepa_gt_pixel_values = rearrange(
-                    gt_pixel_values, "(b f) c h w -> b c f h w", f=config.data.num_frames
-                )
-                trepa_loss = trepa_loss_func(trepa_pred_pixel_values, trepa_gt_pixel_values)
+                with profiler.phase("trepa"):
+                    trepa_pred_pixel_values = rearrange(
+                        pred_pixel_values, "(b f) c h w -> b c f h w", f=config.data.num_frames
+                    )
+                    trepa_gt_pixel_values = rearrange(
+                        gt_pixel_values, "(b f) c h w -> b c f h w", f=config.data.num_frames
+                    )
+                    if trepa_feature_cache is not None:
+                        trepa_gt_feats = trepa_feature_cache.features(
+                            trepa_loss_func, batch["video_path"], batch["start_idx"], trepa_gt_pixel_values
+                        )
+                        trepa_loss = trepa_loss_func(trepa_pred_pixel_values, feats_real=trepa_gt_feats)
+                    else:
+                        trepa_loss = trepa_loss_func(trepa_pred_pixel_values, trepa_gt_pixel_values)
             else:
                 trepa_loss = 0
 
             if config.model.add_audio_layer and config.run.use_syncnet:
-                if config.run.pixel_space_supervise:
-                    syncnet_input = rearrange(
-                        pred_pixel_values, "(b f) c h w -> b (f c) h w", f=config.data.num_frames
-                    )
-                else:
-                    syncnet_input = rearrange(pred_latents, "b c f h w -> b (f c) h w")
-
-                if syncnet_config.data.lower_half:
-                    height = syncnet_input.shape[2]
-                    syncnet_input = syncnet_input[:, :, height // 2 :, :]
-                ones_tensor = torch.ones((config.data.batch_size, 1)).float().to(device=device)
-                vision_embeds, audio_embeds = syncnet(syncnet_input, mel)
-                sync_loss = cosine_loss(vision_embeds.float(), audio_embeds.float(), ones_tensor).mean()
+                with profiler.phase("syncnet"):
+                    if config.run.pixel_space_supervise:
+                        syncnet_input = rearrange(
+                            pred_pixel_values, "(b f) c h w -> b (f c) h w", f=config.data.num_frames
+                        )
+                    else:
+                        syncnet_input = rearrange(pred_latents, "b c f h w -> b (f c) h w")
+
+                    if syncnet_config.data.lower_half:
+                        height = syncnet_input.shape[2]
+                        syncnet_input = syncnet_input[:, :, height // 2 :, :]
+                    ones_tensor = torch.ones((config.data.batch_size, 1)).float().to(device=device)
+                    vision_embeds, audio_embeds = syncnet(syncnet_input, mel)
+                    sync_loss = cosine_loss(vision_embeds.float(), audio_embeds.float(), ones_tensor).mean()
             else:
                 sync_loss = 0
 
@@ -419,19 +607,23 @@ def main(config):
 
             # Backpropagate
             if config.run.mixed_precision_training:
-                scaler.scale(loss).backward()
-                """ >>> gradient clipping >>> """
-                scaler.unscale_(optimizer)
-                torch.nn.utils.clip_grad_norm_(trainable_params, config.optimizer.max_grad_norm)
-                """ <<< gradient clipping <<< """
-                scaler.step(optimizer)
-                scaler.update()
+                with profiler.phase("backward"):
+                    scaler.scale(loss).backward()
+                with profiler.phase("optimizer"):
+                    """ >>> gradient clipping >>> """
+                    scaler.unscale_(optimizer)
+                    torch.nn.utils.clip_grad_norm_(trainable_params, config.optimizer.max_grad_norm)
+                    """ <<< gradient clipping <<< """
+                    scaler.step(optimizer)
+                    scaler.update()
             else:
-                loss.backward()
-                """ >>> gradient clipping >>> """
-                torch.nn.utils.clip_grad_norm_(trainable_params, config.optimizer.max_grad_norm)
-                """ <<< gradient clipping <<< """
-                optimizer.step()
+                with profiler.phase("backward"):
+                    loss.backward()
+                with profiler.phase("optimizer"):
+                    """ >>> gradient clipping >>> """
+                    torch.nn.utils.clip_grad_norm_(trainable_params, config.optimizer.max_grad_norm)
+                    """ <<< gradient clipping <<< """
+                    optimizer.step()
 
             # Check the grad of attn blocks for debugging
             # print(denoising_unet.module.up_blocks[3].attentions[2].transformer_blocks[0].attn2.to_q.weight.grad)
@@ -439,6 +631,7 @@ def main(config):
             lr_scheduler.step()
             progress_bar.update(1)
             global_step += 1
+            profiler.end_step(global_step)
 
             ### <<<< Training <<<< ###
 
@@ -449,49 +642,66 @@ def main(config):
                     "global_step": global_step,
                     "state_dict": denoising_unet.module.state_dict(),
                 }
+                if distill:
+                    state_dict["distill_steps"] = distill_config.student_steps
+                checkpoint_saved = False
                 try:
                     torch.save(state_dict, model_save_path)
                     logger.info(f"Saved checkpoint to {model_save_path}")
+                    checkpoint_saved = True
                 except Exception as e:
                     logger.error(f"Error saving model: {e}")
 
-                # Validation
-                logger.info("Running validation... ")
-
                 validation_video_out_path = os.path.join(output_dir, f"val_videos/val_video_{global_step}.mp4")
                 validation_video_mask_path = os.path.join(output_dir, f"val_videos/val_video_mask.mp4")
 
-                with torch.autocast(device_type="cuda", dtype=torch.float16):
-                    pipeline(
-                        config.data.val_video_path,
-                        config.data.val_audio_path,
-                        validation_video_out_path,
-                        validation_video_mask_path,
-                        num_frames=config.data.num_frames,
-                        num_inference_steps=config.run.inference_steps,
-                        guidance_scale=config.run.guidance_scale,
-                        weight_dtype=torch.float16,
-                        width=config.data.resolution,
-                        height=config.data.resolution,
-                        mask=config.data.mask,
-                        mask_image_path=config.data.mask_image_path,
-                    )
-
-                logger.info(f"Saved validation video output to {validation_video_out_path}")
-
-                val_step_list.append(global_step)
-
-                if config.model.add_audio_layer and os.path.exists(validation_video_out_path):
-                    try:
-                        _, conf = syncnet_eval(syncnet_eval_model, syncnet_detector, validation_video_out_path, "temp")
-                    except Exception as e:
-                        logger.info(e)
-                        conf = 0
-                    sync_conf_list.append(conf)
-                    plot_loss_chart(
-                        os.path.join(output_dir, f"sync_conf_results/sync_conf_chart-{global_step}.png"),
-                        ("Sync confidence", val_step_list, sync_conf_list),
-                    )
+                if async_validator is not None:
+                    # The training goes on, the result is picked up by the poll below once it is there
+                    if not checkpoint_saved:
+                        logger.info(f"Skipped the validation of step {global_step}, the checkpoint was not saved")
+                    elif not async_validator.is_alive():
+                        logger.error(
+                            f"Skipped the validation of step {global_step}, the validation process died "
+                            f"(exit code {async_validator.process.exitcode})"
+                        )
+                    elif async_validator.submit(
+                        global_step, model_save_path, validation_video_out_path, validation_video_mask_path
+                    ):
+                        logger.info(f"Handed the validation of step {global_step} to the validation process")
+                    else:
+                        logger.info(f"Skipped the validation of step {global_step}, the validation process is busy")
+                else:
+                    # Validation
+                    logger.info("Running validation... ")
+
+                    with torch.autocast(device_type="cuda", dtype=torch.float16):
+                        pipeline(
+                            config.data.val_video_path,
+                            config.data.val_audio_path,
+                            validation_video_out_path,
+                            validation_video_mask_path,
+                            **validation_kwargs(config),
+                        )
+
+                    logger.info(f"Saved validation video output to {validation_video_out_path}")
+
+                    val_step_list.append(global_step)
+
+                    if config.model.add_audio_layer and os.path.exists(validation_video_out_path):
+                        try:
+                            _, conf = syncnet_eval(syncnet_eval_model, syncnet_detector, validation_video_out_path)
+                        except Exception as e:
+                            logger.info(e)
+                            conf = 0
+                        sync_conf_list.append(conf)
+                        plot_loss_chart(
+                            os.path.join(output_dir, f"sync_conf_results/sync_conf_chart-{global_step}.png"),
+                            ("Sync confidence", val_step_list, sync_conf_list),
+                        )
+
+            if async_validator is not None:
+                for result in async_validator.poll():
+                    log_validation_result(result, config, output_dir, val_step_list, sync_conf_list)
 
             logs = {"step_loss": loss.item(), "lr": lr_scheduler.get_last_lr()[0]}
             progress_bar.set_postfix(**logs)
@@ -499,6 +709,11 @@ def main(config):
             if global_step >= config.run.max_train_steps:
                 break
 
+    if async_validator is not None:
+        logger.info("Waiting for the pending validations...")
+        for result in async_validator.close():
+            log_validation_result(result, config, output_dir, val_step_list, sync_conf_list)
+
     progress_bar.close()
     dist.destroy_process_group()
 
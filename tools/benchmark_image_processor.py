@@ -0,0 +1,85 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compare the frames/s of `ImageProcessor.prepare_masks_and_masked_images` frame by frame and batched.
+
+Random uint8 frames are processed with the fixed and half masks. The batched path also runs on the GPU when there is
+one, its results are checked against the per-frame ones:
+
+    python -m tools.benchmark_image_processor --num_frames 16 --input_size 512 --resolution 256
+"""
+
+import argparse
+import time
+
+import torch
+
+from latentsync.utils.image_processor import ImageProcessor
+
+
+def prepare_per_frame(image_processor: ImageProcessor, images: torch.Tensor):
+    """The former path: one resize, normalize and mask multiplication per frame, then three stacks."""
+    if image_processor.mask == "fix_mask":
+        results = [image_processor.preprocess_fixed_mask_image(image) for image in images]
+    else:
+        results = [image_processor.preprocess_one_masked_image(image) for image in images]
+    pixel_values_list, masked_pixel_values_list, masks_list = list(zip(*results))
+    return torch.stack(pixel_values_list), torch.stack(masked_pixel_values_list), torch.stack(masks_list)
+
+
+def frames_per_second(function, images: torch.Tensor, repeats: int):
+    function(images)  # Warm-up, also allocates the mask of the batched path
+    if images.is_cuda:
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function(images)
+    if images.is_cuda:
+        torch.cuda.synchronize()
+    return repeats * len(images) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_frames", type=int, default=16)
+    parser.add_argument("--input_size", type=int, default=512, help="Height and width of the input frames")
+    parser.add_argument("--resolution", type=int, default=256)
+    parser.add_argument("--masks", type=str, nargs="+", default=["fix_mask", "half"])
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    devices = ["cpu"] + (["cuda"] if torch.cuda.is_available() else [])
+    images = torch.randint(0, 256, (args.num_frames, 3, args.input_size, args.input_size), dtype=torch.uint8)
+
+    for mask in args.masks:
+        image_processor = ImageProcessor(args.resolution, mask)
+        # The former path only ran on the CPU, which is where the datasets and the pipeline called it
+        expected = prepare_per_frame(image_processor, images)
+        per_frame = frames_per_second(lambda x: prepare_per_frame(image_processor, x), images, args.repeats)
+        print(f"{mask}, {args.num_frames} x {args.input_size} px -> {args.resolution} px")
+        print(f"  per-frame, cpu: {per_frame:.0f} frames/s")
+
+        for device in devices:
+            device_images = images.to(device)
+            actual = image_processor.prepare_masks_and_masked_images(device_images)
+            max_diff = max((a.cpu().double() - e.double()).abs().max().item() for a, e in zip(actual, expected))
+            batched = frames_per_second(image_processor.prepare_masks_and_masked_images, device_images, args.repeats)
+            print(
+                f"  batched, {device}: {batched:.0f} frames/s ({batched / per_frame:.1f}x), "
+                f"max abs diff {max_diff:.2e}"
+            )
+
+
+if __name__ == "__main__":
+    main()
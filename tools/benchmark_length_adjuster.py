@@ -0,0 +1,87 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from latentsync.utils.length_adjust import LENGTH_ADJUST_MODES, adjust_video_length, length_adjust_indices, probe_video
+import torchaudio
+
+
+def make_inputs(temp_dir: str, video_sec: float, audio_sec: float, resolution: str, fps: float):
+    video_path = os.path.join(temp_dir, "input.mp4")
+    audio_path = os.path.join(temp_dir, "input.wav")
+    command = f"ffmpeg -y -loglevel error -f lavfi -i testsrc2=size={resolution}:rate={fps}:duration={video_sec} -c:v libx264 -pix_fmt yuv420p {video_path}"
+    subprocess.run(command, shell=True, check=True)
+    command = f"ffmpeg -y -loglevel error -f lavfi -i sine=frequency=440:sample_rate=16000:duration={audio_sec} {audio_path}"
+    subprocess.run(command, shell=True, check=True)
+    return video_path, audio_path
+
+
+def legacy_adjust(video_path, audio_path, output_video_path, mode, fps, silent_padding_sec, temp_dir):
+    # The previous implementation: every frame goes through PNG files twice and the pingpong lookup is O(n^2)
+    original_fps, _, _, _ = probe_video(video_path)
+    frames_dir = os.path.join(temp_dir, "frames")
+    adjusted_frames_dir = os.path.join(temp_dir, "adjusted_frames")
+    os.makedirs(frames_dir, exist_ok=True)
+    os.makedirs(adjusted_frames_dir, exist_ok=True)
+    command = f"ffmpeg -y -loglevel error -i {video_path} -r {original_fps} {os.path.join(frames_dir, 'frame%04d.png')}"
+    subprocess.run(command, shell=True, check=True)
+    frame_files = sorted(os.listdir(frames_dir))
+
+    waveform, sample_rate = torchaudio.load(audio_path)
+    frame_indices, _ = length_adjust_indices(
+        len(frame_files), waveform.shape[1], sample_rate, mode, fps, silent_padding_sec
+    )
+    for i, index in enumerate(frame_indices):
+        frame = frame_files[index]
+        source_frame = os.path.join(frames_dir, frame_files[frame_files.index(frame)])
+        shutil.copy2(source_frame, os.path.join(adjusted_frames_dir, f"adjusted_frame{i:04d}.png"))
+
+    command = f"ffmpeg -y -loglevel error -r {fps} -i {os.path.join(adjusted_frames_dir, 'adjusted_frame%04d.png')} -i {audio_path} -c:v libx264 -pix_fmt yuv420p -c:a aac {output_video_path}"
+    subprocess.run(command, shell=True, check=True)
+
+
+def benchmark(video_sec: float, audio_sec: float, resolution: str, fps: float, silent_padding_sec: float):
+    for mode in LENGTH_ADJUST_MODES:
+        timings = {}
+        for name, adjust in [("legacy", legacy_adjust), ("single_pass", adjust_video_length)]:
+            with tempfile.TemporaryDirectory() as temp_dir:
+                video_path, audio_path = make_inputs(temp_dir, video_sec, audio_sec, resolution, fps)
+                output_video_path = os.path.join(temp_dir, "output.mp4")
+                start = time.perf_counter()
+                adjust(video_path, audio_path, output_video_path, mode, fps, silent_padding_sec, temp_dir)
+                timings[name] = time.perf_counter() - start
+                _, _, _, num_frames = probe_video(output_video_path)
+                timings[f"{name}_frames"] = num_frames
+        print(
+            f"{mode}: legacy {timings['legacy']:.2f} s ({timings['legacy_frames']} frames), "
+            f"single pass {timings['single_pass']:.2f} s ({timings['single_pass_frames']} frames), "
+            f"speedup {timings['legacy'] / timings['single_pass']:.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the length adjuster against the previous PNG based one")
+    parser.add_argument("--video_sec", type=float, default=20)
+    parser.add_argument("--audio_sec", type=float, default=60)
+    parser.add_argument("--resolution", type=str, default="1280x720")
+    parser.add_argument("--fps", type=float, default=25)
+    parser.add_argument("--silent_padding_sec", type=float, default=0.5)
+    args = parser.parse_args()
+
+    benchmark(args.video_sec, args.audio_sec, args.resolution, args.fps, args.silent_padding_sec)
@@ -0,0 +1,68 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Time what ComfyUI pays at boot for this extension: importing nodes.py and building every node.
+
+Run it on two checkouts (or pass --nodes_path of an older nodes.py) to compare before and after. Each repeat runs in
+a fresh interpreter, so module caches do not hide the import cost.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+STARTUP_SNIPPET = """
+import importlib.util, json, os, sys, time
+sys.path[:0] = {sys_path!r}
+tmpdir = os.environ.get("TMPDIR")
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location("latentsync_nodes", {nodes_path!r})
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+import_time = time.perf_counter() - start
+for node_class in module.NODE_CLASS_MAPPINGS.values():
+    node_class.INPUT_TYPES()
+    node_class()
+total_time = time.perf_counter() - start
+heavy = [name for name in ("torch", "diffusers", "face_alignment", "mediapipe") if name in sys.modules]
+print(json.dumps({{"import_time": import_time, "total_time": total_time, "heavy_modules": heavy,
+                  "tmpdir_changed": os.environ.get("TMPDIR") != tmpdir}}))
+"""
+
+
+def measure(nodes_path: str, comfyui_dir: str):
+    sys_path = [os.path.dirname(nodes_path)] + ([comfyui_dir] if comfyui_dir else [])
+    snippet = STARTUP_SNIPPET.format(sys_path=sys_path, nodes_path=nodes_path)
+    output = subprocess.run([sys.executable, "-c", snippet], capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--nodes_path", type=str, default=os.path.join(os.path.dirname(os.path.dirname(__file__)), "nodes.py")
+    )
+    parser.add_argument("--comfyui_dir", type=str, default="", help="Needed by versions that import folder_paths")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    results = [measure(os.path.abspath(args.nodes_path), args.comfyui_dir) for _ in range(args.repeats)]
+    import_time = statistics.median(result["import_time"] for result in results)
+    total_time = statistics.median(result["total_time"] for result in results)
+    print(f"{args.nodes_path}: import {import_time * 1000:.0f} ms, with node construction {total_time * 1000:.0f} ms")
+    print(f"Heavy modules loaded at startup: {results[-1]['heavy_modules']}")
+    print(f"TMPDIR rewritten: {results[-1]['tmpdir_changed']}")
@@ -0,0 +1,81 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Time `read_video` against the former path, which re-encoded every input to a 25 fps H.264 file before decoding it.
+
+Synthetic 1080p clips are generated at 25 fps (decoded as is now) and 30 fps (resampled while decoding now):
+
+    python -m tools.benchmark_read_video --seconds 10 --repeats 3
+"""
+
+import argparse
+import os
+import subprocess
+import tempfile
+import time
+
+from latentsync.utils.util import read_video, read_video_cv2, read_video_decord
+
+
+def read_video_reencode(video_path: str, temp_dir: str, use_decord=True):
+    """The former `read_video`: `ffmpeg -r 25 -crf 18` to a temporary file, then decode that file."""
+    temp_video_path = os.path.join(temp_dir, "video.mp4")
+    command = f"ffmpeg -loglevel error -y -nostdin -i {video_path} -r 25 -crf 18 {temp_video_path}"
+    subprocess.run(command, shell=True, check=True)
+    return read_video_decord(temp_video_path) if use_decord else read_video_cv2(temp_video_path)
+
+
+def generate_clip(video_path: str, fps: int, seconds: float, size: str):
+    command = ["ffmpeg", "-loglevel", "error", "-y", "-nostdin", "-f", "lavfi"]
+    command += ["-i", f"testsrc2=size={size}:rate={fps}:duration={seconds}"]
+    command += ["-c:v", "libx264", "-pix_fmt", "yuv420p", "-crf", "18", video_path]
+    subprocess.run(command, check=True)
+
+
+def best_of(function, repeats: int):
+    best, frames = float("inf"), None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        frames = function()
+        best = min(best, time.perf_counter() - start)
+    return best, frames
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--size", type=str, default="1920x1080")
+    parser.add_argument("--fps", type=int, nargs="+", default=[25, 30])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--use_decord", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="benchmark_read_video_") as temp_dir:
+        for fps in args.fps:
+            video_path = os.path.join(temp_dir, f"clip_{fps}fps.mp4")
+            generate_clip(video_path, fps, args.seconds, args.size)
+
+            legacy_sec, legacy_frames = best_of(
+                lambda: read_video_reencode(video_path, temp_dir, args.use_decord), args.repeats
+            )
+            new_sec, new_frames = best_of(lambda: read_video(video_path, use_decord=args.use_decord), args.repeats)
+            print(
+                f"{fps} fps, {args.size}, {args.seconds:g} s: re-encode {legacy_sec:.2f} s "
+                f"({len(legacy_frames)} frames), read_video {new_sec:.2f} s ({len(new_frames)} frames), "
+                f"{legacy_sec / new_sec:.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compare the samples/s of the per-file training datasets with the streamed shards of `preprocess.pack_shards`.
+
+Both run through a DataLoader with the training settings of the config, on the same machine and storage:
+
+    python -m tools.benchmark_shard_dataset --config_path configs/unet/stage2.yaml --shards_dir <shards_dir>
+    python -m tools.benchmark_shard_dataset --config_path configs/syncnet/syncnet_16_pixel_attn.yaml \\
+        --shards_dir <shards_dir> --dataset syncnet
+"""
+
+import argparse
+import time
+
+import torch
+from omegaconf import OmegaConf
+
+from latentsync.data.shard_dataset import ShardedClipDataset
+from latentsync.data.syncnet_dataset import SyncNetDataset
+from latentsync.data.unet_dataset import UNetDataset
+
+
+def build_dataset(config, dataset_type, from_shards):
+    if dataset_type == "unet":
+        return UNetDataset(config.data.train_data_dir, config, from_shards=from_shards)
+    return SyncNetDataset(config.data.train_data_dir, config.data.train_fileslist, config, from_shards=from_shards)
+
+
+def samples_per_second(dataset, batch_size, num_workers, num_batches, num_warmup_batches):
+    if num_workers == 0:
+        dataset.worker_init_fn(0)
+    dataloader = torch.utils.data.DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=False,
+        num_workers=num_workers,
+        pin_memory=False,
+        drop_last=True,
+        worker_init_fn=dataset.worker_init_fn,
+    )
+    iterator = iter(dataloader)
+    # The first batches include the worker start-up and, for the shards, filling the shuffle buffers
+    for _ in range(num_warmup_batches):
+        next(iterator)
+    start = time.perf_counter()
+    for _ in range(num_batches):
+        next(iterator)
+    return num_batches * batch_size / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config_path", type=str, default="configs/unet/stage2.yaml")
+    parser.add_argument("--shards_dir", type=str, required=True)
+    parser.add_argument("--dataset", type=str, default="unet", choices=["unet", "syncnet"])
+    parser.add_argument("--batch_size", type=int, default=None, help="Defaults to data.batch_size of the config")
+    parser.add_argument("--num_workers", type=int, default=None, help="Defaults to data.num_workers of the config")
+    parser.add_argument("--num_batches", type=int, default=50)
+    parser.add_argument("--num_warmup_batches", type=int, default=5)
+    parser.add_argument("--buffer_size", type=int, default=100)
+    args = parser.parse_args()
+
+    config = OmegaConf.load(args.config_path)
+    batch_size = args.batch_size or config.data.batch_size
+    num_workers = args.num_workers if args.num_workers is not None else config.data.num_workers
+
+    per_file = samples_per_second(
+        build_dataset(config, args.dataset, from_shards=False),
+        batch_size,
+        num_workers,
+        args.num_batches,
+        args.num_warmup_batches,
+    )
+    print(f"Per-file {args.dataset} dataset: {per_file:.1f} samples/s")
+
+    sharded_dataset = ShardedClipDataset(
+        args.shards_dir, build_dataset(config, args.dataset, from_shards=True), buffer_size=args.buffer_size
+    )
+    sharded = samples_per_second(
+        sharded_dataset, batch_size, num_workers, args.num_batches, args.num_warmup_batches
+    )
+    print(f"Sharded {args.dataset} dataset: {sharded:.1f} samples/s ({sharded / per_file:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import time
+from omegaconf import OmegaConf
+import torch
+from torch.profiler import profile, ProfilerActivity
+from latentsync.models.unet import UNet3DConditionModel
+
+
+def count_ops(unet, inputs, timestep, audio_embeds):
+    # Allocations and copies of one forward, counted from the profiler so it works on CPU as well as CUDA
+    with profile(activities=[ProfilerActivity.CPU]) as prof:
+        unet(inputs, timestep, encoder_hidden_states=audio_embeds)
+    counts = {"allocations": 0, "copies": 0}
+    for event in prof.key_averages():
+        if event.key in ("aten::empty", "aten::empty_strided", "aten::empty_like"):
+            counts["allocations"] += event.count
+        elif event.key in ("aten::copy_", "aten::clone", "aten::contiguous"):
+            counts["copies"] += event.count
+    return counts
+
+
+def time_steps(unet, inputs, timestep, audio_embeds, num_steps, device):
+    for _ in range(2):
+        unet(inputs, timestep, encoder_hidden_states=audio_embeds)
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(num_steps):
+        unet(inputs, timestep, encoder_hidden_states=audio_embeds)
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / num_steps
+
+
+@torch.no_grad()
+def main(args):
+    device = torch.device(args.device)
+    dtype = getattr(torch, args.dtype)
+    config = OmegaConf.load(args.unet_config_path)
+    unet, _ = UNet3DConditionModel.from_pretrained(
+        OmegaConf.to_container(config.model), args.ckpt_path, device=device, dtype=dtype
+    )
+    unet.eval()
+
+    latent_size = config.data.resolution // 8
+    inputs = torch.randn(
+        args.batch_size, config.model.in_channels, config.data.num_frames, latent_size, latent_size
+    ).to(device, dtype)
+    audio_embeds = torch.randn(args.batch_size, config.data.num_frames, 50, config.model.cross_attention_dim).to(
+        device, dtype
+    )
+    timestep = torch.tensor(500, device=device)
+
+    results = {}
+    outputs = {}
+    for mode in ("default", "folded"):
+        if mode == "folded":
+            unet.enable_folded_layout(channels_last=not args.no_channels_last)
+        outputs[mode] = unet(inputs, timestep, encoder_hidden_states=audio_embeds).sample.float()
+        counts = count_ops(unet, inputs, timestep, audio_embeds)
+        latency = time_steps(unet, inputs, timestep, audio_embeds, args.num_steps, device)
+        results[mode] = (counts, latency)
+        print(
+            f"{mode:>8}: {latency * 1000:.1f} ms/step, "
+            f"{counts['allocations']} allocations, {counts['copies']} copies per forward"
+        )
+
+    max_diff = (outputs["default"] - outputs["folded"]).abs().max().item()
+    print(f"Max abs difference between layouts: {max_diff:.3e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--unet_config_path", type=str, default="configs/unet/stage2.yaml")
+    parser.add_argument("--ckpt_path", type=str, default="")
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--dtype", type=str, default="float16" if torch.cuda.is_available() else "float32")
+    parser.add_argument("--batch_size", type=int, default=2, help="2 matches classifier-free guidance")
+    parser.add_argument("--num_steps", type=int, default=10)
+    parser.add_argument("--no_channels_last", action="store_true")
+    args = parser.parse_args()
+
+    main(args)
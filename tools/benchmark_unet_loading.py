@@ -0,0 +1,77 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+from omegaconf import OmegaConf
+import torch
+from latentsync.models.unet import UNet3DConditionModel
+
+
+def load_once(unet_config_path: str, ckpt_path: str, device: str, dtype: str):
+    # Run in a fresh interpreter so that ru_maxrss only covers this loading path
+    config = OmegaConf.load(unet_config_path)
+    start = time.perf_counter()
+    unet, _ = UNet3DConditionModel.from_pretrained(
+        OmegaConf.to_container(config.model), ckpt_path, device=device, dtype=getattr(torch, dtype)
+    )
+    if device.startswith("cuda"):
+        torch.cuda.synchronize()
+    load_time = time.perf_counter() - start
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({"ckpt_path": ckpt_path, "load_time": load_time, "peak_rss_mb": peak_rss_mb}))
+
+
+def benchmark(unet_config_path: str, ckpt_paths: list, device: str, dtype: str):
+    for ckpt_path in ckpt_paths:
+        command = [
+            sys.executable,
+            "-m",
+            "tools.benchmark_unet_loading",
+            "--unet_config_path",
+            unet_config_path,
+            "--device",
+            device,
+            "--dtype",
+            dtype,
+            "--single",
+            ckpt_path,
+        ]
+        output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{ckpt_path}: load time {result['load_time']:.2f} s, peak RSS {result['peak_rss_mb']:.0f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--unet_config_path", type=str, default="configs/unet/stage2.yaml")
+    parser.add_argument(
+        "--ckpt_paths",
+        type=str,
+        nargs="+",
+        default=["checkpoints/latentsync_unet.pt", "checkpoints/latentsync_unet.safetensors"],
+    )
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--dtype", type=str, default="float16")
+    parser.add_argument("--single", type=str, default=None)
+    args = parser.parse_args()
+
+    if args.single is not None:
+        load_once(args.unet_config_path, args.single, args.device, args.dtype)
+    else:
+        benchmark(args.unet_config_path, args.ckpt_paths, args.device, args.dtype)
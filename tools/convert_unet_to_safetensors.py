@@ -0,0 +1,44 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import os
+import torch
+from safetensors.torch import save_file
+
+
+def convert_unet_to_safetensors(ckpt_path: str, output_path: str, dtype: str = None):
+    ckpt = torch.load(ckpt_path, map_location="cpu", weights_only=True)
+    state_dict = ckpt["state_dict"]
+    if dtype is not None:
+        dtype = getattr(torch, dtype)
+        state_dict = {k: v.to(dtype) if v.is_floating_point() else v for k, v in state_dict.items()}
+
+    # safetensors refuses shared or non-contiguous storage
+    state_dict = {k: v.contiguous() for k, v in state_dict.items()}
+    metadata = {"global_step": str(ckpt.get("global_step", 0))}
+
+    save_file(state_dict, output_path, metadata=metadata)
+    print(f"Saved {len(state_dict)} tensors to {output_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ckpt_path", type=str, default="checkpoints/latentsync_unet.pt")
+    parser.add_argument("--output_path", type=str, default=None)
+    parser.add_argument("--dtype", type=str, default=None, choices=["float16", "bfloat16", "float32"])
+    args = parser.parse_args()
+
+    output_path = args.output_path or os.path.splitext(args.ckpt_path)[0] + ".safetensors"
+    convert_unet_to_safetensors(args.ckpt_path, output_path, args.dtype)
@@ -0,0 +1,111 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Run several lipsync jobs (and optionally SyncNet evaluations) at the same time in one process, from the same
+working directory, and check that none of them disturbs the others.
+
+One job runs alone first as the reference, then `--num_jobs` jobs run in threads. Every concurrent output must decode
+to exactly the reference frames. CPU is the default so it runs anywhere; use few steps to keep it short.
+
+    python -m tools.stress_concurrent_jobs --inference_ckpt_path checkpoints/latentsync_unet.pt \\
+        --video_path assets/demo1_video.mp4 --audio_path assets/demo1_audio.wav --num_jobs 4 --inference_steps 2
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from omegaconf import OmegaConf
+
+from latentsync.utils.util import read_video
+from scripts.inference import load_pipeline, pipeline_call_kwargs
+
+
+def run_job(pipeline, config, args, policy, video_out_path):
+    start = time.perf_counter()
+    pipeline.for_job()(
+        video_path=args.video_path,
+        audio_path=args.audio_path,
+        video_out_path=video_out_path,
+        seed=args.seed,
+        **pipeline_call_kwargs(config, args, policy),
+    )
+    return time.perf_counter() - start
+
+
+def run_syncnet_eval(syncnet, syncnet_detector, video_path):
+    from eval.eval_sync_conf import syncnet_eval
+
+    return syncnet_eval(syncnet, syncnet_detector, video_path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--unet_config_path", type=str, default="configs/unet/stage2.yaml")
+    parser.add_argument("--inference_ckpt_path", type=str, required=True)
+    parser.add_argument("--video_path", type=str, required=True)
+    parser.add_argument("--audio_path", type=str, required=True)
+    parser.add_argument("--output_dir", type=str, default="stress_concurrent_jobs")
+    parser.add_argument("--num_jobs", type=int, default=3)
+    parser.add_argument("--inference_steps", type=int, default=2)
+    parser.add_argument("--guidance_scale", type=float, default=1.5)
+    parser.add_argument("--seed", type=int, default=1247)
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--syncnet_ckpt_path", type=str, default=None, help="Also evaluate the outputs concurrently")
+    args = parser.parse_args()
+
+    config = OmegaConf.load(args.unet_config_path)
+    os.makedirs(args.output_dir, exist_ok=True)
+    pipeline, policy = load_pipeline(config, args)
+
+    reference_path = os.path.join(args.output_dir, "reference.mp4")
+    seconds = run_job(pipeline, config, args, policy, reference_path)
+    print(f"Reference job: {seconds:.1f} s")
+    reference_frames = read_video(reference_path, change_fps=False, use_decord=False)
+
+    video_out_paths = [os.path.join(args.output_dir, f"job_{index}.mp4") for index in range(args.num_jobs)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.num_jobs) as pool:
+        job_seconds = list(pool.map(lambda path: run_job(pipeline, config, args, policy, path), video_out_paths))
+    print(f"{args.num_jobs} concurrent jobs: {time.perf_counter() - start:.1f} s wall, {max(job_seconds):.1f} s slowest")
+
+    failures = []
+    for video_out_path in video_out_paths:
+        frames = read_video(video_out_path, change_fps=False, use_decord=False)
+        if frames.shape != reference_frames.shape or not np.array_equal(frames, reference_frames):
+            failures.append(video_out_path)
+
+    if args.syncnet_ckpt_path is not None:
+        from eval.syncnet import SyncNetEval
+        from eval.syncnet_detect import SyncNetDetector
+
+        syncnet = SyncNetEval(device=policy.device.type)
+        syncnet.loadParameters(args.syncnet_ckpt_path)
+        syncnet_detector = SyncNetDetector(device=policy.device.type)
+        reference_result = run_syncnet_eval(syncnet, syncnet_detector, reference_path)
+        with ThreadPoolExecutor(max_workers=args.num_jobs) as pool:
+            results = list(
+                pool.map(lambda path: run_syncnet_eval(syncnet, syncnet_detector, path), video_out_paths)
+            )
+        failures += [path for path, result in zip(video_out_paths, results) if result != reference_result]
+
+    if failures:
+        raise RuntimeError(f"Outputs differ from the reference run: {failures}")
+    print(f"All {args.num_jobs} concurrent outputs match the reference")
+
+
+if __name__ == "__main__":
+    main()